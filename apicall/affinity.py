@@ -0,0 +1,101 @@
+""" Persistent endpoint affinity cache.
+
+最後に接続に成功したエンドポイントを設定ファイルの隣に記録し、
+次回以降の呼び出しではそのエンドポイントを最初に試す。
+"""
+import time
+import typing
+import urllib.parse
+from . import statefile
+
+DEFAULT_TTL = 3600.0
+
+
+def _prefix(endpoint: str) -> str:
+    """ Returns the prefix of urls built from the endpoint by urlutils.concat_urls(). """
+    e = urllib.parse.urlsplit(endpoint, scheme='http')
+    return urllib.parse.urlunsplit(
+        (e.scheme, e.netloc or 'localhost', e.path.rstrip('/') + '/', '', ''))
+
+
+class AffinityCache:
+    """ Remembers the endpoint that succeeded last time.
+
+    The cache entry is ignored when it is older than `ttl` seconds or when it was
+    recorded for another endpoint list.
+
+    :ivar path: Path to the cache file.
+    :ivar endpoints: The current endpoint list.
+    :ivar ttl: Lifetime of the cache entry in seconds.
+    """
+
+    def __init__(self,
+                 path: str,
+                 endpoints: typing.Tuple[str, ...],
+                 ttl: float = DEFAULT_TTL):
+        self.path = path
+        self.endpoints = endpoints
+        self.ttl = ttl
+
+    def _read(self) -> typing.Optional[dict]:
+        entry = statefile.read(self.path)
+        if entry is None:
+            return None
+        if tuple(entry.get('endpoints', ())) != self.endpoints:
+            # The endpoint list was changed.
+            return None
+        if time.time() - entry.get('updated', 0) > self.ttl:
+            # Expired.
+            return None
+        return entry
+
+    def preferred(self) -> typing.Optional[str]:
+        """ Returns the endpoint that succeeded last time. """
+        entry = self._read()
+        if entry is None:
+            return None
+        return entry.get('endpoint')
+
+    def endpoint_of(self, url: str) -> typing.Optional[str]:
+        """ Returns the endpoint which the url was built from.
+
+        If endpoints share a prefix, the longest one is chosen.  Returns None for
+        urls which were not built from the endpoints (e.g. absolute urls).
+        """
+        matches = [e for e in self.endpoints if url.startswith(_prefix(e))]
+        if not matches:
+            return None
+        return max(matches, key=lambda e: len(_prefix(e)))
+
+    def order(self, urls: typing.Tuple[str, ...]) -> typing.Tuple[str, ...]:
+        """ Move the url of the preferred endpoint to the head of urls.
+
+        urls may be a subset of the urls built from the endpoints, e.g. some of them
+        were excluded by the circuit breaker.
+        """
+        endpoint = self.preferred()
+        if endpoint not in self.endpoints:
+            return urls
+        for i, url in enumerate(urls):
+            if self.endpoint_of(url) == endpoint:
+                return (url, ) + urls[:i] + urls[i + 1:]
+        return urls
+
+    def record(self, urls: typing.Tuple[str, ...], url: str):
+        """ Record the endpoint which the succeeded url was built from. """
+        endpoint = self.endpoint_of(url)
+        if endpoint is None:
+            return
+
+        entry = self._read()
+        if entry is not None and entry.get('endpoint') == endpoint and \
+                time.time() - entry.get('updated', 0) < self.ttl / 2:
+            # The entry is fresh enough.  Skip writing to reduce disk I/O.
+            return
+
+        statefile.write(self.path, {
+            'endpoints': list(self.endpoints),
+            'endpoint': endpoint,
+            'updated': time.time(),
+        })
+
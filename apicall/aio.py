@@ -0,0 +1,582 @@
+""" asyncio transport engine.
+
+requestsを使わずにasyncioのストリーム上でHTTP/1.1を話すことで、
+1つのプロセスで数千のリクエストを同時に処理できるようにする。
+リクエストとレスポンスはrestapiと同じRequest/Responseクラスで表現する。
+
+    async with aio.AsyncSession(config.Transport(pool_maxsize=1000)) as session:
+        responses = await asyncio.gather(
+            *(aio.fetch(req, session=session) for req in requests))
+
+Response bodies are read completely before fetch() returns.  Large bodies are
+spooled to a temporary file, so they do not stay in memory.  Proxies are not
+supported.
+"""
+import ssl
+import asyncio
+import collections
+import datetime
+import tempfile
+import time
+import typing
+import urllib.parse
+import weakref
+import requests
+import requests.adapters
+import requests.structures
+import requests.utils
+import urllib3
+from . import config
+from . import restapi
+from . import jsonrpc
+from . import transport
+from . import retry as retry_
+from . import affinity as affinity_
+from . import breaker as breaker_
+from . import metrics as metrics_
+
+# Same as requests.
+MAX_REDIRECTS = 30
+_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# Maximum size of the status line and headers.
+_HEADER_LIMIT = 64 * 1024
+
+
+class _Origin(typing.NamedTuple):
+    scheme: str
+    host: str
+    port: int
+
+
+def _origin_of(url: str) -> _Origin:
+    u = urllib.parse.urlsplit(url)
+    port = u.port or (443 if u.scheme == 'https' else 80)
+    return _Origin(u.scheme, u.hostname or '', port)
+
+
+class _Reader:
+    """ A StreamReader whose operations time out like socket reads of requests.
+
+    Each operation waits at most `timeout` seconds, and none of them goes beyond
+    `deadline` (a time.monotonic() value).
+    """
+
+    def __init__(self, reader: asyncio.StreamReader):
+        self._reader = reader
+        self.timeout: typing.Optional[float] = None
+        self.deadline: typing.Optional[float] = None
+
+    def current_timeout(self) -> typing.Optional[float]:
+        if self.deadline is None:
+            return self.timeout
+        left = max(0.0, self.deadline - time.monotonic())
+        return left if self.timeout is None else min(self.timeout, left)
+
+    async def read(self, n: int = -1) -> bytes:
+        return await asyncio.wait_for(self._reader.read(n),
+                                      self.current_timeout())
+
+    async def readuntil(self, separator: bytes) -> bytes:
+        return await asyncio.wait_for(self._reader.readuntil(separator),
+                                      self.current_timeout())
+
+    async def readexactly(self, n: int) -> bytes:
+        return await asyncio.wait_for(self._reader.readexactly(n),
+                                      self.current_timeout())
+
+
+class _Connection:
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter):
+        self.reader = _Reader(reader)
+        self.writer = writer
+        # True after the response head of the current request was received.
+        self.responded = False
+
+    async def drain(self):
+        """ Wait until the buffer is flushed, with the timeout of reads. """
+        await asyncio.wait_for(self.writer.drain(),
+                               self.reader.current_timeout())
+
+    def close(self):
+        self.writer.close()
+
+
+class _Head(typing.NamedTuple):
+    version: int
+    status: int
+    reason: str
+    headers: urllib3.HTTPHeaderDict
+
+
+class _ProtocolError(Exception):
+    pass
+
+
+class UnsupportedProxyError(requests.RequestException):
+    """ A proxy is configured for the url, but this engine cannot use proxies. """
+    pass
+
+
+def proxy_for(url: str) -> typing.Optional[str]:
+    """ Returns the proxy which requests would use for the url.
+
+    It comes from HTTP_PROXY, HTTPS_PROXY and ALL_PROXY, unless NO_PROXY excludes
+    the host.
+    """
+    return requests.utils.select_proxy(url,
+                                       requests.utils.get_environ_proxies(url))
+
+
+def _is_chunked(headers: typing.Mapping[str, str]) -> bool:
+    return 'chunked' in headers.get('transfer-encoding', '').lower()
+
+
+async def _write_request(conn: _Connection, req: requests.PreparedRequest):
+    u = urllib.parse.urlsplit(typing.cast(str, req.url))
+    target = u.path or '/'
+    if u.query:
+        target += '?' + u.query
+
+    headers = req.headers
+    lines = [f'{req.method} {target} HTTP/1.1']
+    if 'host' not in headers:
+        lines.append(f'Host: {u.netloc.rpartition("@")[2]}')
+    lines += [f'{k}: {v}' for k, v in headers.items()]
+    conn.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    body = req.body
+    if body is None:
+        pass
+    elif isinstance(body, (bytes, str)):
+        conn.writer.write(body.encode() if isinstance(body, str) else body)
+    elif _is_chunked(headers):
+        for chunk in restapi.iter_chunks(body):
+            if chunk:
+                conn.writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                await conn.drain()
+        conn.writer.write(b'0\r\n\r\n')
+    else:
+        for chunk in restapi.iter_chunks(body):
+            conn.writer.write(chunk)
+            await conn.drain()
+    await conn.drain()
+
+
+async def _read_head(conn: _Connection) -> _Head:
+    while True:
+        data = await conn.reader.readuntil(b'\r\n\r\n')
+        status_line, _, header_lines = data.partition(b'\r\n')
+        try:
+            version, status, *reason = status_line.decode('latin-1').split(
+                ' ', 2)
+            head = _Head(
+                version=11 if version == 'HTTP/1.1' else 10,
+                status=int(status),
+                reason=reason[0] if reason else '',
+                headers=urllib3.HTTPHeaderDict(),
+            )
+        except ValueError:
+            raise _ProtocolError(f'Invalid status line: {status_line!r}')
+        for line in header_lines.decode('latin-1').split('\r\n'):
+            name, sep, value = line.partition(':')
+            if sep:
+                head.headers.add(name.strip(), value.strip())
+
+        if not 100 <= head.status < 200:
+            return head
+        # Skip interim responses like 100 Continue.
+
+
+async def _read_body(conn: _Connection, head: _Head, method: str,
+                     f: typing.BinaryIO) -> bool:
+    """ Read the response body into f.
+
+    Returns True if the connection can be reused for the next request.
+    """
+    reusable = head.headers.get('connection', '').lower() != 'close'
+    if head.version < 11:
+        reusable = head.headers.get('connection',
+                                    '').lower() == 'keep-alive'
+
+    if method == 'HEAD' or head.status in (204, 304):
+        return reusable
+
+    if _is_chunked(head.headers):
+        while True:
+            line = await conn.reader.readuntil(b'\r\n')
+            try:
+                size = int(line.split(b';', 1)[0], 16)
+            except ValueError:
+                raise _ProtocolError(f'Invalid chunk size: {line!r}')
+            if size == 0:
+                # Skip trailers.
+                while await conn.reader.readuntil(b'\r\n') != b'\r\n':
+                    pass
+                return reusable
+            await _copy(conn.reader, f, size)
+            await conn.reader.readexactly(2)
+
+    if 'content-length' in head.headers:
+        await _copy(conn.reader, f, int(head.headers['content-length']))
+        return reusable
+
+    # The body continues until the server closes the connection.
+    while True:
+        chunk = await conn.reader.read(restapi.CHUNK_SIZE)
+        if not chunk:
+            return False
+        f.write(chunk)
+
+
+async def _copy(reader: _Reader, f: typing.BinaryIO, size: int):
+    while size > 0:
+        chunk = await reader.read(min(size, restapi.CHUNK_SIZE))
+        if not chunk:
+            raise asyncio.IncompleteReadError(b'', size)
+        f.write(chunk)
+        size -= len(chunk)
+
+
+class AsyncSession(transport.BaseSession):
+    """ Owns connection pools on an event loop.
+
+    Up to options.pool_maxsize connections are opened to each origin at the same
+    time.  Requests beyond the limit wait for a connection to become free.
+    The session must be used only in the event loop that created it.
+    """
+
+    def __init__(self,
+                 options: typing.Optional[config.Transport] = None,
+                 affinity: typing.Optional[affinity_.AffinityCache] = None,
+                 retry: typing.Optional[config.Retry] = None,
+                 breaker: typing.Optional[breaker_.CircuitBreaker] = None,
+                 metrics: typing.Optional[metrics_.Log] = None):
+        super().__init__(options, affinity, retry, breaker, metrics)
+        self._idle: typing.Dict[_Origin, typing.Deque[
+            _Connection]] = collections.defaultdict(collections.deque)
+        self._slots: typing.Dict[_Origin, asyncio.Semaphore] = {}
+        self._ssl: typing.Optional[ssl.SSLContext] = None
+        self._proxies: typing.Dict[_Origin, typing.Optional[str]] = {}
+        # Used only to convert responses into requests.Response.
+        self._adapter = requests.adapters.HTTPAdapter()
+        self._headers = requests.utils.default_headers()
+        if not self.options.keep_alive:
+            self._headers['connection'] = 'close'
+
+    def _ssl_context(self) -> ssl.SSLContext:
+        if self._ssl is None:
+            self._ssl = ssl.create_default_context(
+                cafile=requests.utils.DEFAULT_CA_BUNDLE_PATH)
+        return self._ssl
+
+    def _slot(self, origin: _Origin) -> asyncio.Semaphore:
+        if origin not in self._slots:
+            self._slots[origin] = asyncio.Semaphore(
+                max(1, self.options.pool_maxsize))
+        return self._slots[origin]
+
+    async def _connect(self, origin: _Origin,
+                       timeout: typing.Optional[float]) -> _Connection:
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    origin.host,
+                    origin.port,
+                    ssl=self._ssl_context()
+                    if origin.scheme == 'https' else None,
+                    limit=_HEADER_LIMIT,
+                ), timeout)
+        except asyncio.TimeoutError as e:
+            raise requests.ConnectTimeout(
+                f'Connection to {origin.host}:{origin.port} timed out.'
+            ) from e
+        except OSError as e:
+            raise requests.ConnectionError(
+                f'Failed to connect to {origin.host}:{origin.port}: {e}'
+            ) from e
+        return _Connection(reader, writer)
+
+    async def _exchange(self, conn: _Connection, req: requests.PreparedRequest,
+                        f: typing.BinaryIO) -> typing.Tuple[_Head, bool]:
+        conn.responded = False
+        await _write_request(conn, req)
+        head = await _read_head(conn)
+        conn.responded = True
+        reusable = await _read_body(conn, head, req.method or '', f)
+        return head, reusable
+
+    async def _round_trip(
+            self, req: requests.PreparedRequest,
+            timeout: typing.Optional[typing.Tuple[typing.Optional[float],
+                                                  typing.Optional[float]]],
+            deadline: typing.Optional[float]
+    ) -> requests.Response:
+        """ Send the request and read the response.
+
+        Like requests, the connect timeout bounds connecting, and the read
+        timeout bounds each wait for the server.  The deadline bounds the whole
+        exchange including the response body.
+        """
+        connect_timeout, read_timeout = timeout or (None, None)
+        origin = _origin_of(req.url or '')
+        if origin not in self._proxies:
+            self._proxies[origin] = proxy_for(req.url or '')
+        if self._proxies[origin] is not None:
+            raise UnsupportedProxyError(
+                f'The proxy {self._proxies[origin]} is configured for '
+                f'{origin.host}, but the async engine does not support '
+                f'proxies.  Add the host to NO_PROXY, or use the thread engine.')
+        idle = self._idle[origin]
+        body_pos = None
+        if hasattr(req.body, 'seek') and hasattr(req.body, 'tell'):
+            body_pos = typing.cast(typing.BinaryIO, req.body).tell()
+        replayable = body_pos is not None or req.body is None or isinstance(
+            req.body, (bytes, str))
+
+        async with self._slot(origin):
+            while True:
+                reused = bool(idle)
+                if reused:
+                    conn = idle.pop()
+                else:
+                    conn = await self._connect(origin, connect_timeout)
+
+                f = tempfile.SpooledTemporaryFile(max_size=restapi.SPOOL_SIZE)
+                start = time.monotonic()
+                conn.reader.timeout = read_timeout
+                conn.reader.deadline = deadline
+                try:
+                    head, reusable = await self._exchange(
+                        conn, req, typing.cast(typing.BinaryIO, f))
+                except asyncio.TimeoutError as e:
+                    conn.close()
+                    f.close()
+                    raise requests.ReadTimeout(
+                        f'Read timed out. (read timeout={read_timeout})') from e
+                except asyncio.CancelledError:
+                    conn.close()
+                    f.close()
+                    raise
+                except (OSError, EOFError, asyncio.LimitOverrunError,
+                        _ProtocolError) as e:
+                    conn.close()
+                    f.close()
+                    if reused and not conn.responded and replayable:
+                        # The server closed the idle connection before we sent
+                        # the request.  Retry with a new connection.
+                        if body_pos is not None:
+                            typing.cast(typing.BinaryIO,
+                                        req.body).seek(body_pos)
+                        continue
+                    raise requests.ConnectionError(
+                        f'Connection aborted: {e!r}') from e
+
+                if reusable and self.options.keep_alive:
+                    idle.append(conn)
+                else:
+                    conn.close()
+                break
+
+        f.seek(0)
+        raw = urllib3.HTTPResponse(
+            body=f,
+            headers=head.headers,
+            status=head.status,
+            version=head.version,
+            reason=head.reason,
+            preload_content=False,
+            decode_content=True,
+            request_method=req.method,
+            request_url=req.url,
+        )
+        res = self._adapter.build_response(req, raw)
+        res.elapsed = datetime.timedelta(seconds=time.monotonic() - start)
+        return res
+
+    async def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """ Send a request.  Arguments and exceptions are the same as requests.
+
+        Supported keyword arguments are headers, auth, data and timeout, and
+        deadline, a time.monotonic() value by which the response body must be
+        received.  Redirects are followed like requests.Session does.
+        Proxies are not supported.  UnsupportedProxyError is raised if
+        environment variables configure a proxy for the url.
+        """
+        headers = requests.structures.CaseInsensitiveDict(self._headers)
+        headers.update(kwargs.get('headers') or {})
+        req = requests.Request(
+            method=method,
+            url=url,
+            headers=headers,
+            auth=kwargs.get('auth'),
+            data=kwargs.get('data'),
+        ).prepare()
+
+        history: typing.List[requests.Response] = []
+        while True:
+            res = await self._round_trip(req, kwargs.get('timeout'),
+                                         kwargs.get('deadline'))
+            location = res.headers.get('location')
+            if res.status_code not in _REDIRECT_STATUSES or not location:
+                res.history = history
+                return res
+            if len(history) >= MAX_REDIRECTS:
+                raise requests.TooManyRedirects(
+                    f'Exceeded {MAX_REDIRECTS} redirects.', response=res)
+            res.content  # Release the spooled body.
+            history.append(res)
+            req = self._redirect(req, res, location)
+
+    @staticmethod
+    def _redirect(req: requests.PreparedRequest, res: requests.Response,
+                  location: str) -> requests.PreparedRequest:
+        new = req.copy()
+        new.prepare_url(urllib.parse.urljoin(res.url, location), None)
+        if res.status_code == 303 and req.method != 'HEAD' or (
+                res.status_code in (301, 302) and req.method == 'POST'):
+            new.method = 'GET'
+            new.body = None
+            for name in ('content-length', 'content-type',
+                         'transfer-encoding', 'content-encoding'):
+                new.headers.pop(name, None)
+        if _origin_of(new.url or '').host != _origin_of(req.url or '').host:
+            # Do not leak credentials to other hosts.
+            new.headers.pop('authorization', None)
+        return new
+
+    async def close(self):
+        for idle in self._idle.values():
+            while idle:
+                idle.pop().close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+_defaults: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncSession]' = weakref.WeakKeyDictionary(
+)
+
+
+def default() -> AsyncSession:
+    """ Returns the shared session of the running event loop. """
+    loop = asyncio.get_running_loop()
+    if loop not in _defaults:
+        _defaults[loop] = AsyncSession()
+    return _defaults[loop]
+
+
+async def fetch(
+        request: restapi.Request,
+        verbose: int = 0,
+        logging_cb: typing.Optional[typing.Callable[[str], None]] = None,
+        session: typing.Optional[AsyncSession] = None) -> restapi.Response:
+    """ The asyncio counterpart of restapi.Request.fetch().
+
+    Urls are tried in the same order with the same timeouts, and the same
+    exceptions are raised.
+    """
+    if session is None:
+        session = default()
+
+    body_pos = None
+    if hasattr(request.data, 'seek') and hasattr(request.data, 'tell'):
+        body_pos = typing.cast(typing.BinaryIO, request.data).tell()
+
+    deadline = session.deadline()
+    start, clock = time.time(), time.monotonic()
+    attempt = 1
+    # Urls which requests were sent to.
+    tried: typing.List[str] = []
+    try:
+        while True:
+            try:
+                res = await _fetch_once(request, verbose, logging_cb, session,
+                                        deadline, body_pos, tried)
+            except restapi.ConnectionError:
+                delay = retry_.delay_after_error(session.retry, request.method,
+                                                 request.data, attempt, deadline)
+                if delay is None:
+                    raise
+            else:
+                delay = retry_.delay_after_response(session.retry, request.method,
+                                                    request.data, res.status_code,
+                                                    res.headers, attempt, deadline)
+                if delay is None:
+                    # The body has been received already.
+                    return request.record_metrics(session, res, start, clock,
+                                                  attempt)
+                res.close()
+
+            request.logging_retry(verbose, logging_cb, delay, attempt,
+                                  session.retry.max_attempts)
+            await asyncio.sleep(delay)
+            attempt += 1
+    except (restapi.ConnectionError, restapi.TimeoutError):
+        request.record_failure(session, tried, start, clock, attempt)
+        raise
+
+
+async def _fetch_once(request: restapi.Request, verbose: int,
+                      logging_cb: typing.Optional[typing.Callable[[str], None]],
+                      session: AsyncSession, deadline: typing.Optional[float],
+                      body_pos: typing.Optional[int],
+                      tried: typing.List[str]) -> restapi.Response:
+    if session.options.race:
+        # Racing uses blocking sockets.
+        urls = await asyncio.get_running_loop().run_in_executor(
+            None, session.candidates, request.urls, deadline)
+    else:
+        urls = session.candidates(request.urls, deadline)
+    for i, url in enumerate(urls):
+        if deadline is not None and time.monotonic() >= deadline:
+            raise restapi.TimeoutError()
+        tried.append(url)
+        if body_pos is not None:
+            typing.cast(typing.BinaryIO, request.data).seek(body_pos)
+        try:
+            res = await session.request(
+                request.method,
+                url,
+                headers=request.dict_headers,
+                auth=(request.basic.user, request.basic.password) if request.basic else None,
+                data=request.data,
+                timeout=session.timeout(deadline, len(urls) - i),
+                deadline=deadline,
+            )
+        except requests.ConnectionError as e:
+            request.logging_error(verbose, logging_cb, err=e)
+            session.failed(url)
+            continue
+        except requests.Timeout as e:
+            request.logging_error(verbose, logging_cb, err=e)
+            session.failed(url)
+            raise restapi.TimeoutError() from e
+
+        request.logging_request(verbose, logging_cb, res)
+        if res.status_code in retry_.FAILURE_STATUSES:
+            session.failed(url)
+        else:
+            session.succeeded(request.urls, url)
+        return restapi.Response(request=request, _result=res, failovers=i)
+
+    if deadline is not None and time.monotonic() >= deadline:
+        raise restapi.TimeoutError()
+    raise restapi.ConnectionError()
+
+
+async def send(
+        endpoint: jsonrpc.Endpoint,
+        req: jsonrpc.Request,
+        verbose: int = 0,
+        logging_cb: typing.Optional[typing.Callable[[str], None]] = None,
+        session: typing.Optional[AsyncSession] = None) -> str:
+    """ The asyncio counterpart of jsonrpc.Endpoint.send(). """
+    res_raw = await fetch(endpoint.build_request(req),
+                          verbose=verbose,
+                          logging_cb=logging_cb,
+                          session=session)
+    return jsonrpc.Endpoint.parse_response(res_raw)
@@ -7,12 +7,36 @@ import os
 import abc
 import dataclasses
 import json
+import itertools
+import asyncio
+import time
+import requests
 from . import config
 from . import restapi
 from . import urlutils
 from . import printutils
 from .printutils import pprint
 from . import jsonrpc
+from . import transport
+from . import affinity
+from . import breaker
+from . import httpcache
+from . import probe
+from . import download
+from . import multipart
+from . import compression
+from . import batch
+from . import aio
+from . import bench
+from . import replay
+from . import watch
+from . import jsonpath
+from . import paginate
+from . import sweep
+from . import timing
+from . import telemetry
+from . import metrics
+from . import profiling
 from tabulate import tabulate  # type: ignore
 
 # ExitCodes are compatible with curl command.
@@ -21,9 +45,16 @@ ExitOk = ExitCode(0)
 ExitFailedToInit = ExitCode(1)
 ExitInvalidArgs = ExitFailedToInit
 ExitFailedToConnect = ExitCode(7)
+ExitOperationTimeout = ExitCode(28)
+ExitRangeError = ExitCode(33)
 ExitInvalidResponse = ExitCode(22)
+ExitRecvError = ExitCode(56)
 ExitErrorReponse = ExitCode(254)
 ExitSubprocessError = ExitCode(255)
+ExitInterrupted = ExitCode(130)
+
+# Number of bytes to read from --data to detect its content type.
+DETECT_SIZE = 64 * 1024
 
 
 def parse_headers(
@@ -51,6 +82,225 @@ class CommandArgs(typing.NamedTuple):
     conf_file: str
 
 
+def add_transport_arguments(p: argparse.ArgumentParser):
+    """ Add options to override the transport settings. """
+    p.add_argument('--race', action='store_true', default=None)
+    p.add_argument('--connect-timeout', type=float, metavar='SECONDS')
+    p.add_argument('-m', '--max-time', type=float, metavar='SECONDS')
+    p.add_argument('--retry', type=int, metavar='N')
+    p.add_argument('--retry-delay', type=float, metavar='SECONDS')
+    p.add_argument('--breaker-threshold', type=int, metavar='N')
+    p.add_argument('--breaker-cooldown', type=float, metavar='SECONDS')
+    p.add_argument('--metrics', action='store_true', default=None)
+
+
+def add_trace_arguments(p: argparse.ArgumentParser):
+    p.add_argument('--trace-file', metavar='FILE')
+    p.add_argument('--trace-endpoint', metavar='URL')
+
+
+def add_profile_arguments(p: argparse.ArgumentParser):
+    # main() takes --profile[=MODE] out of arguments before parsing them.  This
+    # is only for the help message.  Like other options, it is taken as a value
+    # only after "--" or in the form of "--header=--profile".
+    p.add_argument('--profile',
+                   nargs='?',
+                   const=profiling.MODES[0],
+                   choices=profiling.MODES)
+
+
+def add_compression_arguments(p: argparse.ArgumentParser):
+    p.add_argument('--compressed', action='store_true')
+    p.add_argument('--compress-request',
+                   choices=compression.REQUEST_ENCODINGS,
+                   metavar='ENCODING')
+
+
+def compression_headers(
+        ns: argparse.Namespace) -> typing.Tuple[config.HttpHeader, ...]:
+    """ Returns headers for --compressed and --compress-request """
+    headers: typing.Tuple[config.HttpHeader, ...] = ()
+    if ns.compressed:
+        headers += compression.accept_encoding(),
+    if ns.compress_request is not None:
+        headers += config.HttpHeader('content-encoding',
+                                     ns.compress_request),
+    return headers
+
+
+def continue_at(value: str) -> str:
+    """ Type of -C option: "-" or a non-negative offset. """
+    if value != '-' and not (value.isdigit() and value.isascii()):
+        raise argparse.ArgumentTypeError(
+            f'must be "-" or a non-negative offset: {value!r}')
+    return value
+
+
+def add_bench_arguments(p: argparse.ArgumentParser):
+    """ Add options of the load testing mode. """
+    p.add_argument('--bench', action='store_true')
+    p.add_argument('--requests',
+                   type=int,
+                   default=bench.DEFAULT_REQUESTS,
+                   metavar='N')
+    p.add_argument('--concurrency', type=int, metavar='C')
+    p.add_argument('--rate', type=float, metavar='PER_SECOND')
+    p.add_argument('--processes', type=int, default=1, metavar='P')
+
+
+def run_bench(ca: CommandArgs,
+              request: restapi.Request,
+              check: typing.Optional[bench.Check] = None) -> ExitCode:
+    """ Repeat the request as specified by the options, and print the report. """
+    concurrency = ca.ns.concurrency
+    if concurrency is None:
+        concurrency = bench.DEFAULT_OPEN_CONCURRENCY if ca.ns.rate else bench.DEFAULT_CONCURRENCY
+    if ca.ns.requests < 1 or concurrency < 1 or ca.ns.processes < 1 or (
+            ca.ns.rate is not None and ca.ns.rate <= 0):
+        print(
+            'ERROR: --requests, --concurrency, --rate and --processes must be '
+            'positive.',
+            file=sys.stderr)
+        return ExitInvalidArgs
+
+    stats = bench.run_parallel(
+        request,
+        bench.Plan(requests=ca.ns.requests,
+                   concurrency=concurrency,
+                   rate=ca.ns.rate),
+        processes=ca.ns.processes,
+        options=transport_options(ca),
+        check=check,
+    )
+    print(bench.report(stats))
+    return ExitOk
+
+
+def transport_options(ca: CommandArgs,
+                      pool_maxsize: int = 0) -> config.Transport:
+    """ Returns the transport settings overridden by command line options
+
+    pool_maxsize is the number of connections which will be used concurrently.
+    """
+    options = ca.conf.transport
+    if pool_maxsize > options.pool_maxsize:
+        options = dataclasses.replace(options, pool_maxsize=pool_maxsize)
+    if ca.ns.race is not None:
+        options = dataclasses.replace(options, race=ca.ns.race)
+    if ca.ns.connect_timeout is not None:
+        options = dataclasses.replace(
+            options, connect_timeout=ca.ns.connect_timeout)
+    if ca.ns.max_time is not None:
+        options = dataclasses.replace(options, max_time=ca.ns.max_time)
+    return options
+
+
+def affinity_cache(ca: CommandArgs, options: config.Transport
+                   ) -> typing.Optional[affinity.AffinityCache]:
+    if options.affinity_ttl <= 0:
+        return None
+    return affinity.AffinityCache(
+        path=config.state_path(ca.conf_file, 'affinity.json'),
+        endpoints=ca.conf.endpoints,
+        ttl=options.affinity_ttl,
+    )
+
+
+def retry_options(ca: CommandArgs) -> config.Retry:
+    """ Returns the retry policy overridden by command line options """
+    policy = ca.conf.retry
+    if ca.ns.retry is not None:
+        policy = dataclasses.replace(policy,
+                                     max_attempts=max(0, ca.ns.retry) + 1)
+    if ca.ns.retry_delay is not None:
+        policy = dataclasses.replace(policy, backoff=ca.ns.retry_delay)
+    if ca.ns.breaker_threshold is not None:
+        policy = dataclasses.replace(policy,
+                                     breaker_threshold=ca.ns.breaker_threshold)
+    if ca.ns.breaker_cooldown is not None:
+        policy = dataclasses.replace(policy,
+                                     breaker_cooldown=ca.ns.breaker_cooldown)
+    return policy
+
+
+def circuit_breaker(ca: CommandArgs, policy: config.Retry
+                    ) -> typing.Optional[breaker.CircuitBreaker]:
+    if policy.breaker_threshold <= 0:
+        return None
+    return breaker.CircuitBreaker(
+        path=config.state_path(ca.conf_file, 'breaker.json'),
+        threshold=policy.breaker_threshold,
+        cooldown=policy.breaker_cooldown,
+    )
+
+
+def response_cache(ca: CommandArgs) -> typing.Optional[httpcache.Cache]:
+    enabled = ca.conf.cache.enabled if ca.ns.cache is None else ca.ns.cache
+    if not enabled:
+        return None
+    return httpcache.Cache(
+        path=config.state_path(ca.conf_file, 'cache'),
+        max_size=ca.conf.cache.max_size,
+    )
+
+
+def metrics_log(ca: CommandArgs) -> typing.Optional[metrics.Log]:
+    enabled = ca.conf.metrics.enabled if ca.ns.metrics is None else ca.ns.metrics
+    if not enabled:
+        return None
+    return metrics.Log(
+        path=config.state_path(ca.conf_file, 'metrics'),
+        max_size=ca.conf.metrics.max_size,
+        backups=ca.conf.metrics.backups,
+    )
+
+
+def build_session(
+        ca: CommandArgs,
+        pool_maxsize: int = 0,
+        cache: typing.Optional[httpcache.Cache] = None,
+        timing: bool = False) -> transport.Session:
+    """ Create a transport session from the config and command line options """
+    options = transport_options(ca, pool_maxsize)
+    policy = retry_options(ca)
+    return transport.Session(options,
+                             affinity=affinity_cache(ca, options),
+                             retry=policy,
+                             breaker=circuit_breaker(ca, policy),
+                             cache=cache,
+                             timing=timing,
+                             metrics=metrics_log(ca))
+
+
+def build_tracer(ns: argparse.Namespace) -> telemetry.AnyTracer:
+    """ Returns the tracer to record spans if --trace-file or --trace-endpoint is specified """
+    if getattr(ns, 'trace_file', None) is None and getattr(
+            ns, 'trace_endpoint', None) is None:
+        return telemetry.NullTracer()
+    return telemetry.Tracer(parent=telemetry.SpanContext.from_environ())
+
+
+def export_trace(ns: argparse.Namespace, tracer: telemetry.Tracer,
+                 service: str):
+    """ Write recorded spans.  Failures are reported but do not change the exit code. """
+    payload = tracer.export(service)
+    try:
+        if ns.trace_file is not None:
+            telemetry.write_file(ns.trace_file, payload)
+        if ns.trace_endpoint is not None:
+            telemetry.post(ns.trace_endpoint, payload)
+    except (OSError, requests.RequestException) as e:
+        print(f'WARNING: Could not export the trace: {e}', file=sys.stderr)
+
+
+# Messages of errors which do not stop --watch.
+WATCH_ERRORS = {
+    restapi.ConnectionError: 'Could not connect to server.',
+    restapi.TimeoutError: 'Operation timed out.',
+    restapi.TransferError: 'Connection was lost while receiving the response.',
+}
+
+
 class TopCommand(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def build(self) -> argparse.ArgumentParser:
@@ -188,11 +438,18 @@ class Endpoint(SubCommand):
     NAME = 'endpoint'
 
     def build_in(self, p: argparse.ArgumentParser):
+        p.add_argument('--probe', action='store_true')
+        p.add_argument('-n', '--samples', type=int,
+                       default=probe.DEFAULT_SAMPLES)
+        p.add_argument('--timeout', type=float, default=probe.DEFAULT_TIMEOUT)
+        p.add_argument('--reorder', action='store_true')
         p.add_argument('urls', nargs='*')
 
     def __call__(self, ca: CommandArgs) -> ExitCode:
         urls = ca.ns.urls
-        if urls:
+        if ca.ns.probe:
+            return self.probe(ca, tuple(urls) or ca.conf.endpoints)
+        elif urls:
             new_conf = dataclasses.replace(ca.conf, endpoints=tuple(urls))
             config.save(ca.conf_file, new_conf)
             return ExitOk
@@ -200,6 +457,32 @@ class Endpoint(SubCommand):
             print('\n'.join(ca.conf.endpoints))
             return ExitOk
 
+    def probe(self, ca: CommandArgs,
+              endpoints: typing.Tuple[str, ...]) -> ExitCode:
+        results = probe.probe(
+            endpoints,
+            samples=ca.ns.samples,
+            headers=ca.conf.headers,
+            basic=ca.conf.basic,
+            timeout=ca.ns.timeout,
+        )
+
+        def ms(sec: typing.Optional[float]) -> str:
+            return '-' if sec is None else f'{sec * 1000:.1f}'
+
+        data = tuple((r.endpoint, ms(r.connect), ms(r.ttfb),
+                      f'{r.success_rate:.0%}') for r in results)
+        print(
+            tabulate(
+                data,
+                headers=('ENDPOINT', 'CONNECT(ms)', 'TTFB(ms)', 'SUCCESS')))
+
+        if ca.ns.reorder:
+            new_conf = dataclasses.replace(
+                ca.conf, endpoints=probe.fastest_first(results))
+            config.save(ca.conf_file, new_conf)
+        return ExitOk
+
 
 class Rest(SubCommand):
     NAME = 'rest'
@@ -212,60 +495,469 @@ class Rest(SubCommand):
         p.add_argument('-H', '--header', action='append')
         p.add_argument('--accept')
         p.add_argument('--content-type', '--type')
-        p.add_argument('-d', '--data')
+        data = p.add_mutually_exclusive_group()
+        data.add_argument('-d', '--data')
+        data.add_argument('-F', '--form', action='append', metavar='NAME=VALUE')
+        p.add_argument('-o', '--output', metavar='FILE')
+        p.add_argument('-C',
+                       '--continue-at',
+                       type=continue_at,
+                       metavar='OFFSET')
+        p.add_argument('--segments', type=int, default=1, metavar='N')
+        p.add_argument('--cache', action='store_true', default=None)
+        p.add_argument('--watch', type=float, metavar='SECONDS')
+        p.add_argument('--diff', action='store_true')
+        p.add_argument('--until', metavar='CONDITION')
+        p.add_argument('--paginate', action='store_true')
+        p.add_argument('--items-path', metavar='PATH')
+        p.add_argument('--cursor-path', metavar='PATH')
+        p.add_argument('--cursor-param', default='cursor', metavar='NAME')
+        p.add_argument('--offset-param', metavar='NAME')
+        p.add_argument('--max-pages', type=int, metavar='N')
+        p.add_argument('--merge',
+                       choices=paginate.MERGE_FORMATS,
+                       default=paginate.MERGE_FORMATS[0])
+        p.add_argument('--param', action='append', metavar='NAME=VALUES')
+        p.add_argument('-w', '--write-out', metavar='FORMAT')
+        p.add_argument('--timing-json', metavar='FILE')
+        add_compression_arguments(p)
+        add_transport_arguments(p)
+        add_trace_arguments(p)
+        add_bench_arguments(p)
         p.add_argument('method')
         p.add_argument('url')
         p.add_argument('queries', nargs='*')
 
     def __call__(self, ca: CommandArgs) -> ExitCode:
-        # 正しいcontent-type headerをつけていないので、アプリケーション側で正しく処理してくれない。
+        offset = 0
+        if ca.ns.bench and (ca.ns.output is not None or ca.ns.continue_at
+                            is not None or ca.ns.segments > 1):
+            print(
+                'ERROR: --bench cannot be used with --output, --continue-at '
+                'and --segments.',
+                file=sys.stderr)
+            return ExitInvalidArgs
+        if ca.ns.watch is not None and (
+                ca.ns.bench or ca.ns.output is not None or ca.ns.continue_at
+                is not None or ca.ns.segments > 1 or ca.ns.watch <= 0):
+            print(
+                'ERROR: --watch must be positive, and cannot be used with '
+                '--bench, --output, --continue-at and --segments.',
+                file=sys.stderr)
+            return ExitInvalidArgs
+        if ca.ns.paginate and (ca.ns.bench or ca.ns.watch is not None
+                               or ca.ns.output is not None
+                               or ca.ns.continue_at is not None
+                               or ca.ns.segments > 1):
+            print(
+                'ERROR: --paginate cannot be used with --bench, --watch, '
+                '--output, --continue-at and --segments.',
+                file=sys.stderr)
+            return ExitInvalidArgs
+        if ca.ns.param and (ca.ns.bench or ca.ns.watch is not None
+                            or ca.ns.paginate or ca.ns.output is not None
+                            or ca.ns.continue_at is not None
+                            or ca.ns.segments > 1):
+            print(
+                'ERROR: --param cannot be used with --bench, --watch, '
+                '--paginate, --output, --continue-at and --segments.',
+                file=sys.stderr)
+            return ExitInvalidArgs
+        if (ca.ns.write_out is not None or ca.ns.timing_json is not None) and (
+                ca.ns.bench or ca.ns.watch is not None or ca.ns.paginate
+                or ca.ns.param or ca.ns.segments > 1):
+            print(
+                'ERROR: --write-out and --timing-json cannot be used with '
+                '--bench, --watch, --paginate, --param and --segments.',
+                file=sys.stderr)
+            return ExitInvalidArgs
+        if (ca.ns.diff or ca.ns.until is not None) and ca.ns.watch is None:
+            print('ERROR: --diff and --until require --watch.',
+                  file=sys.stderr)
+            return ExitInvalidArgs
+        for form in ca.ns.form or ():
+            try:
+                multipart.parse_field(form)
+            except ValueError as e:
+                print(f'ERROR: {e}', file=sys.stderr)
+                return ExitInvalidArgs
+        if ca.ns.continue_at is not None:
+            if ca.ns.output is None:
+                print('ERROR: --continue-at requires --output.',
+                      file=sys.stderr)
+                return ExitInvalidArgs
+            offset = download.resume_offset(ca.ns.output, ca.ns.continue_at)
+        if ca.ns.segments > 1:
+            if ca.ns.output is None or ca.ns.continue_at is not None:
+                print(
+                    'ERROR: --segments requires --output, and cannot be used '
+                    'with --continue-at.',
+                    file=sys.stderr)
+                return ExitInvalidArgs
+
         try:
-            data = self.parse_data(ca.ns.data)
-            response = restapi.Request(
-                method=ca.ns.method,
-                urls=urlutils.concat_urls(
-                    endpoints=ca.conf.endpoints,
-                    url=ca.ns.url,
-                    queries=tuple(ca.ns.queries),
-                ),
-                headers=(self.detect_data_type(data) + ca.conf.headers +
-                         parse_headers(ca.ns)),
-                basic=ca.conf.basic,
-                data=data,
-            ).fetch(
-                verbose=ca.ns.verbose,
-                logging_cb=lambda msg: print(msg),
-            )
+            if ca.ns.bench:
+                return self.bench(ca)
+            if ca.ns.watch is not None:
+                return self.run_watch(ca)
+            if ca.ns.paginate:
+                return self.paginate(ca)
+            if ca.ns.param:
+                return self.sweep(ca)
+            self.execute(ca, offset)
+            return ExitOk
         except restapi.ConnectionError:
             pprint(
                 'ERROR: Could not connect to server.\n'
                 'Please check endpoint urls and HTTP server status.',
                 file=sys.stderr, raw=ca.ns.raw)
             return ExitFailedToConnect
-
-        try:
-            pprint(response.raw_body, raw=ca.ns.raw)
-            return ExitOk
+        except restapi.TimeoutError:
+            pprint(
+                'ERROR: Operation timed out.\n'
+                'Please check HTTP server status or increase --max-time.',
+                file=sys.stderr, raw=ca.ns.raw)
+            return ExitOperationTimeout
+        except download.RangeError as e:
+            print(f'ERROR: {e}', file=sys.stderr)
+            return ExitRangeError
+        except compression.CompressionError as e:
+            print(f'ERROR: {e}', file=sys.stderr)
+            return ExitFailedToInit
+        except restapi.TransferError:
+            print(
+                'ERROR: Connection was lost while receiving the response.',
+                file=sys.stderr)
+            return ExitRecvError
         except printutils.SubprocessError:
             return ExitSubprocessError
 
-    def parse_data(self, data: typing.Optional[str]) -> typing.Optional[bytes]:
+    def build_request(self,
+                      ca: CommandArgs,
+                      stack: contextlib.ExitStack,
+                      offset: int = 0) -> restapi.Request:
+        data: typing.Optional[restapi.Body]
+        if ca.ns.form:
+            encoder = multipart.MultipartEncoder(
+                multipart.parse_field(f) for f in ca.ns.form)
+            stack.callback(encoder.close)
+            data = typing.cast(typing.BinaryIO, encoder)
+            data_type: typing.Tuple[config.HttpHeader, ...] = (
+                config.HttpHeader('content-type', encoder.content_type), )
+        else:
+            head, complete, data = self.peek_data(
+                self.parse_data(ca.ns.data, stack))
+            data_type = self.detect_data_type(head, complete)
+        if data is not None and ca.ns.compress_request is not None:
+            # The source of a streamed body is closed by the stack.
+            data = compression.compress(data, ca.ns.compress_request)
+
+        return restapi.Request(
+            method=ca.ns.method,
+            urls=urlutils.concat_urls(
+                endpoints=ca.conf.endpoints,
+                url=ca.ns.url,
+                queries=tuple(ca.ns.queries),
+            ),
+            # Headers given later take precedence.
+            headers=(data_type + compression_headers(ca.ns) +
+                     ca.conf.headers + parse_headers(ca.ns) +
+                     download.range_headers(ca.ns.output, offset)),
+            basic=ca.conf.basic,
+            data=data,
+        )
+
+    def bench(self, ca: CommandArgs) -> ExitCode:
+        with contextlib.ExitStack() as stack:
+            request = bench.replayable(self.build_request(ca, stack))
+        return run_bench(ca, request)
+
+    def run_watch(self, ca: CommandArgs) -> ExitCode:
+        """ Poll the resource, and print the response whenever it changes. """
+        condition = None
+        if ca.ns.until is not None:
+            try:
+                condition = watch.Condition.parse(ca.ns.until)
+            except ValueError as e:
+                print(f'ERROR: {e}', file=sys.stderr)
+                return ExitInvalidArgs
+
+        with contextlib.ExitStack() as stack:
+            request = bench.replayable(self.build_request(ca, stack))
+        watcher = watch.Watcher(request)
+        session = build_session(ca)
+        last_error = None
+        try:
+            for _ in watch.ticks(ca.ns.watch):
+                try:
+                    change = watcher.poll(verbose=ca.ns.verbose,
+                                          logging_cb=lambda msg: print(msg),
+                                          session=session)
+                except (restapi.ConnectionError, restapi.TimeoutError,
+                        restapi.TransferError) as e:
+                    # Keep polling until the server comes back.
+                    error = WATCH_ERRORS[type(e)]
+                    if error != last_error:
+                        print(f'ERROR: {error}', file=sys.stderr)
+                    last_error = error
+                    continue
+                last_error = None
+                if change is None:
+                    continue
+
+                self.print_change(ca, change)
+                if condition is not None and condition.matches(change.body):
+                    return ExitOk
+        except KeyboardInterrupt:
+            return ExitInterrupted
+        finally:
+            session.close()
+        return ExitOk
+
+    def paginate(self, ca: CommandArgs) -> ExitCode:
+        """ Fetch all pages, and write their items to stdout. """
+        try:
+            pager = paginate.Pager(
+                items_path=None if ca.ns.items_path is None else
+                jsonpath.parse(ca.ns.items_path),
+                cursor_path=None if ca.ns.cursor_path is None else
+                jsonpath.parse(ca.ns.cursor_path),
+                cursor_param=ca.ns.cursor_param,
+                offset_param=ca.ns.offset_param,
+                max_pages=ca.ns.max_pages,
+            )
+        except ValueError as e:
+            print(f'ERROR: {e}', file=sys.stderr)
+            return ExitInvalidArgs
+
+        with contextlib.ExitStack() as stack:
+            request = bench.replayable(self.build_request(ca, stack))
+        write = paginate.write_array if ca.ns.merge == 'array' else paginate.write_ndjson
+        with build_session(ca, pool_maxsize=2) as session:
+            try:
+                write(
+                    paginate.pages(request,
+                                   pager,
+                                   verbose=ca.ns.verbose,
+                                   logging_cb=lambda msg: print(msg, file=sys.stderr),
+                                   session=session),
+                    sys.stdout)
+            except paginate.PageError as e:
+                sys.stdout.flush()
+                print(f'ERROR: {e}', file=sys.stderr)
+                return ExitInvalidResponse
+        return ExitOk
+
+    def sweep(self, ca: CommandArgs) -> ExitCode:
+        """ Send a request for each combination of --param values. """
+        try:
+            params = [sweep.Param.parse(p) for p in ca.ns.param]
+        except ValueError as e:
+            print(f'ERROR: {e}', file=sys.stderr)
+            return ExitInvalidArgs
+        names = set(urlutils.placeholders(ca.ns.url))
+        for q in ca.ns.queries:
+            names.update(urlutils.placeholders(q))
+        if names != {p.name for p in params}:
+            print(
+                'ERROR: --param must be given for each {NAME} placeholder in '
+                'the url and queries, and only for them.',
+                file=sys.stderr)
+            return ExitInvalidArgs
+        stdin_params = [p for p in params if p.source == '@-']
+        if len(stdin_params) + (ca.ns.data == '@-') > 1:
+            print('ERROR: stdin can be read by only one of --param and --data.',
+                  file=sys.stderr)
+            return ExitInvalidArgs
+        concurrency = ca.ns.concurrency or batch.DEFAULT_CONCURRENCY
+        if concurrency < 1:
+            print('ERROR: --concurrency must be 1 or more.', file=sys.stderr)
+            return ExitInvalidArgs
+
+        with contextlib.ExitStack() as stack:
+            base = bench.replayable(self.build_request(ca, stack))
+
+        def build(values: sweep.Values) -> restapi.Request:
+            return dataclasses.replace(
+                base,
+                urls=urlutils.concat_urls(
+                    endpoints=ca.conf.endpoints,
+                    url=urlutils.expand_template(ca.ns.url, values),
+                    queries=tuple(
+                        urlutils.expand_template(q, values, escape=False)
+                        for q in ca.ns.queries),
+                ))
+
+        with build_session(ca, pool_maxsize=concurrency) as session:
+            try:
+                for record in sweep.run(sweep.combinations(params, sys.stdin),
+                                        build,
+                                        session,
+                                        concurrency=concurrency):
+                    Batch.print_record(record)
+            except OSError as e:
+                print(f'ERROR: {e}', file=sys.stderr)
+                return ExitInvalidArgs
+        return ExitOk
+
+    def print_change(self, ca: CommandArgs, change: watch.Change):
+        if ca.ns.diff and change.previous is not None:
+            lines = watch.diff_bodies(change.previous.body, change.body)
+            if change.status != change.previous.status:
+                print(f'~ status: {change.previous.status} -> {change.status}')
+            if lines is not None:
+                for line in lines:
+                    print(line)
+                sys.stdout.flush()
+                return
+        # Terminate each body, so that changes are not joined together.
+        body = change.body
+        if not body.endswith(b'\n'):
+            body += b'\n'
+        pprint(body, raw=ca.ns.raw)
+        sys.stdout.flush()
+
+    def execute(self, ca: CommandArgs, offset: int):
+        timed = ca.ns.segments <= 1 and (
+            ca.ns.write_out is not None or ca.ns.timing_json is not None
+            or ca.ns.verbose >= restapi.SHOW_HEADERS)
+        with contextlib.ExitStack() as stack:
+            request = self.build_request(ca, stack, offset)
+            fetch_kwargs = dict(
+                verbose=ca.ns.verbose,
+                logging_cb=lambda msg: print(msg),
+                session=stack.enter_context(
+                    build_session(ca,
+                                  pool_maxsize=ca.ns.segments,
+                                  cache=response_cache(ca),
+                                  timing=timed)),
+            )
+
+            if ca.ns.segments > 1:
+                download.save_segmented(ca.ns.output, request,
+                                        ca.ns.segments, **fetch_kwargs)
+                return
+
+            trace = stack.enter_context(timing.tracing())
+            if timed:
+                # Report timings even if the request failed.
+                stack.callback(self.report_timing, ca, trace)
+            with profiling.phase('network'):
+                response = request.fetch(stream=True, **fetch_kwargs)
+            stack.callback(response.close)
+            # A streamed body is received while it is printed.
+            with telemetry.span('render output'), profiling.phase('render'):
+                self.print_body(ca, response, offset)
+            trace.finish()
+
+    def report_timing(self, ca: CommandArgs, trace: timing.Trace):
+        if trace.end is None:
+            trace.finish()
+        metrics = timing.summary(trace)
+        if ca.ns.verbose >= restapi.SHOW_HEADERS and trace.hops:
+            hop = timing.hop_record(trace, len(trace.hops) - 1)
+            phases = ', '.join(
+                f'{name} {hop[name] * 1000:.1f} ms'
+                for name in ('dns', 'connect', 'tls', 'send', 'wait',
+                             'transfer') if hop[name] is not None)
+            print(f'* Timing: {phases}, total {metrics["time_total"] * 1000:.1f} ms',
+                  file=sys.stderr)
+        if ca.ns.write_out is not None:
+            sys.stdout.write(timing.write_out(ca.ns.write_out, metrics))
+            sys.stdout.flush()
+        if ca.ns.timing_json == '-':
+            print(json.dumps(metrics), file=sys.stderr)
+        elif ca.ns.timing_json is not None:
+            with open(ca.ns.timing_json, 'w') as f:
+                json.dump(metrics, f, indent=2)
+                f.write('\n')
+
+    def print_body(self,
+                   ca: CommandArgs,
+                   response: restapi.Response,
+                   offset: int = 0):
+        """ Write the response body to the output file or stdout.
+
+        The body is never loaded into memory entirely unless it is small enough.
+        """
+        if ca.ns.output is not None:
+            download.save(ca.ns.output, response, offset)
+        elif printutils.is_raw_output(ca.ns.raw):
+            # We don't need to inspect the body before printing.
+            # Write it to stdout as it arrives.
+            printutils.write_stream(response.iter_body())
+        else:
+            with response.spool() as body:
+                size = body.seek(0, os.SEEK_END)
+                body.seek(0)
+                if size <= restapi.SPOOL_SIZE:
+                    pprint(body.read(), raw=ca.ns.raw)
+                else:
+                    printutils.pprint_file(body, raw=ca.ns.raw)
+
+    def parse_data(self, data: typing.Optional[str],
+                   stack: contextlib.ExitStack) -> typing.Optional[restapi.Body]:
+        """ --data引数の値から送信するデータを作る
+
+        "@FILE" and "@-" are not loaded into memory.  They are sent as a stream.
+        Opened files are closed when the stack is closed.
+        """
         if data is None:
             return None
+        elif data == '@-':
+            stdin = sys.stdin.buffer
+            return iter(lambda: stdin.read(restapi.CHUNK_SIZE), b'')
         elif data.startswith('@'):
             fname = data[1:]
-            with open(fname, 'rb') as f:
-                return f.read()
+            return stack.enter_context(open(fname, 'rb'))
         else:
             return bytes(data, 'utf8')
 
-    def detect_data_type(self, data: typing.Optional[bytes]
+    def peek_data(
+            self, data: typing.Optional[restapi.Body]
+    ) -> typing.Tuple[typing.Optional[bytes], bool, typing.Optional[restapi.Body]]:
+        """ Read the head of the data to detect its type.
+
+        Returns a tuple of the head, whether the head is the whole data, and the data
+        to send instead of the given one.
+        """
+        if data is None or isinstance(data, bytes):
+            return data, True, data
+        if hasattr(data, 'read'):
+            f = typing.cast(typing.BinaryIO, data)
+            pos = f.tell()
+            head = f.read(DETECT_SIZE + 1)
+            f.seek(pos)
+            return head[:DETECT_SIZE], len(head) <= DETECT_SIZE, data
+
+        # The head of stdin cannot be read again.  Send it before the rest.
+        it = iter(typing.cast(typing.Iterable[bytes], data))
+        head = b''
+        for chunk in it:
+            head += chunk
+            if len(head) > DETECT_SIZE:
+                break
+        else:
+            return head, True, head
+        return head[:DETECT_SIZE], False, itertools.chain([head], it)
+
+    def detect_data_type(self, data: typing.Optional[bytes],
+                         complete: bool = True
                          ) -> typing.Tuple[config.HttpHeader, ...]:
-        """ --data引数で指定したデータのタイプを判別し、適切なcontent-typeヘッダーを返す  """
+        """ --data引数で指定したデータのタイプを判別し、適切なcontent-typeヘッダーを返す
+
+        If complete is False, data is the head of the whole data.  JSON is detected by
+        its first character instead of parsing it.
+        """
         if data is None:
             return tuple()
-        if printutils.is_unicode_string(data):
-            if printutils.is_json(data):
+        if complete:
+            if printutils.is_unicode_string(data):
+                if printutils.is_json(data):
+                    return config.HttpHeader('content-type', 'application/json'),
+                return config.HttpHeader('content-type', 'text/plain'),
+        elif printutils.is_unicode_prefix(data):
+            if data.lstrip()[:1] in (b'{', b'['):
                 return config.HttpHeader('content-type', 'application/json'),
             return config.HttpHeader('content-type', 'text/plain'),
         return config.HttpHeader('content-type', 'application/octet-stream'),
@@ -282,14 +974,15 @@ class Jsonrpc(SubCommand):
         p.add_argument('-H', '--header', action='append')
         p.add_argument('--accept')
         p.add_argument('--content-type', '--type')
+        add_compression_arguments(p)
+        add_transport_arguments(p)
+        add_trace_arguments(p)
+        add_bench_arguments(p)
         p.add_argument('method')
         p.add_argument('args', nargs='*')
 
     def __call__(self, ca: CommandArgs) -> ExitCode:
-        default_headers = (
-            config.HttpHeader('content-type', 'application/json'),
-            config.HttpHeader('accept', 'application/json'),
-        )
+        default_headers = jsonrpc.DEFAULT_HEADERS
 
         convert: typing.Callable
         if ca.ns.raw_input:
@@ -309,44 +1002,230 @@ class Jsonrpc(SubCommand):
             params = None
         req = jsonrpc.Request(ca.ns.method, params)
 
+        if ca.ns.compressed:
+            default_headers += compression.accept_encoding(),
+
+        endpoint = jsonrpc.Endpoint(
+            urls=ca.conf.endpoints,
+            headers=default_headers + ca.conf.headers + parse_headers(ca.ns),
+            basic=ca.conf.basic,
+            compression=ca.ns.compress_request,
+        )
         try:
-            res = jsonrpc.Endpoint(
-                urls=ca.conf.endpoints,
-                headers=default_headers + ca.conf.headers + parse_headers(ca.ns),
-                basic=ca.conf.basic,
-            ).send(
-                req,
-                verbose=ca.ns.verbose,
-                logging_cb=lambda msg: print(msg),
-            )
+            if ca.ns.bench:
+                return run_bench(ca,
+                                 bench.replayable(endpoint.build_request(req)),
+                                 check=jsonrpc.Endpoint.parse_response)
+            with profiling.phase('network'), build_session(ca) as session:
+                res = endpoint.send(
+                    req,
+                    verbose=ca.ns.verbose,
+                    logging_cb=lambda msg: print(msg),
+                    session=session,
+                )
         except restapi.ConnectionError:
             print(
                 'ERROR: Could not connect to server.\n'
                 'Please check endpoint urls and HTTP server status.',
                 file=sys.stderr)
             return ExitFailedToConnect
+        except restapi.TimeoutError:
+            print(
+                'ERROR: Operation timed out.\n'
+                'Please check HTTP server status or increase --max-time.',
+                file=sys.stderr)
+            return ExitOperationTimeout
         except jsonrpc.ErrorResponse as e:
             pprint(e.json, raw=ca.ns.raw)
             return ExitInvalidResponse
+        except compression.CompressionError as e:
+            print(f'ERROR: {e}', file=sys.stderr)
+            return ExitFailedToInit
 
         try:
-            pprint(res, raw=ca.ns.raw)
+            with telemetry.span('render output'), profiling.phase('render'):
+                pprint(res, raw=ca.ns.raw)
             return ExitOk
         except printutils.SubprocessError:
             return ExitSubprocessError
 
 
+class Batch(SubCommand):
+    NAME = 'batch'
+
+    def build_in(self, p: argparse.ArgumentParser):
+        p.add_argument('-c',
+                       '--concurrency',
+                       type=int,
+                       default=batch.DEFAULT_CONCURRENCY)
+        p.add_argument('--order',
+                       choices=('input', 'completion'),
+                       default='input')
+        p.add_argument('--body-dir', metavar='DIR')
+        p.add_argument('--engine', choices=('thread', 'async'), default='thread')
+        add_transport_arguments(p)
+        p.add_argument('file', nargs='?', default='-')
+
+    def __call__(self, ca: CommandArgs) -> ExitCode:
+        if ca.ns.concurrency < 1:
+            print('ERROR: --concurrency must be 1 or more.', file=sys.stderr)
+            return ExitInvalidArgs
+        if ca.ns.body_dir is not None:
+            os.makedirs(ca.ns.body_dir, exist_ok=True)
+
+        with contextlib.ExitStack() as stack:
+            if ca.ns.file == '-':
+                lines: typing.Iterable[str] = sys.stdin
+            else:
+                try:
+                    lines = stack.enter_context(open(ca.ns.file))
+                except OSError as e:
+                    print(f'ERROR: {e}', file=sys.stderr)
+                    return ExitInvalidArgs
+            if ca.ns.engine == 'async':
+                proxied = [e for e in ca.conf.endpoints if aio.proxy_for(e)]
+                if proxied:
+                    print(
+                        f'ERROR: A proxy is configured for {proxied[0]}, but '
+                        '--engine async does not support proxies.\n'
+                        'Add the host to NO_PROXY, or use --engine thread.',
+                        file=sys.stderr)
+                    return ExitInvalidArgs
+                asyncio.run(self.run_async(ca, lines))
+                return ExitOk
+
+            session = stack.enter_context(
+                build_session(ca, pool_maxsize=ca.ns.concurrency))
+            results = batch.run(
+                lines,
+                conf=ca.conf,
+                session=session,
+                concurrency=ca.ns.concurrency,
+                ordered=ca.ns.order == 'input',
+                body_dir=ca.ns.body_dir,
+            )
+            for record in results:
+                self.print_record(record)
+        return ExitOk
+
+    async def run_async(self, ca: CommandArgs, lines: typing.Iterable[str]):
+        options = transport_options(ca, pool_maxsize=ca.ns.concurrency)
+        policy = retry_options(ca)
+        async with aio.AsyncSession(
+                options,
+                affinity=affinity_cache(ca, options),
+                retry=policy,
+                breaker=circuit_breaker(ca, policy),
+                metrics=metrics_log(ca)) as session:
+            results = batch.run_async(
+                lines,
+                conf=ca.conf,
+                session=session,
+                concurrency=ca.ns.concurrency,
+                ordered=ca.ns.order == 'input',
+                body_dir=ca.ns.body_dir,
+            )
+            async for record in results:
+                self.print_record(record)
+
+    @staticmethod
+    def print_record(record: dict):
+        print(json.dumps(record, ensure_ascii=False), flush=True)
+
+
+class Replay(SubCommand):
+    NAME = 'replay'
+
+    def build_in(self, p: argparse.ArgumentParser):
+        p.add_argument('--speed', type=float, default=1.0)
+        p.add_argument('-c',
+                       '--concurrency',
+                       type=int,
+                       default=replay.DEFAULT_CONCURRENCY)
+        add_transport_arguments(p)
+        p.add_argument('file', nargs='?', default='-')
+
+    def __call__(self, ca: CommandArgs) -> ExitCode:
+        if ca.ns.concurrency < 1 or ca.ns.speed < 0:
+            print(
+                'ERROR: --concurrency must be 1 or more, and --speed must not '
+                'be negative.',
+                file=sys.stderr)
+            return ExitInvalidArgs
+
+        with contextlib.ExitStack() as stack:
+            if ca.ns.file == '-':
+                lines: typing.Iterable[str] = sys.stdin
+            else:
+                try:
+                    lines = stack.enter_context(replay.open_log(ca.ns.file))
+                except OSError as e:
+                    print(f'ERROR: {e}', file=sys.stderr)
+                    return ExitInvalidArgs
+            session = stack.enter_context(
+                build_session(ca, pool_maxsize=ca.ns.concurrency))
+            stats = replay.replay(
+                lines,
+                conf=ca.conf,
+                session=session,
+                speed=ca.ns.speed,
+                concurrency=ca.ns.concurrency,
+            )
+        print(replay.report(stats))
+        return ExitOk
+
+
+class Stats(SubCommand):
+    NAME = 'stats'
+
+    def build_in(self, p: argparse.ArgumentParser):
+        p.add_argument('--by', action='append', choices=metrics.KEYS)
+        p.add_argument('--window', metavar='DURATION')
+        p.add_argument('--since', metavar='DURATION')
+
+    def __call__(self, ca: CommandArgs) -> ExitCode:
+        try:
+            window = None if ca.ns.window is None else metrics.parse_duration(
+                ca.ns.window)
+            since = None if ca.ns.since is None else metrics.parse_duration(
+                ca.ns.since)
+        except ValueError as e:
+            print(f'ERROR: {e}', file=sys.stderr)
+            return ExitInvalidArgs
+        keys = ca.ns.by or ('endpoint', 'path')
+
+        log = metrics.Log(config.state_path(ca.conf_file, 'metrics'),
+                          backups=ca.conf.metrics.backups)
+        groups = metrics.aggregate(
+            log.read(),
+            keys,
+            window=window,
+            since=None if since is None else time.time() - since)
+        if not groups:
+            print(
+                'No metrics recorded.  Enable them with --metrics, or set '
+                '"metrics": {"enabled": true} in the config file.',
+                file=sys.stderr)
+            return ExitOk
+        print(metrics.report(groups, keys, window=window is not None))
+        return ExitOk
+
+
 ################################################################
 # Top level commands
 class ApicallCommand(TopCommand):
     def build(self) -> argparse.ArgumentParser:
         p = argparse.ArgumentParser(prog='apicall')
         p.set_defaults(fn=self, format_help=p.format_help)
+        add_profile_arguments(p)
         sp = p.add_subparsers()
         Auth().add_to(sp)
         Endpoint().add_to(sp)
         Rest().add_to(sp)
         Jsonrpc().add_to(sp)
+        Batch().add_to(sp)
+        Replay().add_to(sp)
+        Stats().add_to(sp)
         return p
 
 
@@ -357,6 +1236,7 @@ class RestcallCommand(TopCommand):
         rest = Rest()
         p.set_defaults(fn=rest, format_help=p.format_help)
         rest.build_in(p)
+        add_profile_arguments(p)
         return p
 
 
@@ -367,6 +1247,7 @@ class JsonrpccallCommand(TopCommand):
         jr = Jsonrpc()
         p.set_defaults(fn=jr, format_help=p.format_help)
         jr.build_in(p)
+        add_profile_arguments(p)
         return p
 
 
@@ -378,17 +1259,33 @@ class ParseResult(typing.NamedTuple):
     output: str
 
 
-def parse(prog, args) -> ParseResult:
+def top_command(prog) -> TopCommand:
     basename = os.path.basename(prog)
-
-    cmd: TopCommand
     if basename == 'restcall':
-        cmd = RestcallCommand()
+        return RestcallCommand()
     elif basename == 'jsonrpccall':
-        cmd = JsonrpccallCommand()
+        return JsonrpccallCommand()
     else:
-        cmd = ApicallCommand()
+        return ApicallCommand()
 
+
+def value_options(prog) -> typing.FrozenSet[str]:
+    """ Returns options which require a value (e.g. "-H") in any subcommand. """
+    options: typing.Set[str] = set()
+    parsers = [top_command(prog).build()]
+    while parsers:
+        p = parsers.pop()
+        for action in p._actions:
+            if isinstance(action, argparse._SubParsersAction):
+                parsers.extend(action.choices.values())
+            elif action.option_strings and action.nargs not in (
+                    0, argparse.OPTIONAL):
+                options.update(action.option_strings)
+    return frozenset(options)
+
+
+def parse(prog, args) -> ParseResult:
+    cmd = top_command(prog)
     ns: typing.Optional[argparse.Namespace] = None
     output = io.StringIO()
     exit_code = None
@@ -0,0 +1,261 @@
+""" Execute requests described in JSON Lines.
+
+1行に1つのリクエストを記述したJSONLを読み込み、コネクションを再利用しながら
+並行して実行する。結果もJSONLで出力する。
+
+A line is a JSON object like the following.  "type" defaults to "rest".
+
+    {"method": "GET", "url": "/users", "queries": {"name": "bob"}, "headers": {"x-trace": "1"}}
+    {"method": "POST", "url": "/users", "data": {"name": "bob"}}
+    {"type": "jsonrpc", "method": "get_account", "params": [10]}
+
+"id" is copied to the result as is, to match results with requests.
+"""
+import os
+import json
+import time
+import base64
+import typing
+import requests
+from . import config
+from . import restapi
+from . import jsonrpc
+from . import urlutils
+from . import printutils
+from . import transport
+from . import aio
+from . import workers
+
+DEFAULT_CONCURRENCY = 8
+
+
+class SpecError(Exception):
+    """ The request spec is invalid. """
+    pass
+
+
+def _headers(spec: dict) -> typing.Tuple[config.HttpHeader, ...]:
+    headers = spec.get('headers') or {}
+    if not isinstance(headers, dict):
+        raise SpecError('"headers" must be an object.')
+    return tuple(config.HttpHeader(k, str(v)) for k, v in headers.items())
+
+
+def _queries(spec: dict) -> typing.Tuple[str, ...]:
+    queries = spec.get('queries') or []
+    if isinstance(queries, dict):
+        return tuple(f'{k}={v}' for k, v in queries.items())
+    if isinstance(queries, list):
+        return tuple(str(q) for q in queries)
+    raise SpecError('"queries" must be an object or an array.')
+
+
+def _data(spec: dict
+          ) -> typing.Tuple[typing.Optional[bytes], typing.Tuple[config.HttpHeader, ...]]:
+    """ Returns the request body and its content-type header. """
+    if 'data' not in spec:
+        return None, tuple()
+
+    data = spec['data']
+    if isinstance(data, str):
+        body = data.encode()
+        if printutils.is_json(body):
+            return body, (config.HttpHeader('content-type',
+                                            'application/json'), )
+        return body, (config.HttpHeader('content-type', 'text/plain'), )
+    # Other values are sent as JSON.
+    return json.dumps(data).encode(), (config.HttpHeader(
+        'content-type', 'application/json'), )
+
+
+def _string(spec: dict, key: str) -> str:
+    if key not in spec:
+        raise SpecError(f'"{key}" is required.')
+    value = spec[key]
+    if not isinstance(value, str):
+        raise SpecError(f'"{key}" must be a string.')
+    return value
+
+
+def build_request(spec: typing.Any, conf: config.Config) -> restapi.Request:
+    """ Build a request from the spec with the endpoints, headers and auth of conf. """
+    if not isinstance(spec, dict):
+        raise SpecError('The request spec must be an object.')
+    method = _string(spec, 'method')
+
+    kind = spec.get('type', 'rest')
+    if kind == 'jsonrpc':
+        return jsonrpc.Endpoint(
+            urls=conf.endpoints,
+            headers=jsonrpc.DEFAULT_HEADERS + conf.headers + _headers(spec),
+            basic=conf.basic,
+        ).build_request(jsonrpc.Request(method, spec.get('params')))
+    if kind != 'rest':
+        raise SpecError(f'Unknown type: {kind}')
+
+    url = _string(spec, 'url')
+    data, data_type = _data(spec)
+    return restapi.Request(
+        method=method,
+        urls=urlutils.concat_urls(
+            endpoints=conf.endpoints,
+            url=url,
+            queries=_queries(spec),
+        ),
+        headers=data_type + conf.headers + _headers(spec),
+        basic=conf.basic,
+        data=data,
+    )
+
+
+def body_record(body: bytes) -> dict:
+    """ Returns the fields to show the body in a result. """
+    if printutils.is_unicode_string(body):
+        return {'body': body.decode()}
+    return {'body_base64': base64.b64encode(body).decode()}
+
+
+def _start(index: int, line: str) -> typing.Tuple[dict, typing.Any]:
+    """ Parse the line, and returns the result record and the request spec. """
+    record: typing.Dict[str, typing.Any] = {'index': index}
+    try:
+        spec = json.loads(line)
+    except ValueError as e:
+        record['error'] = f'Invalid JSON: {e}'
+        return record, None
+    if isinstance(spec, dict) and 'id' in spec:
+        record['id'] = spec['id']
+    return record, spec
+
+
+def _finish(record: dict, response: restapi.Response,
+            body_dir: typing.Optional[str]):
+    """ Store the response into the record. """
+    try:
+        record['status'] = response.status_code
+        record['url'] = response.url
+        if body_dir is not None:
+            path = os.path.join(body_dir, f'{record["index"]}.body')
+            with open(path, 'wb') as f:
+                response.write_to(f)
+            record['body_path'] = path
+        else:
+            record.update(body_record(b''.join(response.iter_body())))
+    finally:
+        response.close()
+
+
+def _error_message(e: Exception) -> str:
+    if isinstance(e, SpecError):
+        return f'Invalid request spec: {e}'
+    if isinstance(e, restapi.ConnectionError):
+        return 'Could not connect to server.'
+    if isinstance(e, restapi.TimeoutError):
+        return 'Operation timed out.'
+    if isinstance(e, restapi.TransferError):
+        return 'Connection was lost while receiving the response.'
+    # requests.RequestException is also an OSError and a ValueError.
+    if isinstance(e, (requests.RequestException, ValueError, TypeError)):
+        return f'Invalid request: {e}'
+    return f'Could not write the body: {e}'
+
+
+# A record which fails with these errors does not stop the batch.
+_ERRORS = (SpecError, restapi.ConnectionError, restapi.TimeoutError,
+           restapi.TransferError, requests.RequestException, ValueError,
+           TypeError, OSError)
+
+
+def execute(index: int,
+            line: str,
+            conf: config.Config,
+            session: transport.Session,
+            body_dir: typing.Optional[str] = None) -> dict:
+    """ Execute a line of the batch, and returns the result.
+
+    Errors are reported in the "error" field instead of raising exceptions.
+    """
+    record, spec = _start(index, line)
+    if 'error' in record:
+        return record
+    return fetch_record(record, lambda: build_request(spec, conf), session,
+                        body_dir)
+
+
+def fetch_record(record: dict,
+                 build: typing.Callable[[], restapi.Request],
+                 session: transport.Session,
+                 body_dir: typing.Optional[str] = None) -> dict:
+    """ Send the request built by build(), and store the result into the record. """
+    start = time.perf_counter()
+    try:
+        response = build().fetch(session=session, stream=True)
+        _finish(record, response, body_dir)
+    except _ERRORS as e:
+        record['error'] = _error_message(e)
+    record['time'] = round(time.perf_counter() - start, 6)
+    return record
+
+
+async def execute_async(index: int,
+                        line: str,
+                        conf: config.Config,
+                        session: aio.AsyncSession,
+                        body_dir: typing.Optional[str] = None) -> dict:
+    """ The asyncio counterpart of execute(). """
+    record, spec = _start(index, line)
+    if 'error' in record:
+        return record
+
+    start = time.perf_counter()
+    try:
+        response = await aio.fetch(build_request(spec, conf), session=session)
+        _finish(record, response, body_dir)
+    except _ERRORS as e:
+        record['error'] = _error_message(e)
+    record['time'] = round(time.perf_counter() - start, 6)
+    return record
+
+
+def _items(lines: typing.Iterable[str]) -> typing.Iterator[typing.Tuple[int, str]]:
+    return ((i, line) for i, line in enumerate(lines) if line.strip())
+
+
+def run(lines: typing.Iterable[str],
+        conf: config.Config,
+        session: transport.Session,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        ordered: bool = True,
+        body_dir: typing.Optional[str] = None) -> typing.Iterator[dict]:
+    """ Execute all lines, and yields the results.
+
+    Lines are read only as fast as they are executed.  Empty lines are skipped,
+    but they are counted in the "index" field, so it is the line number from 0.
+    """
+    return workers.imap_bounded(
+        lambda item: execute(item[0], item[1], conf, session, body_dir),
+        _items(lines),
+        concurrency=concurrency,
+        ordered=ordered,
+    )
+
+
+def run_async(lines: typing.Iterable[str],
+              conf: config.Config,
+              session: aio.AsyncSession,
+              concurrency: int = DEFAULT_CONCURRENCY,
+              ordered: bool = True,
+              body_dir: typing.Optional[str] = None
+              ) -> typing.AsyncIterator[dict]:
+    """ The asyncio counterpart of run().
+
+    The number of connections is limited by the pool size of the session.
+    Lines are read in a thread, so that waiting for stdin does not block the
+    event loop.
+    """
+    return workers.amap_bounded(
+        lambda item: execute_async(item[0], item[1], conf, session, body_dir),
+        workers.aiter_in_thread(_items(lines)),
+        concurrency=concurrency,
+        ordered=ordered,
+    )
@@ -0,0 +1,270 @@
+""" Load testing by repeating a request.
+
+同じリクエストを繰り返し送信し、レイテンシの分布とスループットを計測する。
+
+* Closed loop: `concurrency` workers send the next request as soon as the
+  previous one completes.
+* Open loop: requests are started at `rate` per second regardless of the
+  responses.  Latency is measured from the scheduled start time, so requests
+  delayed by a slow server are not hidden (no coordinated omission).
+
+Worker processes run the same plan with a share of the requests, and their
+histograms are merged.
+"""
+import math
+import itertools
+import time
+import typing
+import collections
+import dataclasses
+import urllib.parse
+import multiprocessing
+import requests
+from tabulate import tabulate  # type: ignore
+from . import config
+from . import restapi
+from . import transport
+from . import workers
+from .histogram import Histogram
+
+DEFAULT_REQUESTS = 100
+DEFAULT_CONCURRENCY = 1
+# Maximum number of requests in flight in the open loop mode.
+DEFAULT_OPEN_CONCURRENCY = 100
+PERCENTILES = (50, 90, 99, 99.9)
+
+# A function to validate the response.  It raises an exception to count the
+# response as an error.
+Check = typing.Callable[[restapi.Response], typing.Any]
+
+
+class Plan(typing.NamedTuple):
+    requests: int
+    concurrency: int
+    # Requests per second in the open loop mode.  None for the closed loop mode.
+    rate: typing.Optional[float] = None
+
+
+class Sample(typing.NamedTuple):
+    endpoint: str
+    status: typing.Optional[int]
+    error: typing.Optional[str]
+    # Microseconds.
+    latency: int
+    ttfb: typing.Optional[int]
+
+
+@dataclasses.dataclass
+class Stats:
+    latency: Histogram = dataclasses.field(default_factory=Histogram)
+    ttfb: Histogram = dataclasses.field(default_factory=Histogram)
+    statuses: typing.Counter[int] = dataclasses.field(
+        default_factory=collections.Counter)
+    errors: typing.Counter[str] = dataclasses.field(
+        default_factory=collections.Counter)
+    endpoints: typing.Dict[str, Histogram] = dataclasses.field(
+        default_factory=dict)
+    # Wall clock time of the run in seconds.
+    elapsed: float = 0.0
+
+    def add(self, sample: Sample):
+        self.latency.record(sample.latency)
+        if sample.ttfb is not None:
+            self.ttfb.record(sample.ttfb)
+        if sample.status is not None:
+            self.statuses[sample.status] += 1
+        if sample.error is not None:
+            self.errors[sample.error] += 1
+        self.endpoints.setdefault(sample.endpoint,
+                                  Histogram()).record(sample.latency)
+
+    def merge(self, other: 'Stats'):
+        self.latency.merge(other.latency)
+        self.ttfb.merge(other.ttfb)
+        self.statuses.update(other.statuses)
+        self.errors.update(other.errors)
+        for endpoint, h in other.endpoints.items():
+            self.endpoints.setdefault(endpoint, Histogram()).merge(h)
+        self.elapsed = max(self.elapsed, other.elapsed)
+
+    @property
+    def throughput(self) -> float:
+        if self.elapsed <= 0:
+            return 0.0
+        return self.latency.count / self.elapsed
+
+
+def replayable(request: restapi.Request) -> restapi.Request:
+    """ Read a streamed body into memory, so that it can be sent many times. """
+    if request.data is None or isinstance(request.data, bytes):
+        return request
+    return dataclasses.replace(request,
+                               data=b''.join(restapi.iter_chunks(
+                                   request.data)))
+
+
+def _origin(url: str) -> str:
+    u = urllib.parse.urlsplit(url)
+    return f'{u.scheme}://{u.netloc}'
+
+
+def _send(request: restapi.Request, session: transport.Session,
+          start: typing.Optional[float],
+          check: typing.Optional[Check]) -> Sample:
+    """ Send the request, and measure the latency.
+
+    If start is given, the request is sent at start and the latency is measured
+    from it, even if the request could not be sent in time.
+    """
+    if start is None:
+        start = time.perf_counter()
+    else:
+        delay = start - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    endpoint = '-'
+    status = None
+    ttfb = None
+    error = None
+    try:
+        response = request.fetch(session=session)
+        endpoint = _origin(response.url)
+        status = response.status_code
+        ttfb = int(response.turnaround_time.total_seconds() * 1e6)
+        if status >= 400:
+            error = f'HTTP {status}'
+        elif check is not None:
+            try:
+                check(response)
+            except Exception as e:
+                error = type(e).__name__
+    except restapi.ConnectionError:
+        error = 'connection failed'
+    except restapi.TimeoutError:
+        error = 'timed out'
+    except restapi.TransferError:
+        error = 'connection lost'
+    except (requests.RequestException, ValueError) as e:
+        # e.g. too many redirects.  The run goes on, and the error is counted.
+        error = type(e).__name__
+    latency = int((time.perf_counter() - start) * 1e6)
+    return Sample(endpoint, status, error, latency, ttfb)
+
+
+def run(request: restapi.Request,
+        plan: Plan,
+        options: typing.Optional[config.Transport] = None,
+        check: typing.Optional[Check] = None) -> Stats:
+    """ Send the request according to the plan in this process. """
+    request = replayable(request)
+    options = dataclasses.replace(options or config.Transport(),
+                                  pool_maxsize=plan.concurrency)
+    stats = Stats()
+
+    with transport.Session(options) as session:
+        began = time.perf_counter()
+        schedule: typing.Iterable[typing.Optional[float]]
+        if plan.rate:
+            interval = 1.0 / plan.rate
+            schedule = (began + i * interval for i in range(plan.requests))
+        else:
+            # Start as soon as a worker is free.
+            schedule = itertools.repeat(None, plan.requests)
+        samples = workers.imap_bounded(
+            lambda start: _send(request, session, start, check),
+            schedule,
+            concurrency=plan.concurrency,
+            ordered=False,
+        )
+        for sample in samples:
+            stats.add(sample)
+        stats.elapsed = time.perf_counter() - began
+    return stats
+
+
+def _run_worker(args) -> Stats:
+    return run(*args)
+
+
+def split(plan: Plan, processes: int) -> typing.List[Plan]:
+    """ Divide the plan into plans of worker processes. """
+    processes = max(1, min(processes, plan.requests))
+    plans = []
+    for i in range(processes):
+        requests = plan.requests // processes + (
+            1 if i < plan.requests % processes else 0)
+        plans.append(
+            Plan(
+                requests=requests,
+                concurrency=max(1, math.ceil(plan.concurrency / processes)),
+                rate=plan.rate / processes if plan.rate else None,
+            ))
+    return plans
+
+
+def run_parallel(request: restapi.Request,
+                 plan: Plan,
+                 processes: int,
+                 options: typing.Optional[config.Transport] = None,
+                 check: typing.Optional[Check] = None) -> Stats:
+    """ Run the plan with worker processes, and returns the merged stats. """
+    if processes <= 1:
+        return run(request, plan, options, check)
+
+    request = replayable(request)
+    plans = split(plan, processes)
+    stats = Stats()
+    with multiprocessing.Pool(len(plans)) as pool:
+        for s in pool.imap_unordered(_run_worker,
+                                     [(request, p, options, check)
+                                      for p in plans]):
+            stats.merge(s)
+    return stats
+
+
+def _ms(us: typing.Optional[float]) -> str:
+    return f'{(us or 0) / 1000:.2f}'
+
+
+def report(stats: Stats) -> str:
+    """ Returns a human-readable summary of the stats. """
+    lines = [
+        f'Requests:   {stats.latency.count}',
+        f'Errors:     {sum(stats.errors.values())}',
+        f'Elapsed:    {stats.elapsed:.2f} s',
+        f'Throughput: {stats.throughput:.1f} req/s',
+        '',
+    ]
+
+    rows = []
+    for name, h in (('latency', stats.latency), ('ttfb', stats.ttfb)):
+        if h.count == 0:
+            continue
+        rows.append((name, _ms(h.min), _ms(h.mean)) +
+                    tuple(_ms(h.percentile(p))
+                          for p in PERCENTILES) + (_ms(h.max), ))
+    lines.append(
+        tabulate(rows,
+                 headers=('(ms)', 'MIN', 'MEAN') +
+                 tuple(f'P{p:g}' for p in PERCENTILES) + ('MAX', ),
+                 disable_numparse=True))
+
+    if stats.statuses:
+        lines.append('')
+        lines.append(
+            tabulate(sorted(stats.statuses.items()),
+                     headers=('STATUS', 'COUNT')))
+    if stats.errors:
+        lines.append('')
+        lines.append(
+            tabulate(stats.errors.most_common(), headers=('ERROR', 'COUNT')))
+
+    lines.append('')
+    lines.append(
+        tabulate([(endpoint, h.count, _ms(h.percentile(50)),
+                   _ms(h.percentile(99)))
+                  for endpoint, h in sorted(stats.endpoints.items())],
+                 headers=('ENDPOINT', 'REQUESTS', 'P50(ms)', 'P99(ms)'),
+                 disable_numparse=True))
+    return '\n'.join(lines)
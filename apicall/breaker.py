@@ -0,0 +1,106 @@
+""" Per-endpoint circuit breaker.
+
+失敗が続いたエンドポイントへの接続をしばらく止める。状態は設定ファイルの隣に
+保存され、同じエンドポイントを使う後続のプロセスにも引き継がれる。
+同時に動くプロセスの失敗は、保存の前に読み直して合わせる。
+
+* closed:    Requests are sent.  Consecutive failures are counted.
+* open:      The endpoint is skipped for `cooldown` seconds after `threshold`
+             consecutive failures.
+* half-open: After the cooldown, requests are sent again.  A success closes the
+             circuit, and a failure opens it again.
+"""
+import time
+import typing
+import threading
+import urllib.parse
+from . import statefile
+
+
+def _origin(url: str) -> str:
+    u = urllib.parse.urlsplit(url)
+    return f'{u.scheme}://{u.netloc}'
+
+
+class CircuitBreaker:
+    """ Tracks failures of endpoints.  Endpoints are identified by the origin of urls.
+
+    :ivar path: Path to the state file.  None keeps the state only in memory.
+    :ivar threshold: Consecutive failures to open the circuit.
+    :ivar cooldown: Seconds to keep the circuit open.
+    """
+
+    def __init__(self, path: typing.Optional[str], threshold: int,
+                 cooldown: float):
+        self.path = path
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._state: typing.Dict[str, dict] = self._read()
+
+    def _read(self) -> typing.Dict[str, dict]:
+        if self.path is None:
+            return {}
+        now = time.time()
+        state = {}
+        for origin, entry in (statefile.read(self.path) or {}).items():
+            # Forget old failures.  Keep entries a little longer than the
+            # cooldown, so that a failure in the half-open state reopens it.
+            if isinstance(entry, dict) and \
+                    now - entry.get('updated', 0) < 2 * self.cooldown:
+                state[origin] = entry
+        return state
+
+    def is_open(self, url: str) -> bool:
+        with self._lock:
+            entry = self._state.get(_origin(url))
+            if entry is None or entry.get('opened') is None:
+                return False
+            return time.time() - entry['opened'] < self.cooldown
+
+    def succeeded(self, url: str):
+        origin = _origin(url)
+        with self._lock:
+            self._merge()
+            if origin in self._state:
+                # Saved instead of removing the entry, so that merging in other
+                # processes closes the circuit too.
+                self._state[origin] = {'failures': 0, 'updated': time.time()}
+                self._save()
+
+    def failed(self, url: str):
+        now = time.time()
+        with self._lock:
+            self._merge()
+            entry = self._state.setdefault(_origin(url), {'failures': 0})
+            entry['failures'] += 1
+            entry['updated'] = now
+            if entry['failures'] >= self.threshold:
+                entry['opened'] = now
+            self._save()
+
+    def _merge(self):
+        """ Take in what other processes have saved since the file was read.
+
+        The larger count and the later times win, so that processes sharing the
+        file do not overwrite each other's failures.  Failures recorded at the
+        same moment by two processes may still be counted once.  An entry
+        cleared by a success (no failures) is merged by the later update.
+        """
+        for origin, theirs in self._read().items():
+            mine = self._state.setdefault(origin, theirs)
+            if mine is theirs:
+                continue
+            if mine['failures'] == 0 or theirs.get('failures', 0) == 0:
+                if theirs.get('updated', 0) > mine.get('updated', 0):
+                    self._state[origin] = theirs
+                continue
+            mine['failures'] = max(mine['failures'], theirs.get('failures', 0))
+            for key in ('updated', 'opened'):
+                times = [t for t in (mine.get(key), theirs.get(key)) if t]
+                if times:
+                    mine[key] = max(times)
+
+    def _save(self):
+        if self.path is not None:
+            statefile.write(self.path, self._state)
@@ -0,0 +1,143 @@
+""" Compression of request and response bodies.
+
+レスポンスの展開はurllib3が行うため、ここでは対応している圧縮形式の通知と、
+リクエストボディのストリーミング圧縮を扱う。
+"""
+import io
+import sys
+import zlib
+import typing
+import urllib3.util.request
+from . import config
+from . import restapi
+
+# Encodings which can be used to compress request bodies.
+REQUEST_ENCODINGS = ('gzip', 'deflate', 'zstd')
+
+
+class CompressionError(Exception):
+    pass
+
+
+class _Compressor(typing.Protocol):
+    def compress(self, data: bytes) -> bytes:
+        ...
+
+    def flush(self) -> bytes:
+        ...
+
+
+def accept_encoding() -> config.HttpHeader:
+    """ Returns the Accept-Encoding header listing all encodings we can decode.
+
+    requests offers gzip and deflate by default.  Decoding of br and zstd depends
+    on optional packages, so the list comes from urllib3.
+    """
+    return config.HttpHeader('accept-encoding',
+                             urllib3.util.request.ACCEPT_ENCODING)
+
+
+def _zstd_compressor() -> _Compressor:
+    try:
+        # Python 3.14 or later.
+        from compression import zstd  # type: ignore
+        return zstd.ZstdCompressor()
+    except ImportError:
+        pass
+    try:
+        from backports import zstd  # type: ignore
+        return zstd.ZstdCompressor()
+    except ImportError:
+        pass
+    try:
+        import zstandard  # type: ignore
+        return zstandard.ZstdCompressor().compressobj()
+    except ImportError:
+        pass
+    raise CompressionError(
+        'zstd compression requires the backports.zstd or zstandard package.')
+
+
+def compressor(encoding: str) -> _Compressor:
+    if encoding == 'gzip':
+        return zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return zlib.compressobj()
+    if encoding == 'zstd':
+        return _zstd_compressor()
+    raise CompressionError(f'Unsupported encoding: {encoding}')
+
+
+class CompressedReader:
+    """ A file-like object that compresses a file body while it is read.
+
+    The size of the compressed body is unknown in advance, so the request is sent
+    with chunked transfer encoding.  It can be rewound to the beginning, so that
+    the body is compressed and sent again on retries and failovers.
+    """
+
+    def __init__(self, body: typing.BinaryIO, encoding: str):
+        self._body = body
+        self._encoding = encoding
+        self._start = body.tell()
+        self._compressor: typing.Optional[_Compressor] = compressor(encoding)
+        self._buffer = b''
+        self._position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = sys.maxsize
+        while len(self._buffer) < size and self._compressor is not None:
+            chunk = self._body.read(restapi.CHUNK_SIZE)
+            if chunk:
+                self._buffer += self._compressor.compress(chunk)
+            else:
+                self._buffer += self._compressor.flush()
+                self._compressor = None
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self._position += len(data)
+        return data
+
+    def __iter__(self) -> typing.Iterator[bytes]:
+        return iter(lambda: self.read(restapi.CHUNK_SIZE), b'')
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """ Rewind the body.  Only seeking to the beginning is supported. """
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('can only rewind to the beginning')
+        self._body.seek(self._start)
+        self._compressor = compressor(self._encoding)
+        self._buffer = b''
+        self._position = 0
+        return 0
+
+
+def _compress_chunks(chunks: typing.Iterable[bytes],
+                     c: _Compressor) -> typing.Iterator[bytes]:
+    for chunk in chunks:
+        data = c.compress(chunk)
+        if data:
+            yield data
+    yield c.flush()
+
+
+def compress(
+    body: restapi.Body, encoding: str
+) -> typing.Union[bytes, CompressedReader, typing.Iterator[bytes]]:
+    """ Compress the body.
+
+    bytes are compressed at once and returned as bytes.  A file (including a
+    multipart body) is compressed while it is read by CompressedReader, which can
+    be rewound to send it again.  Other iterables such as stdin cannot be sent
+    again anyway, so they are compressed by a generator.  Streamed bodies are sent
+    with chunked transfer encoding.
+    """
+    if isinstance(body, bytes):
+        c = compressor(encoding)
+        return c.compress(body) + c.flush()
+    if hasattr(body, 'seek') and hasattr(body, 'tell'):
+        return CompressedReader(typing.cast(typing.BinaryIO, body), encoding)
+    return _compress_chunks(restapi.iter_chunks(body), compressor(encoding))
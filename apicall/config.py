@@ -47,6 +47,82 @@ class BasicAuth:
     password: str
 
 
+@dataclass_json
+@dataclass(frozen=True)
+class Transport:
+    """ Connection settings of the HTTP transport layer.
+
+    :ivar pool_connections: Number of per-host connection pools to cache.
+    :ivar pool_maxsize: Maximum number of connections to keep in each pool.
+    :ivar keep_alive: Reuse connections between requests if True.
+    :ivar race: Race connections to all endpoints instead of trying them one by one.
+    :ivar race_stagger: Delay in seconds between the starts of racing connections.
+    :ivar affinity_ttl: Seconds to remember the last working endpoint.  0 (default)
+        disables it, so that no state file is written unless asked.
+    :ivar connect_timeout: Maximum seconds to connect to an endpoint.
+    :ivar max_time: Maximum seconds for the whole request including failover.
+    """
+    pool_connections: int = 10
+    pool_maxsize: int = 10
+    keep_alive: bool = True
+    race: bool = False
+    race_stagger: float = 0.05
+    affinity_ttl: float = 0.0
+    connect_timeout: typing.Optional[float] = 10.0
+    max_time: typing.Optional[float] = None
+
+
+@dataclass_json
+@dataclass(frozen=True)
+class Retry:
+    """ Retry policy and per-endpoint circuit breaker.
+
+    :ivar max_attempts: Maximum number of attempts including the first one.  1 disables retries.
+    :ivar backoff: Base delay in seconds.  The n-th retry waits a random time up to
+        backoff * 2 ** (n - 1), but not longer than max_backoff.
+    :ivar max_backoff: Maximum delay in seconds.  Longer Retry-After values are not waited for.
+    :ivar statuses: Status codes of responses to retry.
+    :ivar methods: Idempotent methods.  Only they are retried after connection failures or
+        responses other than 429 and 503, because the server may have processed the request.
+    :ivar breaker_threshold: Consecutive failures to open the circuit of an endpoint.  0 disables it.
+    :ivar breaker_cooldown: Seconds to skip the endpoint after the circuit opened.
+    """
+    max_attempts: int = 1
+    backoff: float = 0.5
+    max_backoff: float = 30.0
+    statuses: typing.Tuple[int, ...] = (429, 502, 503, 504)
+    methods: typing.Tuple[str, ...] = ('GET', 'HEAD', 'OPTIONS', 'PUT',
+                                       'DELETE', 'TRACE')
+    breaker_threshold: int = 0
+    breaker_cooldown: float = 30.0
+
+
+@dataclass_json
+@dataclass(frozen=True)
+class Cache:
+    """ On-disk HTTP response cache.
+
+    :ivar enabled: Store responses of GET requests and reuse them while they are fresh.
+    :ivar max_size: Maximum total size of the cache directory in bytes.
+    """
+    enabled: bool = False
+    max_size: int = 100 * 1024 * 1024
+
+
+@dataclass_json
+@dataclass(frozen=True)
+class Metrics:
+    """ Local log of request metrics for apicall stats.
+
+    :ivar enabled: Record the latency and status of each request.
+    :ivar max_size: The log is rotated when it gets larger than this in bytes.
+    :ivar backups: Number of rotated logs to keep.
+    """
+    enabled: bool = False
+    max_size: int = 16 * 1024 * 1024
+    backups: int = 3
+
+
 @dataclass_json
 @dataclass(frozen=True)
 class Config:
@@ -55,6 +131,10 @@ class Config:
     basic: typing.Optional[BasicAuth] = dataclasses.field(default=None)
     endpoints: typing.Tuple[str, ...] = dataclasses.field(
         default=DEFAULT_ENDPOINTS)
+    transport: Transport = dataclasses.field(default_factory=Transport)
+    retry: Retry = dataclasses.field(default_factory=Retry)
+    cache: Cache = dataclasses.field(default_factory=Cache)
+    metrics: Metrics = dataclasses.field(default_factory=Metrics)
 
     def remove_headers(self, names: typing.Iterable[str]) -> Config:
         """ Remove http headers with names.
@@ -142,6 +222,16 @@ class FileSearcher:
         return os.path.expanduser('~/.apicall.json')
 
 
+def state_path(conf_file: str, name: str) -> str:
+    """ Returns the path of a state file placed next to the config file.
+
+    e.g. state_path('/repo/.apicall.json', 'affinity.json') returns
+    '/repo/.apicall.affinity.json'.
+    """
+    dirname = os.path.dirname(os.path.abspath(conf_file))
+    return os.path.join(dirname, '.apicall.' + name)
+
+
 def default() -> typing.Tuple[str, Config]:
     fname = FileSearcher().default_location()
     obj = Config()
@@ -0,0 +1,314 @@
+""" Download response bodies to files.
+
+出力ファイルへの書き込みと、HTTP Rangeリクエストを使った途中からの再開をサポートする。
+"""
+import os
+import re
+import typing
+import dataclasses
+import concurrent.futures
+from . import config
+from . import restapi
+
+# Extended attribute to keep the validator (ETag or Last-Modified) of the downloaded file.
+VALIDATOR_XATTR = 'user.apicall.validator'
+
+DEFAULT_SEGMENT_RETRIES = 3
+
+_CONTENT_RANGE = re.compile(r'bytes\s+(?:(\d+)-(\d+)|\*)/(\d+|\*)')
+
+
+class RangeError(Exception):
+    """ The server returned an unexpected range. """
+    pass
+
+
+class ContentRange(typing.NamedTuple):
+    start: typing.Optional[int]
+    end: typing.Optional[int]
+    total: typing.Optional[int]
+
+
+def parse_content_range(value: str) -> typing.Optional[ContentRange]:
+    """ Parse the Content-Range header. e.g. "bytes 0-99/1000" """
+    m = _CONTENT_RANGE.fullmatch(value.strip())
+    if m is None:
+        return None
+    start, end, total = m.groups()
+    return ContentRange(
+        start=None if start is None else int(start),
+        end=None if end is None else int(end),
+        total=None if total == '*' else int(total),
+    )
+
+
+def validator_of(response: restapi.Response) -> typing.Optional[str]:
+    """ Returns the value usable for If-Range header. """
+    etag = response.headers.get('etag')
+    if etag and not etag.startswith('W/'):
+        # If-Range header accepts only strong ETags.
+        return etag
+    return response.headers.get('last-modified')
+
+
+def save_validator(path: str, response: restapi.Response):
+    """ Remember the validator of the response in an extended attribute of the file. """
+    setxattr = getattr(os, 'setxattr', None)
+    removexattr = getattr(os, 'removexattr', None)
+    if setxattr is None or removexattr is None:
+        return
+
+    validator = validator_of(response)
+    try:
+        if validator is None:
+            removexattr(path, VALIDATOR_XATTR)
+        else:
+            setxattr(path, VALIDATOR_XATTR, validator.encode())
+    except OSError:
+        # The file system does not support extended attributes.
+        pass
+
+
+def load_validator(path: str) -> typing.Optional[str]:
+    getxattr = getattr(os, 'getxattr', None)
+    if getxattr is None:
+        return None
+    try:
+        return getxattr(path, VALIDATOR_XATTR).decode()
+    except OSError:
+        return None
+
+
+def resume_offset(path: str, continue_at: str) -> int:
+    """ Returns the offset to resume.
+
+    continue_at is the value of -C option.  "-" means the size of the existing file.
+    Raises ValueError if it is neither "-" nor a non-negative integer.
+    """
+    if continue_at == '-':
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+    offset = int(continue_at)
+    if offset < 0:
+        raise ValueError(f'Negative offset: {continue_at}')
+    return offset
+
+
+def range_headers(path: str,
+                  offset: int) -> typing.Tuple[config.HttpHeader, ...]:
+    """ Returns headers to request the rest of the file. """
+    if offset <= 0:
+        return tuple()
+
+    headers: typing.Tuple[config.HttpHeader, ...] = (
+        config.HttpHeader('range', f'bytes={offset}-'),
+        # Byte ranges of encoded content cannot be concatenated.
+        config.HttpHeader('accept-encoding', 'identity'),
+    )
+    validator = load_validator(path)
+    if validator is not None:
+        # The server returns the whole content if the resource was changed.
+        headers += config.HttpHeader('if-range', validator),
+    return headers
+
+
+def save(path: str, response: restapi.Response, offset: int = 0) -> int:
+    """ Write the response body to the file.
+
+    If offset is positive, the response is treated as the answer of range_headers()
+    request.  A partial content is appended at the offset, and a full content
+    replaces the file.
+    Returns the number of bytes written.
+    """
+    status = response.status_code
+    if offset > 0 and status == 416:
+        # Range Not Satisfiable.  Maybe the file has already been downloaded.
+        cr = parse_content_range(response.headers.get('content-range', ''))
+        if cr is not None and cr.total == offset:
+            return 0
+        raise RangeError(f'Cannot resume from {offset} bytes.')
+
+    if offset > 0 and status >= 300:
+        # Keep the partially downloaded file.
+        raise RangeError(f'Cannot resume because the server returned {status}.')
+
+    if offset > 0 and status == 206:
+        cr = parse_content_range(response.headers.get('content-range', ''))
+        if cr is None or cr.start != offset:
+            raise RangeError(f'The server returned unexpected range: {cr}')
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            f.truncate(offset)
+            f.seek(offset)
+            # Save the validator first, so that the file can be resumed even
+            # if the transfer is interrupted.
+            save_validator(path, response)
+            size = response.write_to(f)
+    else:
+        # The server ignored the Range header or the resource was changed.
+        # Start over from the beginning.
+        with open(path, 'wb') as f:
+            save_validator(path, response)
+            size = response.write_to(f)
+    return size
+
+
+class Segment(typing.NamedTuple):
+    """ A byte range of the content.  Both start and end are inclusive. """
+    start: int
+    end: int
+
+
+def split(size: int, n: int) -> typing.Tuple[Segment, ...]:
+    """ Split the content into n segments of almost the same size. """
+    n = max(1, min(n, size))
+    step, rest = divmod(size, n)
+    segments = []
+    start = 0
+    for i in range(n):
+        length = step + (1 if i < rest else 0)
+        segments.append(Segment(start, start + length - 1))
+        start += length
+    return tuple(segments)
+
+
+def _preallocate(fd: int, size: int):
+    fallocate = getattr(os, 'posix_fallocate', None)
+    if fallocate is not None:
+        try:
+            fallocate(fd, 0, size)
+            return
+        except OSError:
+            # The file system does not support it.
+            pass
+    os.ftruncate(fd, size)
+
+
+def _fetch_segment(request: restapi.Request, fd: int, segment: Segment,
+                   validator: typing.Optional[str], retries: int,
+                   **fetch_kwargs):
+    """ Download a segment and write it at the position in the file.
+
+    When the connection is lost, the rest of the segment is requested again
+    up to `retries` times.
+    """
+    offset = segment.start
+    for attempt in range(retries + 1):
+        headers = request.headers + (
+            config.HttpHeader('range', f'bytes={offset}-{segment.end}'),
+            config.HttpHeader('accept-encoding', 'identity'),
+        )
+        if validator is not None:
+            headers += config.HttpHeader('if-range', validator),
+        req = dataclasses.replace(request, headers=headers)
+
+        try:
+            response = req.fetch(stream=True, **fetch_kwargs)
+        except restapi.ConnectionError:
+            if attempt == retries:
+                raise
+            continue
+
+        try:
+            if response.status_code != 206:
+                raise RangeError(
+                    f'The server returned {response.status_code} '
+                    f'for a segment.  The resource may have been changed.')
+            cr = parse_content_range(response.headers.get('content-range', ''))
+            if cr is None or cr.start != offset:
+                raise RangeError(f'The server returned unexpected range: {cr}')
+
+            for chunk in response.iter_body():
+                chunk = chunk[:segment.end + 1 - offset]
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+                if offset > segment.end:
+                    return
+            if offset > segment.end:
+                return
+        except restapi.TransferError:
+            if attempt == retries:
+                raise
+        finally:
+            response.close()
+    raise RangeError(f'Could not download the segment {segment}.')
+
+
+def save_segmented(path: str,
+                   request: restapi.Request,
+                   segments: int,
+                   retries: int = DEFAULT_SEGMENT_RETRIES,
+                   **fetch_kwargs) -> int:
+    """ Download the content with concurrent range requests.
+
+    The first byte is requested to find out the content length and whether the
+    server supports range requests.  If it doesn't, the answer is saved as the
+    whole content.  If the content length is unknown, the content is requested
+    again without segmentation.  Otherwise, the rest of the content is split into
+    segments and written in place into the preallocated file.
+    Extra keyword arguments are passed to Request.fetch().  The session should have
+    a connection pool large enough for the segments.
+    Returns the size of the content.
+    """
+    probe_req = dataclasses.replace(
+        request,
+        headers=request.headers + (
+            config.HttpHeader('range', 'bytes=0-0'),
+            config.HttpHeader('accept-encoding', 'identity'),
+        ),
+    )
+    probe = probe_req.fetch(stream=True, **fetch_kwargs)
+    try:
+        if probe.status_code != 206:
+            # Range requests are not supported.
+            return save(path, probe)
+        cr = parse_content_range(probe.headers.get('content-range', ''))
+        if cr is None or cr.total is None:
+            # The content cannot be split without knowing the length.
+            # The probe has only the first byte, so download the whole again.
+            probe.close()
+            return _save_whole(path, request, **fetch_kwargs)
+        first = b''.join(probe.iter_body())[:1]
+        validator = validator_of(probe)
+        total = cr.total
+        # Send all segment requests to the url which answered the probe.
+        request = dataclasses.replace(request, urls=(probe.url, ))
+    finally:
+        probe.close()
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        _preallocate(fd, total)
+        os.pwrite(fd, first, 0)
+        if total > 1:
+            _download_segments(request, fd, total, segments, validator,
+                               retries, **fetch_kwargs)
+    finally:
+        os.close(fd)
+
+    save_validator(path, probe)
+    return total
+
+
+def _save_whole(path: str, request: restapi.Request, **fetch_kwargs) -> int:
+    response = request.fetch(stream=True, **fetch_kwargs)
+    try:
+        return save(path, response)
+    finally:
+        response.close()
+
+
+def _download_segments(request: restapi.Request, fd: int, total: int,
+                       segments: int, validator: typing.Optional[str],
+                       retries: int, **fetch_kwargs):
+    """ Download bytes from 1 to the end concurrently. """
+    with concurrent.futures.ThreadPoolExecutor(segments) as executor:
+        futures = [
+            executor.submit(_fetch_segment, request, fd,
+                            Segment(s.start + 1, s.end + 1), validator,
+                            retries, **fetch_kwargs)
+            for s in split(total - 1, segments)
+        ]
+        for f in futures:
+            f.result()
@@ -0,0 +1,87 @@
+""" Latency histogram with a bounded relative error.
+
+HdrHistogramと同じ対数・線形の2段階のバケットで値を数える。
+記録した値の数によらずメモリ使用量は一定で、複数のヒストグラムを誤差なく合算できる。
+"""
+import typing
+import dataclasses
+
+# Number of bits of each value kept exactly.  2 ** 11 = 2048 sub-buckets keep
+# 3 significant decimal digits, so the relative error is below 0.1%.
+SUB_BUCKET_BITS = 11
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_HALF = _SUB_BUCKETS >> 1
+
+
+def _index_of(value: int) -> int:
+    if value < _SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return _SUB_BUCKETS + (shift - 1) * _HALF + (value >> shift) - _HALF
+
+
+def _range_of(index: int) -> typing.Tuple[int, int]:
+    """ Returns the lowest and highest values counted in the bucket. """
+    if index < _SUB_BUCKETS:
+        return index, index
+    shift, offset = divmod(index - _SUB_BUCKETS, _HALF)
+    shift += 1
+    lowest = (offset + _HALF) << shift
+    return lowest, lowest + (1 << shift) - 1
+
+
+@dataclasses.dataclass
+class Histogram:
+    """ Counts non-negative integer values.  Usually microseconds.
+
+    Percentiles are reported as the highest value of the bucket, so they are
+    never lower than the real values.
+
+    :ivar counts: Number of values in each bucket.  Empty buckets are omitted.
+    """
+    counts: typing.Dict[int, int] = dataclasses.field(default_factory=dict)
+    count: int = 0
+    total: int = 0
+    min: typing.Optional[int] = None
+    max: typing.Optional[int] = None
+
+    def record(self, value: int, count: int = 1):
+        value = max(0, int(value))
+        index = _index_of(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: 'Histogram'):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None
+                                      or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None
+                                      or other.max > self.max):
+            self.max = other.max
+
+    @property
+    def mean(self) -> float:
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+    def percentile(self, p: float) -> int:
+        """ Returns the value at or below which p percent of values fall. """
+        if self.count == 0:
+            return 0
+        rank = max(1, -(-self.count * p // 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(_range_of(index)[1], self.max or 0)
+        return self.max or 0
@@ -0,0 +1,486 @@
+""" On-disk HTTP response cache.
+
+GETリクエストのレスポンスを設定ファイルの隣のディレクトリに保存し、新鮮なうちは
+サーバーに問い合わせずに返す。古くなったらETagやLast-Modifiedで再検証し、
+304が返ればボディを転送せずに保存済みのものを使う。
+
+Layout of the cache directory:
+
+* index/<sha256 of url>.json: Headers of the response variants selected by Vary.
+* bodies/<xx>/<sha256 of body>: Bodies as received, before decoding
+  Content-Encoding.  The same body is stored only once.
+
+* size.json: The running total of the sizes of stored files.
+
+Files are written to temporary files and renamed, so concurrent processes never
+see a half-written file.  A missing file is a cache miss.  When the running
+total exceeds the limit, the directory is scanned and the least recently used
+files are removed.
+"""
+import os
+import time
+import hashlib
+import tempfile
+import datetime
+import contextlib
+import typing
+import email.utils
+import requests
+import requests.adapters
+import requests.structures
+import urllib3
+from . import statefile
+
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+# Remove files until the total size falls below this ratio of the limit, so that
+# the next stores do not exceed the limit and scan the directory again at once.
+_EVICT_RATIO = 0.9
+# Temporary files older than this are left by killed processes.
+_STALE_TEMPORARY = 24 * 3600.0
+# Responses which may be stored without explicit freshness information.
+_STORABLE_STATUSES = (200, 203, 300, 301, 308, 404, 410)
+# Upper limit of the freshness estimated from Last-Modified.
+_HEURISTIC_MAX = 24 * 3600.0
+_MAX_VARIANTS = 8
+# Requests with these headers are sent as is.  The user wants the server's answer.
+_BYPASS_HEADERS = ('range', 'if-match', 'if-none-match', 'if-modified-since',
+                   'if-unmodified-since', 'if-range')
+# Headers of a 304 response which must not replace the stored ones.
+_KEEP_HEADERS = frozenset(('content-length', 'content-encoding',
+                           'transfer-encoding', 'content-range'))
+
+Headers = typing.Mapping[str, str]
+
+
+class Entry(typing.NamedTuple):
+    """ A stored response.
+
+    :ivar url: The url of the final response after redirects.
+    :ivar vary: Request headers named by Vary and their values.
+    :ivar body: SHA-256 of the body.
+    :ivar stored: Epoch seconds when the response was received or revalidated.
+    """
+    url: str
+    status: int
+    reason: str
+    headers: typing.Tuple[typing.Tuple[str, str], ...]
+    vary: typing.Dict[str, typing.Optional[str]]
+    body: str
+    stored: float
+
+    @classmethod
+    def from_json(cls, obj: dict) -> 'Entry':
+        return cls(
+            url=obj['url'],
+            status=obj['status'],
+            reason=obj['reason'],
+            headers=tuple((k, v) for k, v in obj['headers']),
+            vary=obj['vary'],
+            body=obj['body'],
+            stored=obj['stored'],
+        )
+
+    @property
+    def header_dict(self) -> requests.structures.CaseInsensitiveDict:
+        return requests.structures.CaseInsensitiveDict(self.headers)
+
+
+def _directives(value: typing.Optional[str]
+                ) -> typing.Dict[str, typing.Optional[str]]:
+    """ Parse Cache-Control. """
+    result: typing.Dict[str, typing.Optional[str]] = {}
+    for item in (value or '').split(','):
+        name, _, arg = item.strip().partition('=')
+        if name:
+            result[name.lower()] = arg.strip('"') if arg else None
+    return result
+
+
+def _seconds(value: typing.Optional[str]) -> typing.Optional[float]:
+    try:
+        return max(0.0, float(int(value or '')))
+    except ValueError:
+        return None
+
+
+def _parse_date(value: typing.Optional[str]) -> typing.Optional[float]:
+    if not value:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def freshness_lifetime(headers: Headers, received: float) -> float:
+    """ Returns seconds the response is fresh for since it was generated. """
+    cc = _directives(headers.get('cache-control'))
+    max_age = _seconds(cc.get('max-age'))
+    if max_age is not None:
+        return max_age
+
+    date = _parse_date(headers.get('date')) or received
+    if 'expires' in headers:
+        # An invalid date like "0" means "already expired".
+        expires = _parse_date(headers['expires'])
+        return 0.0 if expires is None else max(0.0, expires - date)
+
+    last_modified = _parse_date(headers.get('last-modified'))
+    if last_modified is not None:
+        return min(_HEURISTIC_MAX, max(0.0, (date - last_modified) / 10))
+    return 0.0
+
+
+def current_age(entry: Entry, now: float) -> float:
+    headers = entry.header_dict
+    date = _parse_date(headers.get('date'))
+    apparent = 0.0 if date is None else max(0.0, entry.stored - date)
+    age = max(apparent, _seconds(headers.get('age')) or 0.0)
+    return age + max(0.0, now - entry.stored)
+
+
+def is_fresh(entry: Entry, request_headers: Headers, now: float) -> bool:
+    """ Returns True if the entry can be used without asking the server. """
+    headers = entry.header_dict
+    if 'no-cache' in _directives(headers.get('cache-control')):
+        return False
+    req_cc = _directives(request_headers.get('cache-control'))
+    if 'no-cache' in req_cc or request_headers.get('pragma') == 'no-cache':
+        return False
+
+    age = current_age(entry, now)
+    max_age = _seconds(req_cc.get('max-age'))
+    if max_age is not None and age > max_age:
+        return False
+    return age < freshness_lifetime(headers, entry.stored)
+
+
+def validators(entry: Entry) -> typing.Dict[str, str]:
+    """ Returns headers to revalidate the entry. """
+    headers = entry.header_dict
+    result = {}
+    if 'etag' in headers:
+        result['if-none-match'] = headers['etag']
+    if 'last-modified' in headers:
+        result['if-modified-since'] = headers['last-modified']
+    return result
+
+
+def cacheable_request(method: str, headers: Headers,
+                      data: typing.Any) -> bool:
+    if method.upper() != 'GET' or data is not None:
+        return False
+    if any(name in headers for name in _BYPASS_HEADERS):
+        return False
+    return 'no-store' not in _directives(headers.get('cache-control'))
+
+
+def storable(res: requests.Response) -> bool:
+    if res.status_code not in _STORABLE_STATUSES:
+        return False
+    headers = res.headers
+    cc = _directives(headers.get('cache-control'))
+    if 'no-store' in cc or headers.get('vary', '').strip() == '*':
+        return False
+    # Responses which are never fresh and cannot be revalidated are useless.
+    return 'max-age' in cc or any(
+        name in headers for name in ('expires', 'etag', 'last-modified'))
+
+
+def _vary_of(response_headers: Headers,
+             request_headers: Headers) -> typing.Dict[str, typing.Optional[str]]:
+    names = (name.strip().lower()
+             for name in response_headers.get('vary', '').split(','))
+    return {name: request_headers.get(name) for name in names if name}
+
+
+def _touch(path: str):
+    """ Mark the file as recently used. """
+    with contextlib.suppress(OSError):
+        os.utime(path)
+
+
+def _remove_quietly(path: str):
+    with contextlib.suppress(OSError):
+        os.remove(path)
+
+
+class _Recorder:
+    """ Reads the body from the network and writes it to the cache at the same time.
+
+    The body is stored when it was read to the end.  Otherwise it is discarded.
+    """
+
+    def __init__(self, cache: 'Cache', raw: urllib3.HTTPResponse,
+                 commit: typing.Callable[[str, int], None]):
+        self._cache = cache
+        self._raw = raw
+        self._commit = commit
+        self._hash = hashlib.sha256()
+        self._size = 0
+        self._file: typing.Optional[typing.BinaryIO] = None
+        self._tmp = ''
+        with contextlib.suppress(OSError):
+            os.makedirs(cache.path, exist_ok=True)
+            fd, self._tmp = tempfile.mkstemp(dir=cache.path, prefix='.tmp-')
+            self._file = os.fdopen(fd, 'wb')
+        self.closed = False
+
+    def read(self, amt: typing.Optional[int] = None) -> bytes:
+        data = self._raw.read(amt, decode_content=False)
+        if self._file is not None and data:
+            self._hash.update(data)
+            self._size += len(data)
+            try:
+                self._file.write(data)
+            except OSError:
+                self._discard()
+            if self._size > self._cache.max_size:
+                self._discard()
+        if not data or amt is None:
+            self._finish()
+        return data
+
+    def _finish(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            digest = self._hash.hexdigest()
+            path = self._cache.body_path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self._tmp, path)
+        except OSError:
+            _remove_quietly(self._tmp)
+            return
+        self._commit(digest, self._size)
+
+    def _discard(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        _remove_quietly(self._tmp)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._discard()
+        if self._raw.closed:
+            self._raw.release_conn()
+        else:
+            # The body was not read to the end.
+            self._raw.close()
+
+
+class Cache:
+    """ Stores responses in a directory.
+
+    :ivar path: Path to the cache directory.
+    :ivar max_size: Maximum total size of files in bytes.
+    """
+
+    def __init__(self, path: str, max_size: int = DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._adapter = requests.adapters.HTTPAdapter()
+
+    def index_path(self, url: str) -> str:
+        name = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.path, 'index', name + '.json')
+
+    def body_path(self, digest: str) -> str:
+        return os.path.join(self.path, 'bodies', digest[:2], digest)
+
+    @property
+    def size_path(self) -> str:
+        return os.path.join(self.path, 'size.json')
+
+    def _variants(self, url: str) -> typing.List[Entry]:
+        obj = statefile.read(self.index_path(url)) or {}
+        try:
+            return [Entry.from_json(v) for v in obj.get('variants', ())]
+        except (KeyError, TypeError, ValueError):
+            # Broken or written by another version.
+            return []
+
+    def lookup(self, url: str, headers: Headers) -> typing.Optional[Entry]:
+        """ Returns the entry matching the request headers, if any. """
+        for entry in self._variants(url):
+            if all(headers.get(name) == value
+                   for name, value in entry.vary.items()):
+                if not os.path.exists(self.body_path(entry.body)):
+                    # Evicted.
+                    return None
+                return entry
+        return None
+
+    def save(self, url: str, entry: Entry):
+        os.makedirs(os.path.dirname(self.index_path(url)), exist_ok=True)
+        variants = [entry] + [
+            v for v in self._variants(url) if v.vary != entry.vary
+        ]
+        statefile.write(self.index_path(url), {
+            'variants': [v._asdict() for v in variants[:_MAX_VARIANTS]],
+        })
+
+    def open(self, entry: Entry, url: str, method: str,
+             headers: Headers) -> typing.Optional[requests.Response]:
+        """ Returns the stored response.  None if the body was evicted. """
+        try:
+            body = open(self.body_path(entry.body), 'rb')
+        except OSError:
+            return None
+        _touch(self.index_path(url))
+        _touch(self.body_path(entry.body))
+
+        stored = entry.header_dict
+        stored['age'] = str(int(current_age(entry, time.time())))
+        raw = urllib3.HTTPResponse(
+            body=body,
+            headers=stored,
+            status=entry.status,
+            reason=entry.reason,
+            preload_content=False,
+            decode_content=True,
+            request_method=method,
+            request_url=entry.url,
+        )
+        req = requests.Request(method, url, headers=dict(headers)).prepare()
+        res = self._adapter.build_response(req, raw)
+        res.url = entry.url
+        res.elapsed = datetime.timedelta(0)
+        return res
+
+    def revalidated(self, url: str, entry: Entry,
+                    headers: Headers) -> Entry:
+        """ Update the entry with headers of a 304 response. """
+        merged = entry.header_dict
+        for name, value in headers.items():
+            if name.lower() not in _KEEP_HEADERS:
+                merged[name] = value
+        entry = entry._replace(headers=tuple(merged.items()),
+                               stored=time.time())
+        with contextlib.suppress(OSError):
+            self.save(url, entry)
+        return entry
+
+    def record(self, url: str, request_headers: Headers,
+               res: requests.Response):
+        """ Store the response while the caller reads its body. """
+        received = time.time()
+
+        def commit(digest: str, size: int):
+            entry = Entry(
+                url=res.url,
+                status=res.status_code,
+                reason=res.reason or '',
+                headers=tuple(res.headers.items()),
+                vary=_vary_of(res.headers, request_headers),
+                body=digest,
+                stored=received,
+            )
+            with contextlib.suppress(OSError):
+                self.save(url, entry)
+                self._stored(size + os.path.getsize(self.index_path(url)))
+
+        raw = res.raw
+        res.raw = urllib3.HTTPResponse(
+            body=typing.cast(typing.BinaryIO, _Recorder(self, raw, commit)),
+            headers=raw.headers,
+            status=raw.status,
+            version=raw.version,
+            reason=raw.reason,
+            preload_content=False,
+            decode_content=True,
+            request_method=res.request.method,
+            request_url=res.url,
+        )
+
+    def _stored(self, size: int):
+        """ Add the size of files just written to the running total.
+
+        The total is an estimate: a replaced index or a body stored twice is
+        counted again, and concurrent processes may miss each other's updates.
+        evict() corrects it whenever it exceeds the limit.
+        """
+        total = (statefile.read(self.size_path) or {}).get('size')
+        if not isinstance(total, int) or total + size > self.max_size:
+            self.evict()
+            return
+        statefile.write(self.size_path, {'size': total + size})
+
+    def evict(self):
+        """ Remove the least recently used files if the cache is too large.
+
+        This scans the whole directory, and saves the actual total size.
+        """
+        now = time.time()
+        files = []
+        total = 0
+        for dirpath, _, names in os.walk(self.path):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                if path == self.size_path:
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if name.startswith('.'):
+                    # A temporary file.  It may be being written now.
+                    if now - st.st_mtime > _STALE_TEMPORARY:
+                        _remove_quietly(path)
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        if total > self.max_size:
+            files.sort()
+            for _, size, path in files:
+                if total <= self.max_size * _EVICT_RATIO:
+                    break
+                _remove_quietly(path)
+                total -= size
+        statefile.write(self.size_path, {'size': total})
+
+
+def request(cache: Cache, send: typing.Callable[..., requests.Response],
+            method: str, url: str, **kwargs) -> requests.Response:
+    """ Send the request through the cache.
+
+    send is a function like requests.Session.request().  Arguments and return
+    values are the same as it.
+    """
+    headers = requests.structures.CaseInsensitiveDict(
+        kwargs.get('headers') or {})
+    if not cacheable_request(method, headers, kwargs.get('data')):
+        return send(method, url, **kwargs)
+
+    res: typing.Optional[requests.Response] = None
+    entry = cache.lookup(url, headers)
+    if entry is not None and is_fresh(entry, headers, time.time()):
+        res = cache.open(entry, url, method, headers)
+    if res is None:
+        conditional = requests.structures.CaseInsensitiveDict(headers)
+        if entry is not None:
+            conditional.update(validators(entry))
+        res = send(method, url, **dict(kwargs, headers=conditional,
+                                       stream=True))
+        if res.status_code == 304 and entry is not None:
+            entry = cache.revalidated(url, entry, res.headers)
+            cached = cache.open(entry, url, method, headers)
+            if cached is not None:
+                res.close()
+                cached.request = res.request
+                cached.elapsed = res.elapsed
+                res = cached
+        elif storable(res):
+            cache.record(url, headers, res)
+
+    if not kwargs.get('stream', False):
+        # Read the body now like requests does.
+        res.content
+    return res
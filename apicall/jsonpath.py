@@ -0,0 +1,60 @@
+""" jq-style paths to locate a value in a JSON document.
+
+Only object keys and array indexes are supported, like ".items[0].state" or
+'.["a key"]'.
+"""
+import re
+import json
+import typing
+
+# Path components are object keys or array indexes.
+Path = typing.Tuple[typing.Union[str, int], ...]
+
+_TOKEN = re.compile(
+    r'\.([A-Za-z_][\w-]*)|\.?\[(-?\d+)\]|\.?\["((?:[^"\\]|\\.)*)"\]')
+_IDENTIFIER = re.compile(r'[A-Za-z_][\w-]*')
+
+
+def parse(expr: str) -> Path:
+    expr = expr.strip()
+    if expr == '.':
+        return ()
+    path: typing.List[typing.Union[str, int]] = []
+    pos = 0
+    while pos < len(expr):
+        m = _TOKEN.match(expr, pos)
+        if m is None:
+            raise ValueError(f'Invalid path: {expr}')
+        key, index, quoted = m.groups()
+        if key is not None:
+            path.append(key)
+        elif index is not None:
+            path.append(int(index))
+        else:
+            path.append(json.loads(f'"{quoted}"'))
+        pos = m.end()
+    return tuple(path)
+
+
+def lookup(obj: typing.Any, path: Path, default: typing.Any = None) -> typing.Any:
+    """ Returns the value at the path, or default if it does not exist. """
+    for key in path:
+        try:
+            obj = obj[key]
+        except (KeyError, IndexError, TypeError):
+            return default
+    return obj
+
+
+def format(path: Path) -> str:
+    if not path:
+        return '.'
+    parts = []
+    for key in path:
+        if isinstance(key, int):
+            parts.append(f'[{key}]')
+        elif _IDENTIFIER.fullmatch(key):
+            parts.append(f'.{key}')
+        else:
+            parts.append(f'[{json.dumps(key)}]')
+    return ''.join(parts)
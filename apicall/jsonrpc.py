@@ -6,6 +6,16 @@ import jsonrpcclient
 
 from . import config
 from . import restapi
+from . import transport
+from . import compression
+from . import telemetry
+
+
+# Headers sent with all JSON-RPC requests.
+DEFAULT_HEADERS: typing.Tuple[config.HttpHeader, ...] = (
+    config.HttpHeader('content-type', 'application/json'),
+    config.HttpHeader('accept', 'application/json'),
+)
 
 
 class Request(typing.NamedTuple):
@@ -48,21 +58,44 @@ class Endpoint:
     urls: typing.Tuple[str, ...]
     headers: typing.Tuple[config.HttpHeader, ...]
     basic: typing.Optional[config.BasicAuth]
+    # Encoding to compress requests.  e.g. "gzip"
+    compression: typing.Optional[str] = None
 
     def send(
             self,
             req: Request,
             verbose: int = 0,
             logging_cb: typing.Optional[typing.Callable[[str], None]] = None,
+            session: typing.Optional[transport.Session] = None,
     )->str:
+        with telemetry.span(req.method, {
+                'rpc.system': 'jsonrpc',
+                'rpc.method': req.method,
+        }):
+            res_raw = self.build_request(req).fetch(
+                verbose=verbose, logging_cb=logging_cb, session=session)
+            return Endpoint.parse_response(res_raw)
+
+    def build_request(self, req: Request) -> restapi.Request:
+        """ Returns the HTTP request to send req to this endpoint. """
         req_rpc = req.to_json()
-        res_raw = restapi.Request(
+        headers = self.headers
+        data: restapi.Body = json.dumps(req_rpc).encode('utf8')
+        if self.compression is not None:
+            headers += config.HttpHeader('content-encoding', self.compression),
+            data = compression.compress(data, self.compression)
+
+        return restapi.Request(
             method='POST',
             urls=self.urls,
-            headers=self.headers,
+            headers=headers,
             basic=self.basic,
-            data=json.dumps(req_rpc).encode('utf8'),
-        ).fetch(verbose=verbose, logging_cb=logging_cb)
+            data=data,
+        )
+
+    @staticmethod
+    def parse_response(res_raw: restapi.Response) -> str:
+        """ Returns the body of the JSON-RPC response.  Raises ErrorResponse on errors. """
         res_rpc = jsonrpcclient.responses.parse(res_raw.json)
         Endpoint._check_response(res_raw.body, res_rpc)
         return res_raw.body
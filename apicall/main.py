@@ -1,3 +1,7 @@
+# Measure the time to import the CLI for --profile.
+import time
+_IMPORT_START = time.perf_counter(), time.process_time()
+
 # Suppress warnings
 import warnings
 warnings.filterwarnings(
@@ -6,25 +10,80 @@ warnings.filterwarnings(
     module='^dataclasses_json\\.',
     category=RuntimeWarning)
 
+import os
 import sys
 
 from . import arguments
 from . import config
+from . import profiling
+from . import telemetry
 
 
 def main():
-    result = arguments.parse(sys.argv[0], sys.argv[1:])
+    args = sys.argv[1:]
+    # Building the parser takes time, so it is only done when an argument looks
+    # like --profile.
+    value_options = arguments.value_options(sys.argv[0]) if any(
+        a.startswith(profiling.OPTION) for a in args) else frozenset()
+    try:
+        mode, args = profiling.split_argv(args, value_options)
+    except ValueError as e:
+        print(f'ERROR: {e}', file=sys.stderr)
+        return arguments.ExitInvalidArgs
+    if mode is None:
+        return run(args)
+
+    wall, cpu = _IMPORT_START
+    profiler = profiling.Profiler(mode)
+    profiler.record('imports', time.perf_counter() - wall,
+                    time.process_time() - cpu)
+    profiler.start()
+    try:
+        with profiling.installed(profiler):
+            return run(args)
+    finally:
+        profiler.stop()
+        profiling.write_report(profiler, os.path.basename(sys.argv[0]))
+
+
+def run(args):
+    started = telemetry.now()
+    with profiling.phase('parse arguments'):
+        result = arguments.parse(sys.argv[0], args)
     if not result.success:
         # Arguments is not valid.
         # Show error messages and exit.
         sys.stderr.write(result.output)
         return arguments.ExitInvalidArgs
 
-    conf_file, conf = config.load_or_default()
+    parsed = telemetry.now()
+    with profiling.phase('load config'):
+        conf_file, conf = config.load_or_default()
     ca = arguments.CommandArgs(
         args=sys.argv,
         ns=result.ns,
         conf=conf,
         conf_file=conf_file,
     )
-    return result.ns.fn(ca)
+
+    tracer = arguments.build_tracer(result.ns)
+    if not isinstance(tracer, telemetry.Tracer):
+        with profiling.phase('command'):
+            return result.ns.fn(ca)
+
+    # Arguments and the config are needed to know whether to trace.  Their
+    # spans are recorded afterwards.
+    prog = os.path.basename(sys.argv[0])
+    with telemetry.installed(tracer):
+        try:
+            with tracer.span(prog, start=started) as root, \
+                    profiling.phase('command'):
+                tracer.record('parse arguments', started, parsed)
+                tracer.record('load config', parsed, telemetry.now())
+                exit_code = result.ns.fn(ca)
+                root.set('process.exit.code', exit_code)
+                if exit_code:
+                    root.fail(f'exit code {exit_code}')
+        finally:
+            arguments.export_trace(result.ns, tracer, prog)
+    return exit_code
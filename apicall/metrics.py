@@ -0,0 +1,282 @@
+""" Append-only log of request metrics.
+
+リクエストごとにメソッド・エンドポイント・パス・ステータス・レイテンシを
+小さなバイナリレコードとして追記する。一定のサイズを超えたファイルは
+ローテーションされるので、ディスク使用量には上限がある。
+
+A record is written with a single write() to a file opened with O_APPEND, so
+concurrent processes do not interleave records.  Broken records at the end of a
+file (e.g. the process was killed while writing) are skipped.
+"""
+import os
+import re
+import struct
+import typing
+import datetime
+import dataclasses
+import urllib.parse
+from tabulate import tabulate  # type: ignore
+from . import histogram
+
+VERSION = 1
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+DEFAULT_BACKUPS = 3
+
+# version, time, latency (us), status, failovers, retries, and lengths of the
+# method, endpoint and path.
+_HEADER = struct.Struct('<BdIHBBBHH')
+_MAX_LATENCY = 0xFFFFFFFF
+_MAX_COUNT = 0xFF
+_MAX_TEXT = 0xFFFF
+
+
+class Record(typing.NamedTuple):
+    # Unix time when the request started.
+    time: float
+    # Seconds until the response headers arrived, including retries.
+    latency: float
+    method: str
+    # e.g. "https://api.example.com"
+    endpoint: str
+    # The path without the query string.
+    path: str
+    # 0 if no response was received, or the transfer of the body failed.
+    status: int
+    # Endpoints which failed before the one which answered.
+    failovers: int = 0
+    retries: int = 0
+
+    @classmethod
+    def of(cls, method: str, url: str, status: int, start: float,
+           latency: float, failovers: int = 0,
+           retries: int = 0) -> 'Record':
+        u = urllib.parse.urlsplit(url)
+        return cls(start, latency, method, f'{u.scheme}://{u.netloc}',
+                   u.path or '/', status, failovers, retries)
+
+    @property
+    def error(self) -> bool:
+        """ True if the request failed.  Connection errors and 5xx are errors. """
+        return self.status == 0 or self.status >= 500
+
+
+def _truncate(text: str, size: int) -> bytes:
+    """ Encode text into at most size bytes without splitting a character. """
+    data = text.encode()
+    if len(data) <= size:
+        return data
+    return data[:size].decode(errors='ignore').encode()
+
+
+def encode(record: Record) -> bytes:
+    method = _truncate(record.method, _MAX_COUNT)
+    endpoint = _truncate(record.endpoint, _MAX_TEXT)
+    path = _truncate(record.path, _MAX_TEXT)
+    header = _HEADER.pack(VERSION, record.time,
+                          min(_MAX_LATENCY, max(0, int(record.latency * 1e6))),
+                          record.status, min(_MAX_COUNT, record.failovers),
+                          min(_MAX_COUNT, record.retries), len(method),
+                          len(endpoint), len(path))
+    return header + method + endpoint + path
+
+
+def decode(data: bytes) -> typing.Iterator[Record]:
+    """ Yields records.  Stops at a broken record. """
+    pos = 0
+    while pos + _HEADER.size <= len(data):
+        (version, start, latency, status, failovers, retries, method_len,
+         endpoint_len, path_len) = _HEADER.unpack_from(data, pos)
+        end = pos + _HEADER.size + method_len + endpoint_len + path_len
+        if version != VERSION or end > len(data):
+            return
+        text = data[pos + _HEADER.size:end]
+        # Lengths are valid, so later records can be read even if the text is not.
+        method = text[:method_len].decode(errors='replace')
+        endpoint = text[method_len:method_len + endpoint_len].decode(
+            errors='replace')
+        path = text[method_len + endpoint_len:].decode(errors='replace')
+        yield Record(start, latency / 1e6, method, endpoint, path, status,
+                     failovers, retries)
+        pos = end
+
+
+class Log:
+    """ A metrics file and its rotated backups: path.1 (newer) to path.N (older).
+
+    :ivar max_size: The file is rotated when it gets larger than this.
+    :ivar backups: Number of rotated files to keep.
+    """
+
+    def __init__(self,
+                 path: str,
+                 max_size: int = DEFAULT_MAX_SIZE,
+                 backups: int = DEFAULT_BACKUPS):
+        self.path = path
+        self.max_size = max_size
+        self.backups = backups
+
+    def append(self, record: Record):
+        """ Errors are ignored because metrics are best effort. """
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0o600)
+        except OSError:
+            return
+        try:
+            os.write(fd, encode(record))
+            if os.fstat(fd).st_size > self.max_size:
+                self._rotate(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _rotate(self, fd: int):
+        # Another process may have rotated the file already.
+        if os.stat(self.path).st_ino != os.fstat(fd).st_ino:
+            return
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        os.replace(self.path, f'{self.path}.1')
+
+    def files(self) -> typing.List[str]:
+        """ Returns existing files from the oldest to the newest. """
+        paths = [f'{self.path}.{i}' for i in range(self.backups, 0, -1)]
+        paths.append(self.path)
+        return [p for p in paths if os.path.exists(p)]
+
+    def read(self) -> typing.Iterator[Record]:
+        for path in self.files():
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            yield from decode(data)
+
+
+class Pending:
+    """ A record to append when the response body has been received.
+
+    A failure while receiving the body is recorded as status 0.
+    """
+
+    def __init__(self, log: Log, record: Record):
+        self._log = log
+        self._record: typing.Optional[Record] = record
+
+    def finish(self, failed: bool = False):
+        """ Append the record.  Calls after the first one are ignored. """
+        record, self._record = self._record, None
+        if record is None:
+            return
+        self._log.append(record._replace(status=0) if failed else record)
+
+
+def record(log: typing.Optional[Log], method: str, url: str, status: int,
+           start: float, latency: float, failovers: int = 0,
+           retries: int = 0):
+    """ Append a record if the log is enabled. """
+    if log is not None:
+        log.append(
+            Record.of(method, url, status, start, latency, failovers,
+                      retries))
+
+
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)([smhd]?)')
+_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_duration(value: str) -> float:
+    """ Parse a duration like "90", "15m", "2h" or "7d" into seconds. """
+    m = _DURATION.fullmatch(value.strip())
+    if m is None or float(m.group(1)) <= 0:
+        raise ValueError(f'Invalid duration: {value}')
+    return float(m.group(1)) * _UNITS[m.group(2)]
+
+
+# Keys to group records by.
+KEYS = ('endpoint', 'path', 'method', 'status')
+
+
+@dataclasses.dataclass
+class Stats:
+    """ Aggregated metrics of a group.  Latencies are in microseconds. """
+    latency: histogram.Histogram = dataclasses.field(
+        default_factory=histogram.Histogram)
+    errors: int = 0
+    failovers: int = 0
+    retries: int = 0
+
+    @property
+    def count(self) -> int:
+        return self.latency.count
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.count if self.count else 0.0
+
+    def add(self, record: Record):
+        self.latency.record(int(record.latency * 1e6))
+        self.errors += record.error
+        self.failovers += record.failovers
+        self.retries += record.retries
+
+
+def aggregate(records: typing.Iterable[Record],
+              keys: typing.Sequence[str] = ('endpoint', 'path'),
+              window: typing.Optional[float] = None,
+              since: typing.Optional[float] = None
+              ) -> typing.Dict[typing.Tuple, Stats]:
+    """ Group records by keys, and by time windows of the given seconds.
+
+    If window is given, the first element of group keys is the start time of
+    the window.  Records older than since (unix time) are ignored.
+    """
+    groups: typing.Dict[typing.Tuple, Stats] = {}
+    for r in records:
+        if since is not None and r.time < since:
+            continue
+        key = tuple(getattr(r, k) for k in keys)
+        if window is not None:
+            key = (r.time - r.time % window, ) + key
+        stats = groups.get(key)
+        if stats is None:
+            stats = groups[key] = Stats()
+        stats.add(r)
+    return dict(sorted(groups.items()))
+
+
+def _ms(us: float) -> str:
+    return f'{us / 1000:.2f}'
+
+
+def report(groups: typing.Dict[typing.Tuple, Stats],
+           keys: typing.Sequence[str],
+           window: bool = False) -> str:
+    """ Returns a table of the aggregated metrics.  Latencies are in milliseconds. """
+    rows = []
+    for key, stats in groups.items():
+        labels = list(key)
+        if window:
+            labels[0] = datetime.datetime.fromtimestamp(
+                labels[0]).strftime('%Y-%m-%d %H:%M')
+        rows.append(labels + [
+            stats.count,
+            f'{stats.errors} ({stats.error_rate:.1%})',
+            stats.failovers,
+            stats.retries,
+            _ms(stats.latency.percentile(50)),
+            _ms(stats.latency.percentile(90)),
+            _ms(stats.latency.percentile(99)),
+            _ms(stats.latency.max or 0),
+        ])
+    headers = (['WINDOW'] if window else []) + [k.upper() for k in keys] + [
+        'REQUESTS', 'ERRORS', 'FAILOVERS', 'RETRIES', 'P50(ms)', 'P90(ms)',
+        'P99(ms)', 'MAX(ms)'
+    ]
+    return tabulate(rows, headers=headers, disable_numparse=True)
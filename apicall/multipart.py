@@ -0,0 +1,166 @@
+""" Streaming multipart/form-data encoder.
+
+ファイルの内容をメモリに読み込まずに、少しずつ読み出しながら
+multipart/form-dataのリクエストボディを生成する。
+"""
+import io
+import os
+import uuid
+import typing
+import mimetypes
+from . import restapi
+
+
+class Field(typing.NamedTuple):
+    """ A form field.
+
+    :ivar name: Field name.
+    :ivar value: Value of the field.  None if the value is read from the path.
+    :ivar path: Path to the file which contains the value.
+    :ivar filename: File name sent to the server.  None for non-file fields.
+    :ivar content_type: Content type of the file.
+    """
+    name: str
+    value: typing.Optional[bytes] = None
+    path: typing.Optional[str] = None
+    filename: typing.Optional[str] = None
+    content_type: typing.Optional[str] = None
+
+
+def parse_field(spec: str) -> Field:
+    """ Parse the value of -F option.  The syntax is compatible with curl.
+
+    * name=value         A text field.
+    * name=@path         A file upload.
+    * name=<path         A text field whose value is read from the file.
+    * ;type=MIME and ;filename=NAME can follow the path.
+
+    Raises ValueError if the spec has no name or no "=".
+    """
+    name, sep, value = spec.partition('=')
+    if not sep or not name:
+        raise ValueError(
+            f'Invalid form field: {spec!r}  (expected NAME=VALUE, '
+            f'NAME=@FILE or NAME=<FILE)')
+    if not value[:1] in ('@', '<'):
+        return Field(name=name, value=value.encode())
+
+    path, *params = value[1:].split(';')
+    options = dict(p.split('=', maxsplit=1) for p in params if '=' in p)
+    if value.startswith('<'):
+        return Field(name=name, path=path)
+
+    content_type = options.get('type') or mimetypes.guess_type(
+        path)[0] or 'application/octet-stream'
+    return Field(
+        name=name,
+        path=path,
+        filename=options.get('filename', os.path.basename(path)),
+        content_type=content_type,
+    )
+
+
+def _quote(value: str) -> str:
+    # Same as the escaping rule of HTML forms.
+    return value.replace('"', '%22').replace('\r', '%0D').replace(
+        '\n', '%0A')
+
+
+class MultipartEncoder:
+    """ A file-like object that produces a multipart/form-data body.
+
+    The size of the body is computed from the file sizes in advance, so the
+    request is sent with a Content-Length header.  Files are opened one by one
+    when their contents are read.
+
+    :ivar boundary: The boundary string of the body.
+    """
+
+    def __init__(self,
+                 fields: typing.Iterable[Field],
+                 boundary: typing.Optional[str] = None):
+        self.boundary = boundary or uuid.uuid4().hex
+        # Parts of the body.  bytes are sent as is, and str is a path of the file.
+        self._parts: typing.List[typing.Union[bytes, str]] = []
+        for field in fields:
+            self._parts.append(self._part_header(field))
+            if field.path is None:
+                self._parts.append(field.value or b'')
+            else:
+                self._parts.append(field.path)
+            self._parts.append(b'\r\n')
+        self._parts.append(f'--{self.boundary}--\r\n'.encode())
+
+        self._length = sum(
+            os.path.getsize(p) if isinstance(p, str) else len(p)
+            for p in self._parts)
+        self._index = 0
+        self._current: typing.Optional[typing.BinaryIO] = None
+        self._position = 0
+
+    def _part_header(self, field: Field) -> bytes:
+        disposition = f'form-data; name="{_quote(field.name)}"'
+        if field.filename is not None:
+            disposition += f'; filename="{_quote(field.filename)}"'
+        header = f'--{self.boundary}\r\n'
+        header += f'Content-Disposition: {disposition}\r\n'
+        if field.content_type is not None:
+            header += f'Content-Type: {field.content_type}\r\n'
+        header += '\r\n'
+        return header.encode()
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _open_part(self) -> typing.BinaryIO:
+        part = self._parts[self._index]
+        if isinstance(part, str):
+            return open(part, 'rb')
+        return io.BytesIO(part)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._length
+        buf = bytearray()
+        while len(buf) < size and self._index < len(self._parts):
+            if self._current is None:
+                self._current = self._open_part()
+            data = self._current.read(size - len(buf))
+            if data:
+                buf += data
+                continue
+
+            # Reached the end of the part.
+            self._current.close()
+            self._current = None
+            self._index += 1
+        self._position += len(buf)
+        return bytes(buf)
+
+    def __iter__(self) -> typing.Iterator[bytes]:
+        while True:
+            chunk = self.read(restapi.CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """ Rewind the body.  Only seeking to the beginning is supported. """
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('can only rewind to the beginning')
+        self.close()
+        self._index = 0
+        self._position = 0
+        return 0
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
@@ -0,0 +1,172 @@
+""" Follow paginated collections.
+
+ページを書き出している間に次のページを先読みする。メモリに載るのは
+書き出し中のページと先読み中のページだけなので、ページ数によらず一定。
+
+The next page is found by one of these.
+
+* The Link header with rel="next" (RFC 8288).  This is the default.
+* A cursor in the body.  It is sent as a query parameter of the next request.
+* An offset query parameter.  It is advanced by the number of items.
+"""
+import json
+import typing
+import dataclasses
+import urllib.parse
+import concurrent.futures
+import requests.utils
+from . import jsonpath
+from . import restapi
+
+MERGE_FORMATS = ('ndjson', 'array')
+
+
+class PageError(Exception):
+    pass
+
+
+@dataclasses.dataclass(frozen=True)
+class Pager:
+    """ How to find items and the next page.
+
+    :ivar items_path: Path to the items in a page.  If omitted, an array page is the
+        items, and any other page is an item.
+    :ivar cursor_path: Path to the cursor of the next page in a page.
+    :ivar cursor_param: Query parameter to send the cursor.
+    :ivar offset_param: Query parameter of the offset.
+    :ivar max_pages: Maximum number of pages to fetch.
+    """
+    items_path: typing.Optional[jsonpath.Path] = None
+    cursor_path: typing.Optional[jsonpath.Path] = None
+    cursor_param: str = 'cursor'
+    offset_param: typing.Optional[str] = None
+    max_pages: typing.Optional[int] = None
+
+    def items(self, page: typing.Any) -> typing.List[typing.Any]:
+        if self.items_path is not None:
+            items = jsonpath.lookup(page, self.items_path)
+            if items is None:
+                return []
+            if not isinstance(items, list):
+                raise PageError(
+                    f'{jsonpath.format(self.items_path)} is not an array.')
+            return items
+        if isinstance(page, list):
+            return page
+        return [page]
+
+    def next_url(self, response: restapi.Response, page: typing.Any,
+                 items: typing.List[typing.Any]) -> typing.Optional[str]:
+        if self.cursor_path is not None:
+            cursor = jsonpath.lookup(page, self.cursor_path)
+            if cursor is None or cursor == '':
+                return None
+            return with_query(response.url, self.cursor_param, cursor)
+        if self.offset_param is not None:
+            if not items:
+                return None
+            offset = int(query_of(response.url).get(self.offset_param, '0'))
+            return with_query(response.url, self.offset_param,
+                              offset + len(items))
+        return next_link(response)
+
+
+def query_of(url: str) -> typing.Dict[str, str]:
+    return dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query))
+
+
+def with_query(url: str, name: str, value: typing.Any) -> str:
+    """ Returns the url whose query parameter is replaced with value. """
+    u = urllib.parse.urlsplit(url)
+    queries = [(k, v) for k, v in urllib.parse.parse_qsl(
+        u.query, keep_blank_values=True) if k != name]
+    queries.append((name, value if isinstance(value, str) else json.dumps(value)))
+    return urllib.parse.urlunsplit(
+        u._replace(query=urllib.parse.urlencode(queries)))
+
+
+def next_link(response: restapi.Response) -> typing.Optional[str]:
+    """ Returns the absolute url of the Link header with rel="next". """
+    value = response.headers.get('link')
+    if not value:
+        return None
+    for link in requests.utils.parse_header_links(value):
+        if 'next' in link.get('rel', '').split():
+            return urllib.parse.urljoin(response.url, link['url'])
+    return None
+
+
+class Page(typing.NamedTuple):
+    url: str
+    items: typing.List[typing.Any]
+    next_url: typing.Optional[str]
+
+
+def _fetch(request: restapi.Request, pager: Pager,
+           fetch_kwargs: typing.Dict[str, typing.Any]) -> Page:
+    response = request.fetch(**fetch_kwargs)
+    try:
+        if not 200 <= response.status_code < 300:
+            raise PageError(
+                f'{response.url} returned HTTP {response.status_code}.')
+        body = response.raw_body
+    finally:
+        response.close()
+    try:
+        page = json.loads(body)
+    except ValueError as e:
+        raise PageError(f'{response.url} did not return JSON.') from e
+
+    items = pager.items(page)
+    next_url = pager.next_url(response, page, items)
+    if next_url == response.url:
+        # The server points to the same page.  Avoid an infinite loop.
+        next_url = None
+    return Page(response.url, items, next_url)
+
+
+def pages(request: restapi.Request, pager: Pager,
+          **fetch_kwargs) -> typing.Iterator[Page]:
+    """ Yields pages.  The next page is fetched while the caller handles a page.
+
+    fetch_kwargs are passed to restapi.Request.fetch().
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        future: typing.Optional[concurrent.futures.Future] = executor.submit(
+            _fetch, request, pager, fetch_kwargs)
+        count = 0
+        while future is not None:
+            page = future.result()
+            count += 1
+            future = None
+            if page.next_url is not None and (pager.max_pages is None
+                                              or count < pager.max_pages):
+                # Later pages are sent to the endpoint which answered.
+                future = executor.submit(
+                    _fetch, dataclasses.replace(request,
+                                                urls=(page.next_url, )),
+                    pager, fetch_kwargs)
+            yield page
+
+
+def write_ndjson(pages: typing.Iterable[Page], out: typing.TextIO):
+    """ Write each item as a line. """
+    for page in pages:
+        for item in page.items:
+            out.write(json.dumps(item, ensure_ascii=False))
+            out.write('\n')
+        out.flush()
+
+
+def write_array(pages: typing.Iterable[Page], out: typing.TextIO):
+    """ Write items of all pages as a JSON array, as pages arrive. """
+    out.write('[')
+    first = True
+    for page in pages:
+        for item in page.items:
+            out.write('\n' if first else ',\n')
+            first = False
+            out.write(json.dumps(item, ensure_ascii=False))
+        out.flush()
+    out.write('\n]\n' if not first else ']\n')
+    out.flush()
@@ -1,10 +1,18 @@
+import io
+import os
 import sys
+import mmap
+import codecs
+import shutil
 import tempfile
 import subprocess
 import typing
 import json
 import contextlib
 
+# Size of chunks to scan a file.
+SCAN_SIZE = 1024 * 1024
+
 
 class SubprocessError(Exception):
     pass
@@ -29,6 +37,15 @@ def is_unicode_string(data: bytes) -> bool:
         return False
 
 
+def is_unicode_prefix(data: bytes) -> bool:
+    """ Same as is_unicode_string(), but data may end in the middle of a character. """
+    try:
+        codecs.getincrementaldecoder('utf8')().decode(data, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
 def is_json(data: bytes) -> bool:
     try:
         json.loads(data.decode())
@@ -46,32 +63,115 @@ def has_jq() -> bool:
         return False
 
 
-def print_hex(data: bytes):
-    with tempfile.TemporaryFile() as f:
-        f.write(data)
-        f.seek(0)
+@contextlib.contextmanager
+def _as_file(data: typing.Union[bytes, typing.BinaryIO]):
+    """ Returns a file object to pass data to subprocesses. """
+    if isinstance(data, bytes):
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.seek(0)
+            yield f
+    else:
+        data.seek(0)
+        yield data
+
+
+def print_hex(data: typing.Union[bytes, typing.BinaryIO]):
+    with _as_file(data) as f:
         result = _run(['od', '-t', 'x1'], stdin=f)
         if result.returncode != 0:
             raise SubprocessError()
 
 
-def print_json(data: bytes):
+def print_json(data: typing.Union[bytes, typing.BinaryIO]):
     """ Print JSON to terminal through jq command.
 
     If the jq command is not available, it prints the JSON as is.
     """
     if not has_jq():
-        sys.stdout.buffer.write(data)
+        if isinstance(data, bytes):
+            sys.stdout.buffer.write(data)
+        else:
+            data.seek(0)
+            copy_to_stdout(data)
         return
 
-    with tempfile.TemporaryFile() as f:
-        f.write(data)
-        f.seek(0)
+    with _as_file(data) as f:
         result = _run(['jq'], stdin=f)
         if result.returncode != 0:
             raise SubprocessError()
 
 
+def copy_to_stdout(f: typing.BinaryIO):
+    """ Copy the rest of file f to stdout.
+
+    os.sendfile() is used if both of them are real files, so that the data is
+    copied in the kernel without passing through Python.
+    """
+    out = sys.stdout.buffer
+    out.flush()
+    try:
+        in_fd = f.fileno()
+        out_fd = sys.stdout.fileno()
+        offset = f.tell()
+        size = os.fstat(in_fd).st_size
+        while offset < size:
+            sent = os.sendfile(out_fd, in_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+        f.seek(offset)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        # sendfile() is not available for these files.
+        # Copy the remaining data in user space.
+        pass
+    shutil.copyfileobj(f, out)
+    out.flush()
+
+
+def is_unicode_file(f: typing.BinaryIO) -> bool:
+    """ Same as is_unicode_string(), but for a file. """
+    if os.fstat(f.fileno()).st_size == 0:
+        return True
+
+    decoder = codecs.getincrementaldecoder('utf8')()
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        try:
+            for offset in range(0, len(m), SCAN_SIZE):
+                decoder.decode(m[offset:offset + SCAN_SIZE])
+            decoder.decode(b'', final=True)
+            return True
+        except UnicodeDecodeError:
+            return False
+
+
+def looks_like_json_file(f: typing.BinaryIO) -> bool:
+    """ Returns True if the file starts with a JSON object or array.
+
+    Unlike is_json(), the file is not parsed entirely.  The jq command
+    reports an error if the file is not valid JSON.
+    """
+    if os.fstat(f.fileno()).st_size == 0:
+        return False
+
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        head = m[:SCAN_SIZE].lstrip()
+    return head[:1] in (b'{', b'[')
+
+
+def is_raw_output(raw: bool = False) -> bool:
+    """ Returns True if data is written to stdout without any conversion. """
+    return raw or not sys.stdout.isatty()
+
+
+def write_stream(chunks: typing.Iterable[bytes]):
+    """ Write chunks to stdout as they arrive. """
+    out = sys.stdout.buffer
+    for chunk in chunks:
+        out.write(chunk)
+        out.flush()
+
+
 def pprint(data: typing.Union[bytes, str], raw: bool = False, file=None):
     # convert data to bytes.
     if isinstance(data, str):
@@ -82,7 +182,7 @@ def pprint(data: typing.Union[bytes, str], raw: bool = False, file=None):
         context = contextlib.redirect_stdout(file)  # type: ignore
 
     with context:
-        if raw or not sys.stdout.isatty():
+        if is_raw_output(raw):
             sys.stdout.buffer.write(data)
             return
 
@@ -99,3 +199,33 @@ def pprint(data: typing.Union[bytes, str], raw: bool = False, file=None):
             'WARNING: The response body is displayed in hex representation\n'
             '         because it is binary data.\n')
         print_hex(data)
+
+
+def pprint_file(f: typing.BinaryIO, raw: bool = False, file=None):
+    """ Same as pprint(), but prints the contents of a file.
+
+    The file must be a real file which has a file descriptor.  The contents are not
+    loaded into memory even if it is very large.
+    """
+    context = contextlib.nullcontext()  # type: ignore
+    if file is not None:
+        context = contextlib.redirect_stdout(file)  # type: ignore
+
+    with context:
+        f.seek(0)
+        if is_raw_output(raw) or os.fstat(f.fileno()).st_size == 0:
+            copy_to_stdout(f)
+            return
+
+        if is_unicode_file(f):
+            if looks_like_json_file(f):
+                print_json(f)
+                return
+            f.seek(0)
+            copy_to_stdout(f)
+            return
+
+        sys.stderr.write(
+            'WARNING: The response body is displayed in hex representation\n'
+            '         because it is binary data.\n')
+        print_hex(f)
@@ -0,0 +1,130 @@
+""" Latency probe for endpoints.
+
+各エンドポイントに対して並行してリクエストを送り、接続時間とTTFBを計測する。
+"""
+import time
+import base64
+import typing
+import statistics
+import http.client
+import urllib.parse
+import concurrent.futures
+from . import config
+
+DEFAULT_SAMPLES = 3
+DEFAULT_TIMEOUT = 5.0
+
+
+class Sample(typing.NamedTuple):
+    """ The result of a request.
+
+    :ivar connect: Seconds to establish the connection (including TLS handshake).
+    :ivar ttfb: Seconds from sending the request to receiving the response headers.
+    :ivar ok: True if the server returned a response without 5xx status.
+    """
+    connect: typing.Optional[float]
+    ttfb: typing.Optional[float]
+    ok: bool
+
+
+class ProbeResult(typing.NamedTuple):
+    endpoint: str
+    samples: typing.Tuple[Sample, ...]
+
+    @property
+    def success_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(s.ok for s in self.samples) / len(self.samples)
+
+    @property
+    def connect(self) -> typing.Optional[float]:
+        """ Median of connect times. """
+        values = [s.connect for s in self.samples if s.connect is not None]
+        return statistics.median(values) if values else None
+
+    @property
+    def ttfb(self) -> typing.Optional[float]:
+        """ Median of TTFBs. """
+        values = [s.ttfb for s in self.samples if s.ttfb is not None]
+        return statistics.median(values) if values else None
+
+    @property
+    def latency(self) -> float:
+        """ Median time to the first byte including connect time. """
+        if self.connect is None or self.ttfb is None:
+            return float('inf')
+        return self.connect + self.ttfb
+
+
+def _connection(url: str, timeout: float) -> http.client.HTTPConnection:
+    u = urllib.parse.urlsplit(url, scheme='http')
+    host = u.hostname or 'localhost'
+    if u.scheme == 'https':
+        return http.client.HTTPSConnection(host, u.port, timeout=timeout)
+    return http.client.HTTPConnection(host, u.port, timeout=timeout)
+
+
+def probe_once(url: str,
+               headers: typing.Tuple[config.HttpHeader, ...] = (),
+               basic: typing.Optional[config.BasicAuth] = None,
+               timeout: float = DEFAULT_TIMEOUT) -> Sample:
+    """ Send a GET request to url and measure the latency. """
+    u = urllib.parse.urlsplit(url, scheme='http')
+    path = u.path or '/'
+    if u.query:
+        path += '?' + u.query
+
+    dict_headers = {h.name: h.value for h in headers}
+    if basic is not None:
+        token = base64.b64encode(f'{basic.user}:{basic.password}'.encode())
+        dict_headers['authorization'] = 'Basic ' + token.decode()
+
+    conn = _connection(url, timeout)
+    connect = ttfb = None
+    try:
+        start = time.perf_counter()
+        conn.connect()
+        connect = time.perf_counter() - start
+
+        start = time.perf_counter()
+        conn.request('GET', path, headers=dict_headers)
+        res = conn.getresponse()
+        ttfb = time.perf_counter() - start
+        res.read()
+        return Sample(connect=connect, ttfb=ttfb, ok=res.status < 500)
+    except (OSError, http.client.HTTPException):
+        return Sample(connect=connect, ttfb=ttfb, ok=False)
+    finally:
+        conn.close()
+
+
+def probe(endpoints: typing.Tuple[str, ...],
+          samples: int = DEFAULT_SAMPLES,
+          headers: typing.Tuple[config.HttpHeader, ...] = (),
+          basic: typing.Optional[config.BasicAuth] = None,
+          timeout: float = DEFAULT_TIMEOUT) -> typing.Tuple[ProbeResult, ...]:
+    """ Probe all endpoints concurrently.
+
+    Samples of an endpoint are taken one by one, so they don't compete with each other.
+    """
+
+    def worker(endpoint: str) -> ProbeResult:
+        return ProbeResult(
+            endpoint=endpoint,
+            samples=tuple(
+                probe_once(endpoint, headers, basic, timeout)
+                for _ in range(samples)),
+        )
+
+    if not endpoints:
+        return tuple()
+    with concurrent.futures.ThreadPoolExecutor(len(endpoints)) as executor:
+        return tuple(executor.map(worker, endpoints))
+
+
+def fastest_first(
+        results: typing.Iterable[ProbeResult]) -> typing.Tuple[str, ...]:
+    """ Returns endpoints sorted by success rate and latency. """
+    ordered = sorted(results, key=lambda r: (-r.success_rate, r.latency))
+    return tuple(r.endpoint for r in ordered)
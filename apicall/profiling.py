@@ -0,0 +1,234 @@
+""" Phase-level profiling of a single invocation.
+
+--profileを指定すると、import・引数の解析・設定の読み込み・通信・出力の
+各段階の経過時間、CPU時間、ピークRSSを標準エラー出力に表示する。
+"cpu"ではcProfileの結果をpstatsファイルに書き出し、"mem"ではtracemallocで
+段階ごとの割り当てのピークと、割り当ての多い行を表示する。
+
+Imports before apicall.main are not measured.  Use "python -X importtime" to
+break them down.
+"""
+import io
+import sys
+import time
+import typing
+import pstats
+import cProfile
+import contextlib
+import tracemalloc
+import dataclasses
+from tabulate import tabulate  # type: ignore
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None  # type: ignore
+
+MODES = ('time', 'cpu', 'mem')
+OPTION = '--profile'
+# Number of lines to show in the summary of cProfile and tracemalloc.
+TOP = 15
+
+
+def split_argv(
+    args: typing.Sequence[str],
+    value_options: typing.Container[str] = ()
+) -> typing.Tuple[typing.Optional[str], typing.List[str]]:
+    """ Take --profile[=MODE] out of arguments before parsing them.
+
+    This lets the parser itself be profiled, and keeps "--profile GET" from being
+    parsed as a mode.  Only a standalone option is taken: it is kept after "--",
+    and right after an option in value_options (e.g. "-H"), so that the parser
+    sees the same arguments as without profiling.  Returns the mode (None if not
+    given) and the rest of the arguments.  Raises ValueError if the mode is
+    invalid.
+    """
+    mode = None
+    rest: typing.List[str] = []
+    for i, arg in enumerate(args):
+        if arg == '--':
+            rest.extend(args[i:])
+            break
+        if i > 0 and args[i - 1] in value_options:
+            rest.append(arg)
+        elif arg == OPTION:
+            mode = MODES[0]
+        elif arg.startswith(OPTION + '='):
+            mode = arg[len(OPTION) + 1:]
+            if mode not in MODES:
+                raise ValueError(f'Invalid profile mode: {mode}  '
+                                 f'(choose from {", ".join(MODES)})')
+        else:
+            rest.append(arg)
+    return mode, rest
+
+
+def peak_rss() -> typing.Optional[int]:
+    """ Returns the peak resident set size of this process in bytes. """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, and macOS reports bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+@dataclasses.dataclass
+class Phase:
+    """ Measurements of a phase.  Times are in seconds, and sizes are in bytes.
+
+    :ivar name: Names of the outer phases and this phase joined with "/".
+    """
+    name: str
+    wall: float = 0.0
+    cpu: float = 0.0
+    # High-water mark of RSS since the process started, at the end of the phase.
+    peak_rss: typing.Optional[int] = None
+    # Peak of memory traced by tracemalloc during the phase.
+    alloc_peak: typing.Optional[int] = None
+
+
+class NullProfiler:
+    """ The profiler used without --profile. """
+    enabled = False
+
+    def phase(self, name: str) -> typing.ContextManager[None]:
+        return contextlib.nullcontext()
+
+
+class Profiler:
+    """ Measures phases.  Phases can be nested. """
+    enabled = True
+
+    def __init__(self, mode: str = MODES[0]):
+        self.mode = mode
+        self.phases: typing.List[Phase] = []
+        self._names: typing.List[str] = []
+        # Peaks of the open phases before their inner phases reset the peak.
+        self._alloc_peaks: typing.List[int] = []
+        self._cprofile: typing.Optional[cProfile.Profile] = None
+
+    def start(self):
+        if self.mode == 'cpu':
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        elif self.mode == 'mem':
+            tracemalloc.start()
+
+    def stop(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+
+    def record(self, name: str, wall: float, cpu: float):
+        """ Record a phase which has already ended. """
+        self.phases.append(
+            Phase('/'.join(self._names + [name]),
+                  wall,
+                  cpu,
+                  peak_rss=peak_rss()))
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> typing.Iterator[None]:
+        phase = Phase('/'.join(self._names + [name]))
+        self.phases.append(phase)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            if self._alloc_peaks:
+                self._alloc_peaks[-1] = max(self._alloc_peaks[-1],
+                                            tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self._alloc_peaks.append(0)
+        self._names.append(name)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            phase.wall = time.perf_counter() - wall
+            phase.cpu = time.process_time() - cpu
+            phase.peak_rss = peak_rss()
+            self._names.pop()
+            if tracing:
+                phase.alloc_peak = max(self._alloc_peaks.pop(),
+                                       tracemalloc.get_traced_memory()[1])
+
+    def report(self) -> str:
+        """ Returns a table of phases. """
+        mem = any(p.alloc_peak is not None for p in self.phases)
+        rows = []
+        for p in self.phases:
+            row = [
+                p.name,
+                f'{p.wall * 1000:.1f}',
+                f'{p.cpu * 1000:.1f}',
+                _mib(p.peak_rss),
+            ]
+            if mem:
+                row.append(_mib(p.alloc_peak))
+            rows.append(row)
+        headers = ['PHASE', 'WALL(ms)', 'CPU(ms)', 'PEAK RSS(MiB)']
+        if mem:
+            headers.append('ALLOC PEAK(MiB)')
+        return tabulate(rows, headers=headers, disable_numparse=True)
+
+    def dump_stats(self, path: str):
+        """ Write the cProfile result.  Read it with "python -m pstats FILE". """
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(path)
+
+    def top_functions(self) -> str:
+        if self._cprofile is None:
+            return ''
+        out = io.StringIO()
+        pstats.Stats(self._cprofile, stream=out).sort_stats(
+            'cumulative').print_stats(TOP)
+        return out.getvalue().strip()
+
+    def top_allocations(self) -> str:
+        if not tracemalloc.is_tracing():
+            return ''
+        stats = tracemalloc.take_snapshot().statistics('lineno')[:TOP]
+        return '\n'.join(str(s) for s in stats)
+
+
+def _mib(size: typing.Optional[int]) -> str:
+    return '-' if size is None else f'{size / 1024 / 1024:.1f}'
+
+
+AnyProfiler = typing.Union[Profiler, NullProfiler]
+_profiler: AnyProfiler = NullProfiler()
+
+
+def profiler() -> AnyProfiler:
+    return _profiler
+
+
+@contextlib.contextmanager
+def installed(p: AnyProfiler) -> typing.Iterator[AnyProfiler]:
+    """ Use the profiler in the block. """
+    global _profiler
+    previous = _profiler
+    _profiler = p
+    try:
+        yield p
+    finally:
+        _profiler = previous
+
+
+def phase(name: str) -> typing.ContextManager[None]:
+    """ Measure a phase with the profiler of this process. """
+    return _profiler.phase(name)
+
+
+def write_report(p: Profiler, prog: str, file: typing.TextIO = sys.stderr):
+    """ Print the result of profiling.  The cProfile result is saved to PROG.pstats. """
+    print(p.report(), file=file)
+    if p.mode == 'cpu':
+        path = f'{prog}.pstats'
+        p.dump_stats(path)
+        print('', file=file)
+        print(p.top_functions(), file=file)
+        print(f'\nSaved to {path}.  Read it with "python -m pstats {path}".',
+              file=file)
+    elif p.mode == 'mem':
+        print('\nTop allocations:', file=file)
+        print(p.top_allocations(), file=file)
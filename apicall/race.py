@@ -0,0 +1,162 @@
+""" Happy Eyeballs style connection racing between endpoints.
+
+全てのURLの全てのアドレスに対してTCP接続を少しずつ時間をずらしながら同時に
+試行し、最初に接続できたURLを先頭に並べ替える。
+"""
+import time
+import errno
+import socket
+import selectors
+import typing
+import itertools
+import collections
+import urllib.parse
+from . import config
+
+# Delay between the starts of two connection attempts.
+# RFC 8305 recommends 250ms, but endpoints are usually in the same network.
+DEFAULT_STAGGER = config.Transport.race_stagger
+DEFAULT_TIMEOUT = 10.0
+
+_AddrInfo = typing.Tuple[int, int, int, str, typing.Any]
+
+
+def address_of(url: str) -> typing.Tuple[str, int]:
+    u = urllib.parse.urlsplit(url, scheme='http')
+    port = u.port
+    if port is None:
+        port = 443 if u.scheme == 'https' else 80
+    return u.hostname or 'localhost', port
+
+
+def _interleave(
+        infos: typing.Sequence[_AddrInfo]) -> typing.List[_AddrInfo]:
+    """ Alternate address families, starting with the first one (RFC 8305 4). """
+    if not infos:
+        return []
+    first = [i for i in infos if i[0] == infos[0][0]]
+    others = [i for i in infos if i[0] != infos[0][0]]
+    return [
+        i for pair in itertools.zip_longest(first, others) for i in pair
+        if i is not None
+    ]
+
+
+def addresses(url: str) -> typing.List[_AddrInfo]:
+    """ Returns the addresses to try for the url.  Empty if it cannot be resolved. """
+    host, port = address_of(url)
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except OSError:
+        return []
+    return _interleave(infos)
+
+
+def _open(info: _AddrInfo) -> typing.Optional[socket.socket]:
+    """ Start a non-blocking connection attempt to the address.
+
+    Returns None if the attempt failed immediately.
+    """
+    family, type_, proto, _, addr = info
+    try:
+        sock = socket.socket(family, type_, proto)
+    except OSError:
+        # e.g. IPv6 is disabled.
+        return None
+    sock.setblocking(False)
+    err = sock.connect_ex(addr)
+    if err not in (0, errno.EINPROGRESS):
+        sock.close()
+        return None
+    return sock
+
+
+def race(urls: typing.Tuple[str, ...],
+         stagger: float = DEFAULT_STAGGER,
+         timeout: typing.Optional[float] = DEFAULT_TIMEOUT
+         ) -> typing.Tuple[str, ...]:
+    """ Reorder urls by racing TCP connections to them.
+
+    Every address of each url is tried, alternating IPv6 and IPv4.  Connection
+    attempts start in the given order, one every `stagger` seconds or as soon as
+    all running attempts have failed.  Hosts are resolved when their first attempt
+    is due.  When an attempt connects, the other attempts are cancelled and the
+    result is ordered as: the winner, urls not yet decided, urls failed to connect.
+    A url fails when attempts to all of its addresses have failed.
+    If no attempt succeeds within `timeout` seconds, urls are returned as is.
+    """
+    if len(urls) < 2:
+        return urls
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    failed: typing.List[str] = []
+    winner: typing.Optional[str] = None
+    next_index = 0
+    next_start = time.monotonic()
+    # Addresses not tried yet, and the number of unfinished attempts of each url.
+    queue: typing.Deque[typing.Tuple[str, _AddrInfo]] = collections.deque()
+    remaining: typing.Dict[str, int] = {}
+
+    def fail(url: str):
+        remaining[url] -= 1
+        if remaining[url] == 0:
+            failed.append(url)
+
+    with selectors.DefaultSelector() as sel:
+        try:
+            while winner is None:
+                now = time.monotonic()
+                running = len(sel.get_map())
+                if (queue or next_index < len(urls)) and (now >= next_start
+                                                          or running == 0):
+                    if not queue:
+                        url = urls[next_index]
+                        next_index += 1
+                        infos = addresses(url)
+                        remaining[url] = len(infos)
+                        if not infos:
+                            failed.append(url)
+                            continue
+                        queue.extend((url, i) for i in infos)
+                    url, info = queue.popleft()
+                    next_start = now + stagger
+                    sock = _open(info)
+                    if sock is None:
+                        fail(url)
+                    else:
+                        sel.register(sock, selectors.EVENT_WRITE, url)
+                    continue
+
+                if running == 0:
+                    # All attempts failed.
+                    break
+                if deadline is not None and now >= deadline:
+                    break
+
+                wait = None
+                if queue or next_index < len(urls):
+                    wait = max(0.0, next_start - now)
+                if deadline is not None:
+                    wait = max(0.0, deadline - now) if wait is None else min(
+                        wait, deadline - now)
+
+                for key, _ in sel.select(wait):
+                    sock = typing.cast(socket.socket, key.fileobj)
+                    sel.unregister(sock)
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    sock.close()
+                    if err == 0:
+                        winner = key.data
+                        break
+                    fail(key.data)
+        finally:
+            # Cancel the remaining attempts.
+            for key in list(sel.get_map().values()):
+                sel.unregister(key.fileobj)
+                typing.cast(socket.socket, key.fileobj).close()
+
+    if winner is None:
+        return urls
+
+    rest = tuple(u for u in urls if u != winner and u not in failed)
+    return (winner, ) + rest + tuple(u for u in urls if u in failed)
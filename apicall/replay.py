@@ -0,0 +1,299 @@
+""" Replay access logs.
+
+アクセスログを1行ずつ読みながら、記録されたリクエストを元の間隔で再送信する。
+ログ全体をメモリに読み込まないので、巨大なログでも扱える。
+
+Supported formats are detected line by line.
+
+* Common or combined log format.  A response time in seconds may follow as the
+  last field, like nginx's $request_time.
+* JSON Lines.  Keys are "time" (epoch seconds or ISO 8601), "method", "path" (or
+  "url"), and optionally "status", "latency" (seconds), "headers" and "body".
+"""
+import re
+import gzip
+import json
+import time
+import typing
+import datetime
+import collections
+import dataclasses
+import urllib.parse
+import requests
+from tabulate import tabulate  # type: ignore
+from . import config
+from . import restapi
+from . import transport
+from . import urlutils
+from . import workers
+from .histogram import Histogram
+
+DEFAULT_CONCURRENCY = 16
+
+_CLF = re.compile(r'\S+ \S+ \S+ \[([^\]]+)\] "(\S+) (\S+)[^"]*" (\d{3}) \S+'
+                  r'(?: "[^"]*" "[^"]*")?(?: ([\d.]+))?\s*')
+
+# Headers which must not be copied from the log.
+_SKIP_HEADERS = frozenset(
+    ('host', 'content-length', 'transfer-encoding', 'connection',
+     'keep-alive', 'te', 'upgrade'))
+
+
+class Entry(typing.NamedTuple):
+    """ A request recorded in the log.
+
+    :ivar time: Epoch seconds when the request was received.
+    :ivar target: Path and query string of the request.
+    :ivar status: Status code of the original response.
+    :ivar latency: Response time of the original request in seconds.
+    """
+    time: float
+    method: str
+    target: str
+    status: typing.Optional[int] = None
+    latency: typing.Optional[float] = None
+    headers: typing.Tuple[config.HttpHeader, ...] = ()
+    body: typing.Optional[bytes] = None
+
+
+def _parse_time(value: typing.Any) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    # fromisoformat() of Python 3.9 does not accept "Z".
+    return datetime.datetime.fromisoformat(value.replace('Z',
+                                                         '+00:00')).timestamp()
+
+
+def _target_of(url: str) -> str:
+    """ Strip the scheme and host, because requests are sent to our endpoints. """
+    u = urllib.parse.urlsplit(url)
+    target = u.path or '/'
+    if u.query:
+        target += '?' + u.query
+    return target
+
+
+def _parse_json(line: str) -> Entry:
+    obj = json.loads(line)
+    body = obj.get('body')
+    headers = obj.get('headers') or {}
+    return Entry(
+        time=_parse_time(obj.get('time', obj.get('timestamp'))),
+        method=obj['method'].upper(),
+        target=_target_of(obj.get('path') or obj['url']),
+        status=obj.get('status'),
+        latency=obj.get('latency', obj.get('request_time')),
+        headers=tuple(
+            config.HttpHeader(k, str(v)) for k, v in headers.items()
+            if k.lower() not in _SKIP_HEADERS),
+        body=body.encode() if isinstance(body, str) else None,
+    )
+
+
+def _parse_clf(line: str) -> Entry:
+    m = _CLF.fullmatch(line)
+    if m is None:
+        raise ValueError('Not a common log format line.')
+    when, method, target, status, latency = m.groups()
+    return Entry(
+        time=datetime.datetime.strptime(
+            when, '%d/%b/%Y:%H:%M:%S %z').timestamp(),
+        method=method.upper(),
+        target=_target_of(target),
+        status=int(status),
+        latency=None if latency is None else float(latency),
+    )
+
+
+def parse_line(line: str) -> typing.Optional[Entry]:
+    """ Parse a line of the log.  Returns None if the line is not a request. """
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        if line.startswith('{'):
+            return _parse_json(line)
+        return _parse_clf(line)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def open_log(path: str) -> typing.TextIO:
+    """ Open the log as a text stream.  Gzip-compressed logs are decompressed. """
+    if path.endswith('.gz'):
+        return typing.cast(typing.TextIO, gzip.open(path, 'rt',
+                                                    errors='replace'))
+    return open(path, errors='replace')
+
+
+class Result(typing.NamedTuple):
+    entry: Entry
+    status: typing.Optional[int]
+    error: typing.Optional[str]
+    # Seconds.
+    latency: float
+    # How late the request was sent compared with the schedule.  None if
+    # requests were sent without a schedule (speed 0).
+    lag: typing.Optional[float]
+
+
+@dataclasses.dataclass
+class Stats:
+    """ Comparison between the original and replayed requests.
+
+    Latencies are in microseconds.
+    """
+    original: Histogram = dataclasses.field(default_factory=Histogram)
+    replayed: Histogram = dataclasses.field(default_factory=Histogram)
+    # Replayed latencies of the requests whose original latencies are known.
+    compared: Histogram = dataclasses.field(default_factory=Histogram)
+    lag: Histogram = dataclasses.field(default_factory=Histogram)
+    errors: typing.Counter[str] = dataclasses.field(
+        default_factory=collections.Counter)
+    # Requests whose status code differs from the original.
+    mismatches: int = 0
+    # Lines which could not be parsed.
+    skipped: int = 0
+    elapsed: float = 0.0
+
+    def add(self, result: Result):
+        latency = int(result.latency * 1e6)
+        self.replayed.record(latency)
+        if result.lag is not None:
+            self.lag.record(int(result.lag * 1e6))
+        if result.entry.latency is not None:
+            self.original.record(int(result.entry.latency * 1e6))
+            self.compared.record(latency)
+        if result.error is not None:
+            self.errors[result.error] += 1
+        if result.entry.status is not None and result.status is not None and \
+                result.status != result.entry.status:
+            self.mismatches += 1
+
+
+def build_request(entry: Entry, conf: config.Config) -> restapi.Request:
+    return restapi.Request(
+        method=entry.method,
+        urls=urlutils.concat_urls(
+            endpoints=conf.endpoints,
+            url=entry.target,
+            queries=(),
+        ),
+        headers=entry.headers + conf.headers,
+        basic=conf.basic,
+        data=entry.body,
+    )
+
+
+def _send(entry: Entry, at: typing.Optional[float], conf: config.Config,
+          session: transport.Session) -> Result:
+    """ Send the entry at the scheduled time.  If at is None, send it now. """
+    if at is not None:
+        delay = at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    start = time.perf_counter()
+    status = None
+    error = None
+    try:
+        response = build_request(entry, conf).fetch(session=session)
+        status = response.status_code
+        if status >= 500:
+            error = f'HTTP {status}'
+    except restapi.ConnectionError:
+        error = 'connection failed'
+    except restapi.TimeoutError:
+        error = 'timed out'
+    except restapi.TransferError:
+        error = 'connection lost'
+    except (requests.RequestException, ValueError):
+        # e.g. an invalid url or header in the log.  Other entries are sent.
+        error = 'invalid request'
+    return Result(entry, status, error,
+                  time.perf_counter() - start,
+                  None if at is None else max(0.0, start - at))
+
+
+def replay(lines: typing.Iterable[str],
+           conf: config.Config,
+           session: transport.Session,
+           speed: float = 1.0,
+           concurrency: int = DEFAULT_CONCURRENCY) -> Stats:
+    """ Replay requests in the log.
+
+    The interval between requests is divided by speed.  If speed is 0, requests
+    are sent as fast as the concurrency allows.  Lines are read only as fast as
+    requests are sent.
+    """
+    stats = Stats()
+    began = time.perf_counter()
+    first: typing.List[float] = []
+
+    def schedule(
+    ) -> typing.Iterator[typing.Tuple[Entry, typing.Optional[float]]]:
+        for line in lines:
+            entry = parse_line(line)
+            if entry is None:
+                if line.strip():
+                    stats.skipped += 1
+                continue
+            if not first:
+                first.append(entry.time)
+            if speed > 0:
+                # Logs are not strictly sorted.  Early entries are sent at once.
+                yield entry, began + max(0.0, entry.time - first[0]) / speed
+            else:
+                yield entry, None
+
+    results = workers.imap_bounded(
+        lambda item: _send(item[0], item[1], conf, session),
+        schedule(),
+        concurrency=concurrency,
+        ordered=False,
+    )
+    for result in results:
+        stats.add(result)
+    stats.elapsed = time.perf_counter() - began
+    return stats
+
+
+def _ms(us: float) -> str:
+    return f'{us / 1000:.2f}'
+
+
+def report(stats: Stats) -> str:
+    count = stats.replayed.count
+    errors = sum(stats.errors.values())
+    lines = [
+        f'Requests:   {count}',
+        f'Skipped:    {stats.skipped} lines',
+        f'Errors:     {errors} ({errors / max(1, count):.2%})',
+        f'Mismatches: {stats.mismatches} responses with a different status',
+        f'Elapsed:    {stats.elapsed:.2f} s',
+        f'Max lag:    {_ms(stats.lag.max or 0)} ms behind the schedule'
+        if stats.lag.count else 'Max lag:    - (no schedule)',
+        '',
+    ]
+
+    rows = []
+    for p in (50, 90, 99, 99.9):
+        replayed = stats.replayed.percentile(p)
+        if stats.original.count:
+            original = stats.original.percentile(p)
+            compared = stats.compared.percentile(p)
+            rows.append((f'P{p:g}', _ms(original), _ms(compared),
+                         f'{(compared - original) / 1000:+.2f}', _ms(replayed)))
+        else:
+            rows.append((f'P{p:g}', '-', '-', '-', _ms(replayed)))
+    lines.append(
+        tabulate(rows,
+                 headers=('(ms)', 'ORIGINAL', 'REPLAYED', 'DELTA',
+                          'REPLAYED(ALL)'),
+                 disable_numparse=True))
+
+    if stats.errors:
+        lines.append('')
+        lines.append(
+            tabulate(stats.errors.most_common(), headers=('ERROR', 'COUNT')))
+    return '\n'.join(lines)
@@ -1,22 +1,58 @@
+import time
 import typing
+import tempfile
+import dataclasses
 from dataclasses import dataclass
 from . import config
+from . import transport
+from . import retry
+from . import telemetry
+from . import metrics
 import requests
 
 SHOW_HEADERS = 1
+# Size of chunks to read a streamed response body.
+CHUNK_SIZE = 64 * 1024
+# Response bodies larger than this are spooled to a temporary file.
+SPOOL_SIZE = 8 * 1024 * 1024
+
+
+# Request body.  File objects and iterables are sent without loading them into
+# memory.  Iterables are sent with chunked transfer encoding.
+Body = typing.Union[bytes, typing.BinaryIO, typing.Iterable[bytes]]
+
+
+def iter_chunks(body: Body) -> typing.Iterator[bytes]:
+    """ Iterate over the request body without loading it into memory. """
+    if isinstance(body, bytes):
+        yield body
+    elif hasattr(body, 'read'):
+        f = typing.cast(typing.BinaryIO, body)
+        yield from iter(lambda: f.read(CHUNK_SIZE), b'')
+    else:
+        yield from typing.cast(typing.Iterable[bytes], body)
 
 
 class ConnectionError(Exception):
     pass
 
 
+class TimeoutError(Exception):
+    pass
+
+
+class TransferError(Exception):
+    """ The connection was lost while receiving the response body. """
+    pass
+
+
 @dataclass(frozen=True)
 class Request:
     method: str
     urls: typing.Tuple[str, ...]
     headers: typing.Tuple[config.HttpHeader, ...]
     basic: typing.Optional[config.BasicAuth]
-    data: typing.Optional[bytes]
+    data: typing.Optional[Body]
 
     @property
     def dict_headers(self):
@@ -25,33 +61,188 @@ class Request:
     def fetch(
             self,
             verbose: int = 0,
-            logging_cb: typing.Optional[typing.Callable[[str], None]] = None):
-        for url in self.urls:
+            logging_cb: typing.Optional[typing.Callable[[str], None]] = None,
+            session: typing.Optional[transport.Session] = None,
+            stream: bool = False):
+        """ Send the request to the first reachable url.
+
+        If session is omitted, the process-wide shared session is used.
+        If stream is True, the response body is not downloaded until it is
+        accessed.  Use Response.iter_body() to read it without buffering.
+        Failed requests are sent again according to the retry policy of the session.
+        """
+        if session is None:
+            session = transport.default()
+
+        # Position to rewind a file body before sending it again.
+        body_pos = None
+        if hasattr(self.data, 'seek') and hasattr(self.data, 'tell'):
+            body_pos = typing.cast(typing.BinaryIO, self.data).tell()
+
+        with telemetry.span('fetch', {'http.request.method': self.method}):
+            return self._fetch_with_retry(verbose, logging_cb, session, stream,
+                                          body_pos)
+
+    def _fetch_with_retry(self, verbose: int,
+                          logging_cb: typing.Optional[typing.Callable[[str], None]],
+                          session: transport.Session, stream: bool,
+                          body_pos: typing.Optional[int]) -> 'Response':
+        deadline = session.deadline()
+        start, clock = time.time(), time.monotonic()
+        attempt = 1
+        # Urls which requests were sent to.
+        tried: typing.List[str] = []
+        try:
+            while True:
+                try:
+                    res = self._fetch_once(verbose, logging_cb, session, stream,
+                                           deadline, body_pos, attempt, tried)
+                except ConnectionError:
+                    delay = retry.delay_after_error(session.retry, self.method,
+                                                    self.data, attempt, deadline)
+                    if delay is None:
+                        raise
+                else:
+                    delay = retry.delay_after_response(session.retry, self.method,
+                                                       self.data, res.status_code,
+                                                       res.headers, attempt,
+                                                       deadline)
+                    if delay is None:
+                        # The body has not been received yet if it is streamed.
+                        res = self.record_metrics(
+                            session, res, start, clock, attempt,
+                            pending=stream or deadline is not None)
+                        if not stream and deadline is not None:
+                            res.load()
+                        return res
+                    res.close()
+
+                self.logging_retry(verbose, logging_cb, delay, attempt,
+                                   session.retry.max_attempts)
+                time.sleep(delay)
+                attempt += 1
+        except (ConnectionError, TimeoutError):
+            self.record_failure(session, tried, start, clock, attempt)
+            raise
+
+    def _fetch_once(self, verbose: int,
+                    logging_cb: typing.Optional[typing.Callable[[str], None]],
+                    session: transport.Session, stream: bool,
+                    deadline: typing.Optional[float],
+                    body_pos: typing.Optional[int],
+                    attempt: int = 1,
+                    tried: typing.Optional[typing.List[str]] = None
+                    ) -> 'Response':
+        """ Try urls in order until one of them answers.
+
+        Urls are appended to tried before requests are sent to them.
+        """
+        tracer = telemetry.tracer()
+        urls = session.candidates(self.urls, deadline)
+        for i, url in enumerate(urls):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError()
+            if tried is not None:
+                tried.append(url)
+            if body_pos is not None:
+                typing.cast(typing.BinaryIO, self.data).seek(body_pos)
             try:
-                res = requests.request(
-                    self.method,
-                    url,
-                    headers=self.dict_headers,
-                    auth=(self.basic.user, self.basic.password) if self.basic else None,
-                    data=self.data,
-                )
+                with tracer.span(self.method, {
+                        'url.full': url,
+                        'http.request.method': self.method,
+                        'http.request.resend_count': attempt - 1 or None,
+                }, telemetry.KIND_CLIENT) as span:
+                    headers = self.dict_headers
+                    headers.update(span.headers())
+                    kwargs = {}
+                    if tracer.enabled:
+                        kwargs['hooks'] = {'response': _redirect_recorder(tracer)}
+                    res = session.request(
+                        self.method,
+                        url,
+                        headers=headers,
+                        auth=(self.basic.user, self.basic.password) if self.basic else None,
+                        data=self.data,
+                        timeout=session.timeout(deadline, len(urls) - i),
+                        # The body is read later to bound it with the deadline.
+                        stream=stream or deadline is not None,
+                        **kwargs,
+                    )
+                    span.set('http.response.status_code', res.status_code)
+                    if res.status_code >= 400:
+                        span.fail(str(res.status_code))
 
                 self.logging_request(verbose, logging_cb, res)
+                if res.status_code in retry.FAILURE_STATUSES:
+                    session.failed(url)
+                else:
+                    session.succeeded(self.urls, url)
 
                 # The request is successful.  Return the response object.
                 return Response(
                     request=self,
                     _result=res,
+                    failovers=i,
+                    deadline=deadline,
                 )
             except requests.ConnectionError as e:
                 self.logging_error(verbose, logging_cb, err=e)
+                session.failed(url)
                 # Maybe... hostname or port is incorrect.
                 # Try to other urls.
                 continue
+            except requests.Timeout as e:
+                # The server accepted the request, but it did not respond in time.
+                self.logging_error(verbose, logging_cb, err=e)
+                session.failed(url)
+                raise TimeoutError() from e
 
         # Tried all urls, but I could not connect them all.
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError()
         raise ConnectionError()
 
+    def record_failure(self, session: transport.BaseSession,
+                       tried: typing.Sequence[str], start: float, clock: float,
+                       attempt: int):
+        """ Append the failure to the metrics log of the session.
+
+        No endpoint answered.  The last url in tried is recorded.
+        clock is time.monotonic() at start.
+        """
+        metrics.record(session.metrics, self.method,
+                       tried[-1] if tried else self.urls[0], 0, start,
+                       time.monotonic() - clock,
+                       retries=attempt - 1)
+
+    def record_metrics(self,
+                       session: transport.BaseSession,
+                       res: 'Response',
+                       start: float,
+                       clock: float,
+                       attempt: int,
+                       pending: bool = False) -> 'Response':
+        """ Append the result to the metrics log of the session.
+
+        clock is time.monotonic() at start.  If pending is True, the record is
+        appended when the body of the returned response has been received, so that
+        a failed transfer is recorded as a failure.
+        """
+        if session.metrics is None:
+            return res
+        history = res._result.history
+        record = metrics.Record.of(self.method,
+                                   (history[0] if history else res._result).url,
+                                   res.status_code, start,
+                                   time.monotonic() - clock, res.failovers,
+                                   attempt - 1)
+        if not pending:
+            session.metrics.append(record)
+            return res
+        return dataclasses.replace(res,
+                                   _metrics=metrics.Pending(
+                                       session.metrics, record))
+
     def logging_request(self, verbose: int,
                         cb: typing.Optional[typing.Callable[[str], None]],
                         res: requests.Response):
@@ -76,7 +267,7 @@ class Request:
 
     def logging_error(self, verbose: int,
                       cb: typing.Optional[typing.Callable[[str], None]],
-                      err: requests.ConnectionError):
+                      err: requests.RequestException):
         if cb is None:
             return
         if verbose < SHOW_HEADERS:
@@ -84,11 +275,60 @@ class Request:
 
         cb(f'ERROR: {err}')
 
+    def logging_retry(self, verbose: int,
+                      cb: typing.Optional[typing.Callable[[str], None]],
+                      delay: float, attempt: int, max_attempts: int):
+        if cb is None:
+            return
+        if verbose < SHOW_HEADERS:
+            return
+
+        cb(f'Retrying in {delay:.2f} seconds... ({attempt}/{max_attempts - 1})')
+
+
+def _redirect_recorder(tracer: telemetry.AnyTracer) -> typing.Callable:
+    """ Returns a response hook of requests to record a span for each redirect. """
+    start = telemetry.now()
+
+    def hook(res: requests.Response, **kwargs):
+        nonlocal start
+        end = telemetry.now()
+        if res.is_redirect:
+            tracer.record(
+                'redirect', start, end, {
+                    'url.full': res.url,
+                    'http.response.status_code': res.status_code,
+                    'http.response.header.location': res.headers.get('location'),
+                })
+        start = end
+
+    return hook
+
 
 @dataclass(frozen=True)
 class Response:
     request: Request
     _result: requests.Response
+    # Number of endpoints which failed before this response.
+    failovers: int = 0
+    # time.monotonic() value by which the body must be received (--max-time).
+    deadline: typing.Optional[float] = None
+    # The metrics record to append when the body has been received.
+    _metrics: typing.Optional[metrics.Pending] = None
+
+    @property
+    def url(self) -> str:
+        """ The url of the final response after redirects. """
+        return self._result.url
+
+    @property
+    def status_code(self) -> int:
+        return self._result.status_code
+
+    @property
+    def headers(self) -> typing.Mapping[str, str]:
+        """ Response headers.  Names are case-insensitive. """
+        return self._result.headers
 
     @property
     def body(self) -> str:
@@ -102,6 +342,65 @@ class Response:
     def json(self):
         return self._result.json()
 
+    def iter_body(self,
+                  chunk_size: int = CHUNK_SIZE) -> typing.Iterator[bytes]:
+        """ Iterate over the response body as it arrives.
+
+        Raises TimeoutError when the deadline has passed, and TransferError when
+        the connection was lost.  The deadline is checked whenever a chunk arrives.
+        """
+        try:
+            for chunk in self._result.iter_content(chunk_size):
+                if self._expired():
+                    self._finish_metrics(failed=True)
+                    self.close()
+                    raise TimeoutError()
+                yield chunk
+        except requests.RequestException as e:
+            self._finish_metrics(failed=True)
+            if self._expired():
+                raise TimeoutError() from e
+            raise TransferError() from e
+        self._finish_metrics()
+
+    def _finish_metrics(self, failed: bool = False):
+        if self._metrics is not None:
+            self._metrics.finish(failed)
+
+    def _expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def load(self):
+        """ Read the whole body into memory now, within the deadline. """
+        body = b''.join(self.iter_body())
+        # Like requests does for non-streaming requests.
+        self._result._content = body
+        self._result._content_consumed = True
+
+    def write_to(self, f: typing.BinaryIO) -> int:
+        """ Write the response body to f and returns the number of bytes. """
+        size = 0
+        for chunk in self.iter_body():
+            f.write(chunk)
+            size += len(chunk)
+        return size
+
+    def spool(self, max_size: int = SPOOL_SIZE) -> typing.BinaryIO:
+        """ Returns the response body as a file object.
+
+        The body is kept in memory if it is smaller than max_size.  Otherwise it is
+        written to a temporary file.  The caller should close the returned file.
+        """
+        f = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self.write_to(typing.cast(typing.BinaryIO, f))
+        f.seek(0)
+        return typing.cast(typing.BinaryIO, f)
+
+    def close(self):
+        """ Release the connection back to the pool. """
+        self._finish_metrics()
+        self._result.close()
+
     @property
     def turnaround_time(self):
         return self._result.elapsed
@@ -0,0 +1,88 @@
+""" Retry policy.
+
+リトライするかどうかと、次の試行までの待ち時間を決める。
+実際の待機と再送信はrestapiとaioの各エンジンが行う。
+"""
+import time
+import random
+import typing
+import email.utils
+from . import config
+
+# The server tells that the request was not processed.  They can be retried
+# regardless of the method.
+_REFUSED_STATUSES = (429, 503)
+# Responses which mean the endpoint is unhealthy.
+FAILURE_STATUSES = (502, 503, 504)
+
+
+def parse_retry_after(value: typing.Optional[str]) -> typing.Optional[float]:
+    """ Parse the Retry-After header.  Returns seconds to wait. """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def backoff(policy: config.Retry, attempt: int) -> float:
+    """ Returns the delay before the next attempt with full jitter. """
+    cap = min(policy.max_backoff, policy.backoff * 2**(attempt - 1))
+    return random.uniform(0, cap)
+
+
+def replayable(data: typing.Any) -> bool:
+    """ Returns True if the body can be sent again. """
+    return data is None or isinstance(data, bytes) or hasattr(data, 'seek')
+
+
+def _allowed(policy: config.Retry, data: typing.Any, attempt: int) -> bool:
+    return attempt < policy.max_attempts and replayable(data)
+
+
+def _fits(delay: float, deadline: typing.Optional[float]) -> bool:
+    return deadline is None or time.monotonic() + delay < deadline
+
+
+def delay_after_error(policy: config.Retry, method: str, data: typing.Any,
+                      attempt: int,
+                      deadline: typing.Optional[float]) -> typing.Optional[float]:
+    """ Returns the delay before retrying after no endpoint could be connected.
+
+    attempt is the number of attempts made so far.  None means the error should
+    be raised.
+    """
+    if not _allowed(policy, data, attempt):
+        return None
+    if method.upper() not in policy.methods:
+        return None
+    delay = backoff(policy, attempt)
+    return delay if _fits(delay, deadline) else None
+
+
+def delay_after_response(
+        policy: config.Retry, method: str, data: typing.Any, status: int,
+        headers: typing.Mapping[str, str], attempt: int,
+        deadline: typing.Optional[float]) -> typing.Optional[float]:
+    """ Returns the delay before retrying after the response.
+
+    None means the response should be returned.
+    """
+    if status not in policy.statuses or not _allowed(policy, data, attempt):
+        return None
+    if method.upper() not in policy.methods and \
+            status not in _REFUSED_STATUSES:
+        return None
+
+    delay = parse_retry_after(headers.get('retry-after'))
+    if delay is None:
+        delay = backoff(policy, attempt)
+    elif delay > policy.max_backoff:
+        # Do not wait so long.  Let the caller decide.
+        return None
+    return delay if _fits(delay, deadline) else None
@@ -0,0 +1,46 @@
+""" Small JSON files to keep state between invocations.
+
+状態ファイルは複数のプロセスから同時に読み書きされるため、
+書き込みは一時ファイルへの書き込みとリネームで行う。
+"""
+import os
+import json
+import typing
+import tempfile
+
+
+def read(path: str) -> typing.Optional[dict]:
+    """ Returns the content of the file, or None if it is missing or broken. """
+    try:
+        with open(path) as f:
+            obj = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(obj, dict):
+        return None
+    return obj
+
+
+def write(path: str, obj: dict):
+    """ Replace the file atomically.  Errors are ignored because state is best effort. """
+    # Write to a temporary file and rename it, so that concurrent processes
+    # never read a half-written file.
+    dirname = os.path.dirname(os.path.abspath(path))
+    try:
+        fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.apicall-')
+    except OSError:
+        # The directory is not writable.
+        return
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(obj, f)
+        os.replace(tmp, path)
+    except OSError:
+        _remove_quietly(tmp)
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,90 @@
+""" Parameter sweeps over URL templates.
+
+"/users/{id}" のようなURLテンプレートに値のリストを当てはめ、展開したリクエストを
+並行して送信する。値はファイルや標準入力から1行ずつ読み込む。
+
+Values are given as "NAME=a,b,c", "NAME=@FILE" or "NAME=@-" (stdin).  With
+several parameters, all combinations are requested.  The values of the first
+parameter are streamed, and the others are read into memory.
+"""
+import typing
+from . import batch
+from . import restapi
+from . import transport
+from . import workers
+
+Values = typing.Dict[str, str]
+
+
+class Param(typing.NamedTuple):
+    name: str
+    # "@FILE", "@-" or comma-separated values.
+    source: str
+
+    @classmethod
+    def parse(cls, spec: str) -> 'Param':
+        name, sep, source = spec.partition('=')
+        if not sep or not name.isidentifier():
+            raise ValueError(f'Invalid parameter: {spec}')
+        return cls(name, source)
+
+    def values(self, stdin: typing.Iterable[str]) -> typing.Iterator[str]:
+        """ Yields values.  Empty lines of files are skipped. """
+        if self.source == '@-':
+            lines: typing.Iterable[str] = stdin
+        elif self.source.startswith('@'):
+            yield from _read_lines(self.source[1:])
+            return
+        else:
+            lines = self.source.split(',')
+        for line in lines:
+            value = line.strip()
+            if value:
+                yield value
+
+
+def _read_lines(path: str) -> typing.Iterator[str]:
+    with open(path) as f:
+        for line in f:
+            value = line.strip()
+            if value:
+                yield value
+
+
+def combinations(params: typing.Sequence[Param],
+                 stdin: typing.Iterable[str]) -> typing.Iterator[Values]:
+    """ Yields all combinations of values.  The last parameter changes fastest. """
+    if not params:
+        return
+    rest = [list(p.values(stdin)) for p in params[1:]]
+
+    def product(i: int, values: Values) -> typing.Iterator[Values]:
+        if i == len(rest):
+            yield dict(values)
+            return
+        for value in rest[i]:
+            values[params[i + 1].name] = value
+            yield from product(i + 1, values)
+
+    for value in params[0].values(stdin):
+        yield from product(0, {params[0].name: value})
+
+
+def run(combos: typing.Iterable[Values],
+        build: typing.Callable[[Values], restapi.Request],
+        session: transport.Session,
+        concurrency: int = batch.DEFAULT_CONCURRENCY,
+        ordered: bool = True) -> typing.Iterator[dict]:
+    """ Send a request for each combination, and yields result records.
+
+    Records are the same as apicall batch, and "params" holds the values.
+    """
+    def execute(item: typing.Tuple[int, Values]) -> dict:
+        index, values = item
+        record = {'index': index, 'params': values}
+        return batch.fetch_record(record, lambda: build(values), session)
+
+    return workers.imap_bounded(execute,
+                                enumerate(combos),
+                                concurrency=concurrency,
+                                ordered=ordered)
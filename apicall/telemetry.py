@@ -0,0 +1,317 @@
+""" OpenTelemetry-compatible tracing.
+
+コマンドの各段階（引数の解析、設定の読み込み、エンドポイントへの試行、リダイレクト、
+出力）をスパンとして記録し、OTLP/JSON形式でファイルかコレクターに送る。
+送信するリクエストにはW3C Trace Contextのtraceparentヘッダーを付けるので、
+サーバー側のトレースとつながる。
+
+Tracing is disabled by default.  The disabled tracer does not allocate spans, so
+instrumented code costs only a function call.  If the TRACEPARENT environment
+variable is set, spans are recorded as children of it.
+"""
+import os
+import re
+import json
+import time
+import typing
+import threading
+import contextlib
+import dataclasses
+import requests
+from . import version
+
+TRACEPARENT = 'traceparent'
+TRACESTATE = 'tracestate'
+
+# Values of Span.kind in OTLP.
+KIND_INTERNAL = 1
+KIND_CLIENT = 3
+# Values of the status code in OTLP.
+STATUS_ERROR = 2
+
+_TRACEPARENT = re.compile(r'00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})')
+
+Attributes = typing.Dict[str, typing.Any]
+
+
+def now() -> int:
+    """ Returns the current time in nanoseconds since the epoch. """
+    return time.time_ns()
+
+
+def _random_id(size: int) -> str:
+    while True:
+        value = os.urandom(size).hex()
+        # All zeros is an invalid id.
+        if value.strip('0'):
+            return value
+
+
+class SpanContext(typing.NamedTuple):
+    trace_id: str
+    span_id: str
+    flags: str = '01'
+    state: str = ''
+
+    @classmethod
+    def parse(cls, traceparent: str,
+              tracestate: str = '') -> typing.Optional['SpanContext']:
+        """ Parse the traceparent header.  Returns None if it is invalid. """
+        m = _TRACEPARENT.fullmatch(traceparent.strip().lower())
+        if m is None:
+            return None
+        trace_id, span_id, flags = m.groups()
+        if not trace_id.strip('0') or not span_id.strip('0'):
+            return None
+        return cls(trace_id, span_id, flags, tracestate.strip())
+
+    @classmethod
+    def from_environ(cls, environ: typing.Mapping[str, str] = os.environ
+                     ) -> typing.Optional['SpanContext']:
+        return cls.parse(environ.get('TRACEPARENT', ''),
+                         environ.get('TRACESTATE', ''))
+
+    @property
+    def traceparent(self) -> str:
+        return f'00-{self.trace_id}-{self.span_id}-{self.flags}'
+
+    def headers(self) -> typing.Dict[str, str]:
+        """ Returns headers to propagate this context. """
+        headers = {TRACEPARENT: self.traceparent}
+        if self.state:
+            headers[TRACESTATE] = self.state
+        return headers
+
+
+@dataclasses.dataclass
+class Span:
+    name: str
+    context: SpanContext
+    parent_id: typing.Optional[str]
+    kind: int = KIND_INTERNAL
+    start: int = dataclasses.field(default_factory=now)
+    end: typing.Optional[int] = None
+    attributes: Attributes = dataclasses.field(default_factory=dict)
+    error: typing.Optional[str] = None
+
+    def set(self, key: str, value: typing.Any):
+        if value is not None:
+            self.attributes[key] = value
+
+    def fail(self, error: str):
+        """ Mark the span as failed.  error is the type of the error. """
+        self.error = error
+        self.attributes['error.type'] = error
+
+    def headers(self) -> typing.Dict[str, str]:
+        return self.context.headers()
+
+    def to_otlp(self) -> dict:
+        span = {
+            'traceId': self.context.trace_id,
+            'spanId': self.context.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            # 64-bit integers are strings in OTLP/JSON.
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end or self.start),
+            'attributes': _otlp_attributes(self.attributes),
+            'status': {} if self.error is None else {
+                'code': STATUS_ERROR,
+                'message': self.error,
+            },
+        }
+        if self.context.state:
+            span['traceState'] = self.context.state
+        if self.parent_id is not None:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _otlp_value(value: typing.Any) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_attributes(attributes: Attributes) -> typing.List[dict]:
+    return [{
+        'key': key,
+        'value': _otlp_value(value)
+    } for key, value in attributes.items()]
+
+
+class NullSpan:
+    """ A span of the disabled tracer.  Everything is ignored. """
+
+    def set(self, key: str, value: typing.Any):
+        pass
+
+    def fail(self, error: str):
+        pass
+
+    def headers(self) -> typing.Dict[str, str]:
+        return {}
+
+
+NULL_SPAN = NullSpan()
+_NULL_CONTEXT = contextlib.nullcontext(NULL_SPAN)
+
+
+class NullTracer:
+    """ The disabled tracer. """
+    enabled = False
+
+    def span(self,
+             name: str,
+             attributes: typing.Optional[Attributes] = None,
+             kind: int = KIND_INTERNAL,
+             start: typing.Optional[int] = None
+             ) -> typing.ContextManager[typing.Any]:
+        return _NULL_CONTEXT
+
+    def record(self,
+               name: str,
+               start: int,
+               end: int,
+               attributes: typing.Optional[Attributes] = None) -> typing.Any:
+        return NULL_SPAN
+
+
+class Tracer:
+    """ Records spans in memory.
+
+    Spans are children of the innermost span opened by span() in the same
+    thread.  In other threads, they are children of the first span.
+
+    :ivar parent: The remote parent.  e.g. TRACEPARENT of the environment.
+    """
+    enabled = True
+
+    def __init__(self, parent: typing.Optional[SpanContext] = None):
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else _random_id(16)
+        self.spans: typing.List[Span] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _current(self) -> typing.Optional[str]:
+        stack = getattr(self._local, 'stack', None)
+        if stack:
+            return stack[-1].context.span_id
+        with self._lock:
+            if self.spans:
+                return self.spans[0].context.span_id
+        return self.parent.span_id if self.parent else None
+
+    def _new(self, name: str, kind: int, start: int,
+             attributes: typing.Optional[Attributes]) -> Span:
+        context = SpanContext(
+            self.trace_id, _random_id(8),
+            self.parent.flags if self.parent else '01',
+            self.parent.state if self.parent else '')
+        span = Span(name, context, self._current(), kind, start,
+                    attributes={
+                        k: v
+                        for k, v in (attributes or {}).items() if v is not None
+                    })
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @contextlib.contextmanager
+    def span(self,
+             name: str,
+             attributes: typing.Optional[Attributes] = None,
+             kind: int = KIND_INTERNAL,
+             start: typing.Optional[int] = None) -> typing.Iterator[Span]:
+        """ Record a span until the block ends.  Exceptions mark it as failed. """
+        span = self._new(name, kind, start or now(), attributes)
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            if span.error is None:
+                span.fail(type(e).__name__)
+            raise
+        finally:
+            stack.pop()
+            span.end = now()
+
+    def record(self,
+               name: str,
+               start: int,
+               end: int,
+               attributes: typing.Optional[Attributes] = None) -> Span:
+        """ Record a span which has already ended. """
+        span = self._new(name, KIND_INTERNAL, start, attributes)
+        span.end = end
+        return span
+
+    def export(self, service: str = 'apicall') -> dict:
+        """ Returns spans as an OTLP/JSON ExportTraceServiceRequest. """
+        with self._lock:
+            spans = [s.to_otlp() for s in self.spans]
+        return {
+            'resourceSpans': [{
+                'resource': {
+                    'attributes': _otlp_attributes({'service.name': service}),
+                },
+                'scopeSpans': [{
+                    'scope': {
+                        'name': 'apicall',
+                        'version': version.VERSION,
+                    },
+                    'spans': spans,
+                }],
+            }],
+        }
+
+
+AnyTracer = typing.Union[Tracer, NullTracer]
+_tracer: AnyTracer = NullTracer()
+
+
+def tracer() -> AnyTracer:
+    """ Returns the tracer of this process. """
+    return _tracer
+
+
+@contextlib.contextmanager
+def installed(t: AnyTracer) -> typing.Iterator[AnyTracer]:
+    """ Use the tracer in the block. """
+    global _tracer
+    previous = _tracer
+    _tracer = t
+    try:
+        yield t
+    finally:
+        _tracer = previous
+
+
+def span(name: str,
+         attributes: typing.Optional[Attributes] = None,
+         kind: int = KIND_INTERNAL) -> typing.ContextManager[typing.Any]:
+    """ Record a span with the tracer of this process. """
+    return _tracer.span(name, attributes, kind)
+
+
+def write_file(path: str, payload: dict):
+    """ Append the payload as a line, like the OTLP file exporter. """
+    with open(path, 'a') as f:
+        f.write(json.dumps(payload, separators=(',', ':')))
+        f.write('\n')
+
+
+def post(url: str, payload: dict, timeout: float = 5.0):
+    """ Send the payload to an OTLP/HTTP collector.  e.g. http://localhost:4318/v1/traces """
+    res = requests.post(url,
+                        data=json.dumps(payload),
+                        headers={'content-type': 'application/json'},
+                        timeout=timeout)
+    res.raise_for_status()
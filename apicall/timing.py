@@ -0,0 +1,335 @@
+""" Per-phase timing of requests.
+
+コネクションプールの接続クラスを差し替えて、名前解決・TCP接続・TLSハンドシェイク・
+リクエスト送信・最初のバイトまでの待ち時間を計測する。計測はtracing()の中で
+送られたリクエストだけが対象で、スレッドごとに独立している。
+
+Every request on the wire is a hop.  Redirects, retries and failover attempts
+make more hops, and failed hops are recorded with the error.
+"""
+import re
+import json
+import time
+import socket
+import typing
+import threading
+import contextlib
+import dataclasses
+import urllib3
+import urllib3.connection
+import urllib3.connectionpool
+import urllib3.exceptions
+import urllib3.util.connection
+import requests
+import requests.adapters
+
+_local = threading.local()
+
+
+@dataclasses.dataclass
+class Hop:
+    """ Timestamps of a request.  They are time.perf_counter() values.
+
+    Phases which did not happen are None.  e.g. dns and connected are None if a
+    pooled connection was reused.
+    """
+    start: float
+    method: str = ''
+    url: str = ''
+    reused: bool = True
+    remote_ip: typing.Optional[str] = None
+    dns: typing.Optional[float] = None
+    tcp: typing.Optional[float] = None
+    tls: typing.Optional[float] = None
+    sent: typing.Optional[float] = None
+    first_byte: typing.Optional[float] = None
+    status: typing.Optional[int] = None
+    error: typing.Optional[str] = None
+    bytes_up: int = 0
+    response: typing.Optional[urllib3.BaseHTTPResponse] = None
+
+    @property
+    def connected(self) -> float:
+        """ When the request could be sent. """
+        return self.tls or self.tcp or self.start
+
+    @property
+    def bytes_down(self) -> int:
+        res = self.response
+        if res is None:
+            return 0
+        # Approximate size of the status line and headers.
+        size = len(f'HTTP/1.1 {res.status} {res.reason}\r\n') + 2
+        size += sum(len(k) + len(v) + 4 for k, v in res.headers.items())
+        return size + res.tell()
+
+
+@dataclasses.dataclass
+class Trace:
+    start: float = dataclasses.field(default_factory=time.perf_counter)
+    end: typing.Optional[float] = None
+    hops: typing.List[Hop] = dataclasses.field(default_factory=list)
+
+    def begin(self) -> Hop:
+        hop = Hop(start=time.perf_counter())
+        self.hops.append(hop)
+        return hop
+
+    def finish(self):
+        """ Mark the end of the transfer.  Call it after the body was read. """
+        self.end = time.perf_counter()
+
+    def done_of(self, i: int) -> float:
+        """ When the hop ended.  Redirected and retried bodies are read just before the next hop. """
+        if i + 1 < len(self.hops):
+            return self.hops[i + 1].start
+        return self.end or time.perf_counter()
+
+
+def current() -> typing.Optional[Trace]:
+    return getattr(_local, 'trace', None)
+
+
+@contextlib.contextmanager
+def tracing() -> typing.Iterator[Trace]:
+    """ Record requests sent by sessions with timing=True in this thread. """
+    trace = Trace()
+    previous = current()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+class _TimedConnection:
+    """ Mixin of urllib3 connections to record phases into the current trace. """
+    _hop: typing.Optional[Hop] = None
+    _dns_host: str
+
+    def _active_hop(self) -> typing.Optional[Hop]:
+        """ Returns the hop in progress on this connection, or begins a new one. """
+        trace = current()
+        if trace is None:
+            return None
+        hop = self._hop
+        if hop is None or hop not in trace.hops or hop.first_byte is not None \
+                or hop.error is not None:
+            hop = trace.begin()
+            self._hop = hop
+        return hop
+
+    def _new_conn(self) -> socket.socket:
+        hop = self._hop if current() is not None else None
+        if hop is None:
+            return super()._new_conn()  # type: ignore
+
+        # Resolve the name here to measure DNS apart from the TCP handshake.
+        # urllib3 connects to the resolved addresses without resolving them again.
+        host = self._dns_host
+        try:
+            addresses = [
+                str(info[4][0]) for info in socket.getaddrinfo(
+                    host.strip('[]'), self.port,  # type: ignore
+                    urllib3.util.connection.allowed_gai_family(),
+                    socket.SOCK_STREAM)
+            ]
+        except OSError:
+            # Let urllib3 raise the error.
+            addresses = [host]
+        hop.dns = time.perf_counter()
+
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    sock = super()._new_conn()  # type: ignore
+                    break
+                except (urllib3.exceptions.NewConnectionError,
+                        urllib3.exceptions.ConnectTimeoutError):
+                    if i + 1 == len(addresses):
+                        raise
+        finally:
+            self._dns_host = host
+        hop.tcp = time.perf_counter()
+        with contextlib.suppress(OSError):
+            hop.remote_ip = sock.getpeername()[0]
+        return sock
+
+    def connect(self):
+        hop = self._active_hop()
+        if hop is None:
+            return super().connect()  # type: ignore
+        hop.reused = False
+        try:
+            super().connect()  # type: ignore
+        except Exception as e:
+            hop.error = type(e).__name__
+            raise
+        if isinstance(self, urllib3.connection.HTTPSConnection):
+            hop.tls = time.perf_counter()
+
+    def request(self, method: str, url: str, *args, **kwargs):
+        hop = self._active_hop()
+        if hop is None:
+            return super().request(method, url, *args,  # type: ignore
+                                   **kwargs)
+        scheme = 'https' if isinstance(
+            self, urllib3.connection.HTTPSConnection) else 'http'
+        hop.method = method
+        hop.url = url if '://' in url else f'{scheme}://{self.host}:{self.port}{url}'  # type: ignore
+        try:
+            super().request(method, url, *args, **kwargs)  # type: ignore
+        except Exception as e:
+            hop.error = type(e).__name__
+            raise
+        hop.sent = time.perf_counter()
+
+    def send(self, data):
+        super().send(data)  # type: ignore
+        hop = self._hop
+        if hop is not None and current() is not None:
+            hop.bytes_up += len(data) if hasattr(data, '__len__') else 0
+
+    def getresponse(self):
+        hop = self._hop if current() is not None else None
+        try:
+            res = super().getresponse()  # type: ignore
+        except Exception as e:
+            if hop is not None:
+                hop.error = type(e).__name__
+            raise
+        if hop is not None:
+            hop.first_byte = time.perf_counter()
+            hop.status = res.status
+            hop.response = res
+        return res
+
+
+class TimedHTTPConnection(_TimedConnection, urllib3.connection.HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnection,
+                           urllib3.connection.HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimingAdapter(requests.adapters.HTTPAdapter):
+    """ HTTPAdapter whose connections record timings. """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+def _seconds(value: typing.Optional[float]) -> typing.Optional[float]:
+    return None if value is None else round(value, 6)
+
+
+def _phase(begin: typing.Optional[float],
+           end: typing.Optional[float]) -> typing.Optional[float]:
+    if begin is None or end is None:
+        return None
+    return _seconds(max(0.0, end - begin))
+
+
+def hop_record(trace: Trace, i: int) -> dict:
+    """ Returns durations of the phases of the hop in seconds. """
+    hop = trace.hops[i]
+    connected = hop.connected
+    return {
+        'method': hop.method,
+        'url': hop.url,
+        'status': hop.status,
+        'error': hop.error,
+        'reused': hop.reused,
+        'remote_ip': hop.remote_ip,
+        'start': _phase(trace.start, hop.start),
+        'dns': _phase(hop.start, hop.dns),
+        'connect': _phase(hop.dns or hop.start, hop.tcp),
+        'tls': _phase(hop.tcp, hop.tls),
+        'send': _phase(connected, hop.sent),
+        'wait': _phase(hop.sent, hop.first_byte),
+        'transfer': _phase(hop.first_byte, trace.done_of(i))
+        if hop.first_byte is not None else None,
+        'bytes_up': hop.bytes_up,
+        'bytes_down': hop.bytes_down,
+    }
+
+
+def summary(trace: Trace) -> dict:
+    """ Returns curl-like metrics of the final hop, and records of all hops.
+
+    time_* are seconds from the start of the request, like curl.  attempt is the
+    number of hops until the first response, including failed connections to
+    other endpoints.
+    """
+    result: typing.Dict[str, typing.Any] = {}
+    answered = [hop for hop in trace.hops if hop.status is not None]
+    end = trace.end or time.perf_counter()
+    if answered:
+        last = answered[-1]
+        i = trace.hops.index(last)
+        https = last.tls is not None
+
+        def since_start(t: typing.Optional[float]) -> float:
+            return _seconds((t or last.start) - trace.start) or 0.0
+
+        result.update({
+            'http_code': last.status,
+            'url_effective': last.url,
+            'remote_ip': last.remote_ip,
+            'time_namelookup': since_start(last.dns),
+            'time_connect': since_start(last.tcp),
+            'time_appconnect': since_start(last.tls) if https else 0.0,
+            'time_pretransfer': since_start(last.connected),
+            'time_starttransfer': since_start(last.first_byte),
+            'time_redirect': since_start(last.start) if i > 0 else 0.0,
+            'size_upload': last.bytes_up,
+            'size_download': last.bytes_down,
+            'num_connects': sum(1 for hop in trace.hops if not hop.reused),
+            'num_redirects': sum(1 for hop in answered[:-1]
+                                 if 300 <= (hop.status or 0) < 400),
+        })
+        # Endpoints which could not be connected were tried before.
+        result['attempt'] = 1 + next(
+            n for n, hop in enumerate(trace.hops) if hop.status is not None)
+    result['time_total'] = _seconds(end - trace.start)
+    result['hops'] = [hop_record(trace, i) for i in range(len(trace.hops))]
+    return result
+
+
+_VARIABLE = re.compile(r'%\{(\w+)\}')
+_ESCAPES = {'\\n': '\n', '\\t': '\t', '\\r': '\r', '\\\\': '\\'}
+
+
+def write_out(fmt: str, metrics: dict) -> str:
+    """ Expand a curl-style --write-out format like "%{http_code} %{time_total}\\n".
+
+    %{json} is all metrics as JSON.  Unknown variables are expanded to empty.
+    """
+    def variable(m: typing.Match) -> str:
+        name = m.group(1)
+        if name == 'json':
+            return json.dumps(metrics)
+        value = metrics.get(name)
+        if value is None:
+            return ''
+        if isinstance(value, float):
+            return f'{value:.6f}'
+        return str(value)
+
+    fmt = re.sub(r'\\[ntr\\]', lambda m: _ESCAPES[m.group(0)], fmt)
+    return _VARIABLE.sub(variable, fmt)
@@ -0,0 +1,161 @@
+""" HTTP transport layer shared by restapi and jsonrpc.
+
+requests.Sessionを保持し、同じプロセス内で発行するリクエスト間で
+TCP/TLSコネクションを再利用する。
+"""
+import time
+import typing
+import requests
+import requests.adapters
+from . import config
+from . import race
+from . import affinity as affinity_
+from . import breaker as breaker_
+from . import metrics as metrics_
+from . import httpcache
+from . import timing as timing_
+
+
+class BaseSession:
+    """ Endpoint selection and timeout policy shared by the transport engines.
+
+    :ivar options: The transport settings used to build this session.
+    :ivar affinity: The cache to remember the last working endpoint.
+    :ivar retry: The retry policy.
+    :ivar breaker: The circuit breaker to skip failing endpoints.
+    :ivar metrics: The log to record the latency and status of each request.
+    """
+
+    def __init__(self,
+                 options: typing.Optional[config.Transport] = None,
+                 affinity: typing.Optional[affinity_.AffinityCache] = None,
+                 retry: typing.Optional[config.Retry] = None,
+                 breaker: typing.Optional[breaker_.CircuitBreaker] = None,
+                 metrics: typing.Optional[metrics_.Log] = None):
+        self.options = options or config.Transport()
+        self.affinity = affinity
+        self.retry = retry or config.Retry()
+        self.breaker = breaker
+        self.metrics = metrics
+
+    def deadline(self) -> typing.Optional[float]:
+        """ Returns the time.monotonic() value at which a request started now must end. """
+        if self.options.max_time is None:
+            return None
+        return time.monotonic() + self.options.max_time
+
+    def candidates(
+            self,
+            urls: typing.Tuple[str, ...],
+            deadline: typing.Optional[float] = None,
+    ) -> typing.Tuple[str, ...]:
+        """ Returns urls in the order they should be tried.
+
+        Endpoints whose circuit is open are excluded.
+        """
+        if self.breaker is not None:
+            breaker = self.breaker
+            urls = tuple(u for u in urls if not breaker.is_open(u))
+        if self.affinity is not None:
+            urls = self.affinity.order(urls)
+        if self.options.race:
+            timeout = self.options.connect_timeout or race.DEFAULT_TIMEOUT
+            if deadline is not None:
+                timeout = min(timeout, max(0.0, deadline - time.monotonic()))
+            urls = race.race(
+                urls, stagger=self.options.race_stagger, timeout=timeout)
+        return urls
+
+    def timeout(
+            self,
+            deadline: typing.Optional[float],
+            attempts_left: int,
+    ) -> typing.Optional[typing.Tuple[typing.Optional[float],
+                                      typing.Optional[float]]]:
+        """ Returns (connect, read) timeouts for the next attempt.
+
+        The time remaining until the deadline is split evenly across the remaining
+        attempts for connecting, so that all endpoints are tried before the deadline.
+        The read timeout is the whole remaining time because the request is not
+        retried after the server accepted it.
+        """
+        connect = self.options.connect_timeout
+        if deadline is None:
+            if connect is None:
+                return None
+            return connect, None
+
+        remaining = max(0.0, deadline - time.monotonic())
+        share = remaining / max(1, attempts_left)
+        if connect is None or share < connect:
+            connect = share
+        return connect, remaining
+
+    def succeeded(self, urls: typing.Tuple[str, ...], url: str):
+        """ Notify that url in urls answered successfully. """
+        if self.affinity is not None:
+            self.affinity.record(urls, url)
+        if self.breaker is not None:
+            self.breaker.succeeded(url)
+
+    def failed(self, url: str):
+        """ Notify that url could not be connected or answered with an error. """
+        if self.breaker is not None:
+            self.breaker.failed(url)
+
+
+class Session(BaseSession):
+    """ Owns a requests.Session with configured connection pools. """
+
+    def __init__(self,
+                 options: typing.Optional[config.Transport] = None,
+                 affinity: typing.Optional[affinity_.AffinityCache] = None,
+                 retry: typing.Optional[config.Retry] = None,
+                 breaker: typing.Optional[breaker_.CircuitBreaker] = None,
+                 cache: typing.Optional[httpcache.Cache] = None,
+                 timing: bool = False,
+                 metrics: typing.Optional[metrics_.Log] = None):
+        super().__init__(options, affinity, retry, breaker, metrics)
+        self.cache = cache
+        self._session = requests.Session()
+
+        # Timed connections record phases of requests sent in timing.tracing().
+        adapter_class = timing_.TimingAdapter if timing else \
+            requests.adapters.HTTPAdapter
+        adapter = adapter_class(
+            pool_connections=self.options.pool_connections,
+            pool_maxsize=self.options.pool_maxsize,
+        )
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        if not self.options.keep_alive:
+            self._session.headers['connection'] = 'close'
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        if self.cache is not None:
+            return httpcache.request(self.cache, self._session.request,
+                                     method, url, **kwargs)
+        return self._session.request(method, url, **kwargs)
+
+    def close(self):
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+_default: typing.Optional[Session] = None
+
+
+def default() -> Session:
+    """ Returns the process-wide shared session.
+
+    The session is created at first call with default settings.
+    """
+    global _default
+    if _default is None:
+        _default = Session()
+    return _default
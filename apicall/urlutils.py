@@ -1,6 +1,9 @@
+import re
 import typing
 import urllib.parse
 
+_PLACEHOLDER = re.compile(r'\{([A-Za-z_]\w*)\}')
+
 
 def is_absolute_url(url) -> bool:
     u = urllib.parse.urlsplit(url, scheme='http')
@@ -57,3 +60,23 @@ def concat_urls(
         concated_urls.append(urllib.parse.urlunsplit(components))
 
     return tuple(concated_urls)
+
+
+def placeholders(template: str) -> typing.Tuple[str, ...]:
+    """ Returns names of "{name}" placeholders in the template. """
+    return tuple(m.group(1) for m in _PLACEHOLDER.finditer(template))
+
+
+def expand_template(template: str,
+                    values: typing.Mapping[str, str],
+                    escape: bool = True) -> str:
+    """ Replace "{name}" placeholders with values.
+
+    If escape is True, values are percent-encoded including "/", so that a value
+    is always one path segment or one query value.
+    """
+    def replace(m: typing.Match) -> str:
+        value = values[m.group(1)]
+        return urllib.parse.quote(value, safe='') if escape else value
+
+    return _PLACEHOLDER.sub(replace, template)
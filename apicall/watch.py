@@ -0,0 +1,150 @@
+""" Poll a resource and report changes.
+
+同じリクエストを一定間隔で送り続け、レスポンスが変わったときだけ報告する。
+前回のレスポンスにETagやLast-Modifiedがあれば条件付きリクエストを送るので、
+変化がなければサーバーはボディを返さない。
+"""
+import re
+import json
+import time
+import typing
+import dataclasses
+from . import config
+from . import jsonpath
+from . import restapi
+
+_MISSING = object()
+
+
+class Change(typing.NamedTuple):
+    status: int
+    body: bytes
+    # None if this is the first response.
+    previous: typing.Optional['Change'] = None
+
+
+@dataclasses.dataclass(frozen=True)
+class Condition:
+    """ A condition like '.status == "ready"' to stop watching.
+
+    The value is parsed as JSON.  A value which is not valid JSON is a string.
+    """
+    path: jsonpath.Path
+    value: typing.Any
+    negate: bool = False
+
+    @classmethod
+    def parse(cls, expr: str) -> 'Condition':
+        m = re.fullmatch(r'(.+?)\s*(==|!=)\s*(.*)', expr.strip())
+        if m is None:
+            raise ValueError(f'Invalid condition: {expr}')
+        path, op, value = m.groups()
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            parsed = value
+        return cls(jsonpath.parse(path), parsed, negate=op == '!=')
+
+    def matches(self, body: bytes) -> bool:
+        try:
+            obj = json.loads(body)
+        except ValueError:
+            return False
+        value = jsonpath.lookup(obj, self.path, _MISSING)
+        if value is _MISSING:
+            return False
+        return (value == self.value) != self.negate
+
+
+def diff(old: typing.Any, new: typing.Any,
+         path: jsonpath.Path = ()) -> typing.Iterator[str]:
+    """ Yields differences between JSON values, one per line.
+
+    "+" is an added value, "-" is a removed value, and "~" is a changed value.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in list(old) + [k for k in new if k not in old]:
+            if key not in new:
+                yield f'- {jsonpath.format(path + (key, ))}: {json.dumps(old[key])}'
+            elif key not in old:
+                yield f'+ {jsonpath.format(path + (key, ))}: {json.dumps(new[key])}'
+            else:
+                yield from diff(old[key], new[key], path + (key, ))
+    elif isinstance(old, list) and isinstance(new, list):
+        for i in range(max(len(old), len(new))):
+            if i >= len(new):
+                yield f'- {jsonpath.format(path + (i, ))}: {json.dumps(old[i])}'
+            elif i >= len(old):
+                yield f'+ {jsonpath.format(path + (i, ))}: {json.dumps(new[i])}'
+            else:
+                yield from diff(old[i], new[i], path + (i, ))
+    elif old != new or type(old) is not type(new):
+        yield f'~ {jsonpath.format(path)}: {json.dumps(old)} -> {json.dumps(new)}'
+
+
+def diff_bodies(old: bytes, new: bytes) -> typing.Optional[typing.List[str]]:
+    """ Returns the JSON diff, or None if either of them is not JSON. """
+    try:
+        return list(diff(json.loads(old), json.loads(new)))
+    except ValueError:
+        return None
+
+
+class Watcher:
+    """ Sends the request repeatedly, and detects changes of the response.
+
+    Validators of the last response are sent with the next request.  A 304
+    response means no change.
+    """
+
+    def __init__(self, request: restapi.Request):
+        self.request = request
+        self.last: typing.Optional[Change] = None
+        self._validators: typing.Tuple[config.HttpHeader, ...] = ()
+
+    def poll(self, **fetch_kwargs) -> typing.Optional[Change]:
+        """ Send the request once.  Returns the change, or None if nothing changed.
+
+        fetch_kwargs are passed to restapi.Request.fetch().
+        """
+        request = dataclasses.replace(self.request,
+                                      headers=self.request.headers +
+                                      self._validators)
+        response = request.fetch(**fetch_kwargs)
+        try:
+            if response.status_code == 304 and self.last is not None:
+                return None
+            body = response.raw_body
+        finally:
+            response.close()
+
+        self._validators = ()
+        if 200 <= response.status_code < 300:
+            if 'etag' in response.headers:
+                self._validators += config.HttpHeader(
+                    'if-none-match', response.headers['etag']),
+            if 'last-modified' in response.headers:
+                self._validators += config.HttpHeader(
+                    'if-modified-since', response.headers['last-modified']),
+
+        last = self.last
+        if last is not None and last.status == response.status_code and \
+                last.body == body:
+            return None
+        self.last = Change(response.status_code, body,
+                           last._replace(previous=None) if last else None)
+        return self.last
+
+
+def ticks(interval: float,
+          clock: typing.Callable[[], float] = time.monotonic,
+          sleep: typing.Callable[[float], None] = time.sleep
+          ) -> typing.Iterator[int]:
+    """ Yields at a fixed rate.  Ticks missed by a slow iteration are skipped. """
+    start = clock()
+    n = 0
+    while True:
+        yield n
+        elapsed = clock() - start
+        n = max(n + 1, int(elapsed // interval) + 1)
+        sleep(max(0.0, start + n * interval - clock()))
@@ -0,0 +1,126 @@
+""" Bounded concurrent execution of many tasks.
+
+大量のタスクをスレッドプールで実行する。入力は必要な分だけ読み進めるため、
+タスクの数が多くてもメモリ使用量は一定に保たれる。
+"""
+import asyncio
+import collections
+import typing
+import concurrent.futures
+
+T = typing.TypeVar('T')
+R = typing.TypeVar('R')
+
+
+def imap_bounded(fn: typing.Callable[[T], R],
+                 items: typing.Iterable[T],
+                 concurrency: int,
+                 ordered: bool = True) -> typing.Iterator[R]:
+    """ Apply fn to items with `concurrency` threads.
+
+    At most 2 * concurrency items are taken from items at a time.  Results are
+    yielded in the order of items if ordered is True, otherwise in the order of
+    completion.  Exceptions raised by fn are propagated to the caller.
+    """
+    concurrency = max(1, concurrency)
+    window = 2 * concurrency
+    it = iter(items)
+    pending: typing.Deque[concurrent.futures.Future] = collections.deque()
+
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        try:
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < window:
+                    try:
+                        item = next(it)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.append(executor.submit(fn, item))
+
+                if not pending:
+                    return
+
+                if ordered:
+                    yield pending.popleft().result()
+                else:
+                    done, _ = concurrent.futures.wait(
+                        pending,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                    for f in done:
+                        pending.remove(f)
+                    for f in done:
+                        yield f.result()
+        finally:
+            for f in pending:
+                f.cancel()
+
+
+async def aiter_in_thread(items: typing.Iterable[T]) -> typing.AsyncIterator[T]:
+    """ Iterate over items which block (e.g. lines of stdin) in a thread.
+
+    The event loop keeps running while the next item is being read.
+    """
+    loop = asyncio.get_running_loop()
+    it = iter(items)
+    end = object()
+    while True:
+        item = await loop.run_in_executor(None, next, it, end)
+        if item is end:
+            return
+        yield typing.cast(T, item)
+
+
+async def amap_bounded(fn: typing.Callable[[T], typing.Awaitable[R]],
+                       items: typing.Union[typing.Iterable[T],
+                                           typing.AsyncIterable[T]],
+                       concurrency: int,
+                       ordered: bool = True) -> typing.AsyncIterator[R]:
+    """ The asyncio counterpart of imap_bounded().
+
+    items may be an async iterable, e.g. aiter_in_thread() of a blocking input.
+    At most 2 * concurrency tasks are running at a time.
+    """
+    concurrency = max(1, concurrency)
+    window = 2 * concurrency
+    if isinstance(items, typing.AsyncIterable):
+        ait = items.__aiter__()
+    else:
+        ait = _aiter(items)
+    pending: typing.Deque[asyncio.Task] = collections.deque()
+
+    try:
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < window:
+                try:
+                    item = await ait.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending.append(asyncio.ensure_future(fn(item)))
+
+            if not pending:
+                return
+
+            if ordered:
+                yield await pending.popleft()
+            else:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                # done is a set.  Tasks which finished together are yielded
+                # in the order of items.
+                finished = [t for t in pending if t in done]
+                for t in finished:
+                    pending.remove(t)
+                for t in finished:
+                    yield t.result()
+    finally:
+        for t in pending:
+            t.cancel()
+
+
+async def _aiter(items: typing.Iterable[T]) -> typing.AsyncIterator[T]:
+    for item in items:
+        yield item
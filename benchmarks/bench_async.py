@@ -0,0 +1,126 @@
+""" Scaling benchmark of the thread and asyncio transport engines.
+
+A local asyncio server which answers each request after a fixed delay is
+started in another process.  The delay emulates the latency of a remote API,
+so the throughput is bound by the number of requests kept in flight.  The same
+number of requests is sent at each concurrency with both engines.
+
+Usage:
+    python3 benchmarks/bench_async.py [--delay MS] [--concurrency 10,100,1000] [--engines thread,async]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tabulate import tabulate  # type: ignore
+from apicall import config, restapi, transport, workers, aio
+
+PAYLOAD = b'{"result": "ok"}'
+
+
+def serve(port, delay, ready):
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                if b'content-length:' in head.lower():
+                    length = head.lower().split(b'content-length:')[1]
+                    await reader.readexactly(int(length.split(b'\r\n')[0]))
+                await asyncio.sleep(delay)
+                writer.write(b'HTTP/1.1 200 OK\r\n'
+                             b'content-type: application/json\r\n'
+                             b'content-length: %d\r\n\r\n%s' %
+                             (len(PAYLOAD), PAYLOAD))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    async def main():
+        await asyncio.start_server(handle, '127.0.0.1', port, backlog=4096)
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def request(url):
+    return restapi.Request(method='GET',
+                           urls=(url, ),
+                           headers=(),
+                           basic=None,
+                           data=None)
+
+
+def run_threads(url, concurrency, n):
+    options = config.Transport(pool_maxsize=concurrency)
+    with transport.Session(options) as session:
+        fetch = lambda _: request(url).fetch(session=session).status_code
+        return list(workers.imap_bounded(fetch, range(n), concurrency))
+
+
+def run_async(url, concurrency, n):
+    async def main():
+        options = config.Transport(pool_maxsize=concurrency)
+        async with aio.AsyncSession(options) as session:
+            responses = await asyncio.gather(
+                *(aio.fetch(request(url), session=session) for _ in range(n)))
+            return [r.status_code for r in responses]
+
+    return asyncio.run(main())
+
+
+ENGINES = {'thread': run_threads, 'async': run_async}
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--delay',
+                   type=float,
+                   default=50,
+                   help='response delay in milliseconds')
+    p.add_argument('--concurrency', default='10,100,1000')
+    p.add_argument('--engines', default='thread,async')
+    p.add_argument('--requests',
+                   type=int,
+                   default=0,
+                   help='requests per run (default: 10 * concurrency)')
+    p.add_argument('--port', type=int, default=18080)
+    ns = p.parse_args()
+
+    # Each in-flight request needs a socket on both sides.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve,
+                                     args=(ns.port, ns.delay / 1000, ready),
+                                     daemon=True)
+    server.start()
+    ready.wait()
+    url = f'http://127.0.0.1:{ns.port}/'
+
+    rows = []
+    for concurrency in (int(x) for x in ns.concurrency.split(',')):
+        n = ns.requests or 10 * concurrency
+        for engine in ns.engines.split(','):
+            began = time.perf_counter()
+            statuses = ENGINES[engine](url, concurrency, n)
+            elapsed = time.perf_counter() - began
+            assert statuses == [200] * n
+            rows.append((engine, concurrency, n, f'{elapsed:.2f}',
+                         f'{n / elapsed:.0f}'))
+
+    server.terminate()
+    print(
+        tabulate(rows,
+                 headers=('ENGINE', 'CONCURRENCY', 'REQUESTS', 'TIME(s)',
+                          'REQUESTS/s')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+""" Throughput benchmark of segmented range downloads.
+
+A local HTTP server that supports range requests is started, and the same
+content is downloaded with different numbers of segments.  The server limits
+the bandwidth of each connection to emulate a link where a single TCP stream
+cannot saturate the network.
+
+Usage:
+    python3 benchmarks/bench_segments.py [--size MB] [--rate MB/s] [--segments 1,2,4,8]
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import http.server
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tabulate import tabulate  # type: ignore
+from apicall import config, restapi, transport, download
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    content = b''
+    rate = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        size = len(self.content)
+        start, end = 0, size - 1
+        status = 200
+        m = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('range', ''))
+        if m:
+            start = int(m.group(1))
+            end = min(int(m.group(2) or size - 1), size - 1)
+            status = 206
+
+        self.send_response(status)
+        self.send_header('accept-ranges', 'bytes')
+        self.send_header('etag', '"bench"')
+        if status == 206:
+            self.send_header('content-range', f'bytes {start}-{end}/{size}')
+        self.send_header('content-length', str(end - start + 1))
+        self.end_headers()
+
+        # Send the body with the limited bandwidth.
+        began = time.monotonic()
+        sent = 0
+        view = memoryview(self.content)[start:end + 1]
+        while sent < len(view):
+            chunk = view[sent:sent + CHUNK_SIZE]
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            delay = sent / self.rate - (time.monotonic() - began)
+            if delay > 0:
+                time.sleep(delay)
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--size', type=int, default=64, help='content size in MB')
+    p.add_argument('--rate',
+                   type=float,
+                   default=32,
+                   help='bandwidth per connection in MB/s')
+    p.add_argument('--segments', default='1,2,4,8')
+    ns = p.parse_args()
+
+    RangeHandler.content = os.urandom(ns.size * 1024 * 1024)
+    RangeHandler.rate = ns.rate * 1024 * 1024
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/content'
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'content')
+        for n in (int(x) for x in ns.segments.split(',')):
+            session = transport.Session(config.Transport(pool_maxsize=n))
+            request = restapi.Request(method='GET',
+                                      urls=(url, ),
+                                      headers=(),
+                                      basic=None,
+                                      data=None)
+            began = time.perf_counter()
+            download.save_segmented(path, request, n, session=session)
+            elapsed = time.perf_counter() - began
+
+            with open(path, 'rb') as f:
+                assert f.read() == RangeHandler.content
+            rows.append((n, f'{elapsed:.2f}', f'{ns.size / elapsed:.1f}'))
+            session.close()
+
+    server.shutdown()
+    print(tabulate(rows, headers=('SEGMENTS', 'TIME(s)', 'THROUGHPUT(MB/s)')))
+
+
+if __name__ == '__main__':
+    main()
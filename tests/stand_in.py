@@ -0,0 +1,60 @@
+""" 通信の代わりに用意した応答を返すセッション """
+from __future__ import annotations
+import io
+import typing
+import threading
+import requests
+from apicall import transport
+
+
+class Reply(typing.NamedTuple):
+    status: int = 200
+    headers: typing.Mapping[str, str] = {}
+    # bytes, or a file object to read the body from (e.g. one which fails).
+    body: typing.Union[bytes, typing.BinaryIO] = b''
+
+
+class Sent(typing.NamedTuple):
+    method: str
+    url: str
+    headers: typing.Mapping[str, str]
+
+
+Answer = typing.Callable[[Sent], Reply]
+
+
+def replies(*items: Reply) -> Answer:
+    """ Answer requests with the replies in order. """
+    rest = list(items)
+    return lambda sent: rest.pop(0)
+
+
+class StandInSession(transport.Session):
+    """ Returns replies made by a function instead of sending requests.
+
+    The function may raise, e.g. requests.ConnectionError, to fail the request.
+
+    :ivar sent: Requests in the order they were sent.
+    """
+
+    def __init__(self,
+                 answer: Answer = lambda sent: Reply(),
+                 *args,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.answer = answer
+        self.sent: typing.List[Sent] = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        sent = Sent(method, url, kwargs.get('headers') or {})
+        with self.lock:
+            self.sent.append(sent)
+            reply = self.answer(sent)
+        res = requests.Response()
+        res.status_code = reply.status
+        res.headers = requests.structures.CaseInsensitiveDict(reply.headers)
+        res.raw = io.BytesIO(reply.body) if isinstance(reply.body,
+                                                        bytes) else reply.body
+        res.url = url
+        return res
@@ -0,0 +1,65 @@
+import json
+from apicall.affinity import AffinityCache
+
+ENDPOINTS = (
+    'http://localhost:8000',
+    'http://localhost:8080',
+    'http://localhost:3000',
+)
+URLS = tuple(e + '/users' for e in ENDPOINTS)
+
+
+class TestAffinityCache:
+    def test_no_cache(self, tmp_path):
+        cache = AffinityCache(str(tmp_path / 'cache.json'), ENDPOINTS)
+        assert cache.order(URLS) == URLS
+
+    def test_record_and_order(self, tmp_path):
+        cache = AffinityCache(str(tmp_path / 'cache.json'), ENDPOINTS)
+        cache.record(URLS, URLS[2])
+        assert cache.order(URLS) == (URLS[2], URLS[0], URLS[1])
+
+    def test_endpoints_changed(self, tmp_path):
+        path = str(tmp_path / 'cache.json')
+        AffinityCache(path, ENDPOINTS).record(URLS, URLS[2])
+
+        endpoints = ENDPOINTS[1:]
+        urls = URLS[1:]
+        assert AffinityCache(path, endpoints).order(urls) == urls
+
+    def test_expired(self, tmp_path):
+        path = tmp_path / 'cache.json'
+        path.write_text(
+            json.dumps({
+                'endpoints': list(ENDPOINTS),
+                'endpoint': ENDPOINTS[1],
+                'updated': 0,
+            }))
+        assert AffinityCache(str(path), ENDPOINTS).order(URLS) == URLS
+
+    def test_absolute_url(self, tmp_path):
+        cache = AffinityCache(str(tmp_path / 'cache.json'), ENDPOINTS)
+        cache.record(URLS, URLS[1])
+        assert cache.order(('https://example.com/', )) == (
+            'https://example.com/', )
+
+    def test_broken_file(self, tmp_path):
+        path = tmp_path / 'cache.json'
+        path.write_text('{')
+        assert AffinityCache(str(path), ENDPOINTS).order(URLS) == URLS
+
+    def test_subset_of_urls(self, tmp_path):
+        cache = AffinityCache(str(tmp_path / 'cache.json'), ENDPOINTS)
+        cache.record(URLS, URLS[2])
+        # The circuit breaker excluded the first endpoint.
+        assert cache.order(URLS[1:]) == (URLS[2], URLS[1])
+        assert cache.order(URLS[:2]) == URLS[:2]
+
+    def test_shared_prefix(self, tmp_path):
+        endpoints = ('http://localhost:8000', 'http://localhost:8000/v2')
+        urls = ('http://localhost:8000/users',
+                'http://localhost:8000/v2/users')
+        cache = AffinityCache(str(tmp_path / 'cache.json'), endpoints)
+        cache.record(urls, urls[1])
+        assert cache.preferred() == endpoints[1]
+        assert cache.order(urls) == (urls[1], urls[0])
@@ -0,0 +1,260 @@
+import gzip
+import json
+import time
+import socket
+import asyncio
+import pytest
+import requests
+import apicall.config as config
+from apicall import aio, restapi
+
+
+class StandInServer:
+    """ A minimal HTTP/1.1 server which echoes the request.
+
+    If close_after is set, idle connections are closed after that many requests
+    without notifying the client.
+    """
+
+    def __init__(self, close_after=0):
+        self.close_after = close_after
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        served = 0
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.IncompleteReadError:
+                    return
+                lines = head.decode().split('\r\n')
+                method, target, _ = lines[0].split(' ')
+                headers = {}
+                for line in lines[1:]:
+                    if line:
+                        name, value = line.split(': ', 1)
+                        headers[name.lower()] = value
+                body = b''
+                if 'content-length' in headers:
+                    body = await reader.readexactly(
+                        int(headers['content-length']))
+                elif headers.get('transfer-encoding') == 'chunked':
+                    while True:
+                        size = int(await reader.readuntil(b'\r\n'), 16)
+                        body += (await reader.readexactly(size + 2))[:-2]
+                        if size == 0:
+                            break
+
+                await self.respond(writer, method, target, headers, body)
+                served += 1
+                if served == self.close_after:
+                    return
+        finally:
+            writer.close()
+
+    async def respond(self, writer, method, target, headers, body):
+        status = '200 OK'
+        extra = ''
+        payload = json.dumps({
+            'method': method,
+            'target': target,
+            'body': body.decode(),
+            'authorization': headers.get('authorization'),
+        }).encode()
+        if target == '/redirect':
+            status = '302 Found'
+            extra = 'location: /echo\r\n'
+        elif target == '/gzip':
+            payload = gzip.compress(payload)
+            extra = 'content-encoding: gzip\r\n'
+        elif target == '/chunked':
+            writer.write(b'HTTP/1.1 200 OK\r\ntransfer-encoding: chunked\r\n\r\n'
+                         b'3\r\nabc\r\n2\r\nde\r\n0\r\n\r\n')
+            return
+        writer.write(f'HTTP/1.1 {status}\r\ncontent-length: {len(payload)}\r\n'
+                     f'content-type: application/json\r\n{extra}\r\n'.encode() +
+                     payload)
+        await writer.drain()
+
+
+def closed_url():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f'http://127.0.0.1:{port}'
+
+
+def run(server, fn, options=None):
+    async def main():
+        srv = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        url = f'http://127.0.0.1:{srv.sockets[0].getsockname()[1]}'
+        try:
+            async with aio.AsyncSession(options) as session:
+                return await fn(url, session)
+        finally:
+            srv.close()
+
+    return asyncio.run(main())
+
+
+def request(method, *urls, data=None):
+    return restapi.Request(
+        method=method,
+        urls=urls,
+        headers=(),
+        basic=config.BasicAuth('user', 'pass'),
+        data=data,
+    )
+
+
+def test_fetch():
+    async def fn(url, session):
+        res = await aio.fetch(request('POST', url + '/echo', data=b'hello'),
+                              session=session)
+        return res.status_code, res.content_type, res.json
+
+    status, content_type, body = run(StandInServer(), fn)
+    assert status == 200
+    assert content_type == 'application/json'
+    assert body['body'] == 'hello'
+    assert body['authorization'].startswith('Basic ')
+
+
+def test_failover_and_logging():
+    logs = []
+
+    async def fn(url, session):
+        return await aio.fetch(request('GET', closed_url(), url + '/echo'),
+                               verbose=1,
+                               logging_cb=logs.append,
+                               session=session)
+
+    res = run(StandInServer(), fn)
+    assert res.json['target'] == '/echo'
+    assert logs[0].startswith('ERROR:')
+    assert logs[1].startswith('> GET http://127.0.0.1:')
+
+
+def test_connection_error():
+    async def fn(url, session):
+        await aio.fetch(request('GET', closed_url()), session=session)
+
+    with pytest.raises(restapi.ConnectionError):
+        run(StandInServer(), fn)
+
+
+def test_timeout():
+    async def hang(reader, writer):
+        await asyncio.sleep(10)
+
+    server = StandInServer()
+    server.handle = hang
+
+    async def fn(url, session):
+        await aio.fetch(request('GET', url), session=session)
+
+    with pytest.raises(restapi.TimeoutError):
+        run(server, fn, config.Transport(max_time=0.2))
+
+
+def test_redirect_chunked_and_gzip():
+    async def fn(url, session):
+        redirected = await aio.fetch(request('POST', url + '/redirect'),
+                                     session=session)
+        chunked = await aio.fetch(request('GET', url + '/chunked'),
+                                  session=session)
+        gzipped = await aio.fetch(request('GET', url + '/gzip'),
+                                  session=session)
+        return redirected, chunked, gzipped
+
+    redirected, chunked, gzipped = run(StandInServer(), fn)
+    assert redirected.json['method'] == 'GET'
+    assert redirected.url.endswith('/echo')
+    assert chunked.raw_body == b'abcde'
+    assert gzipped.json['target'] == '/gzip'
+
+
+def test_chunked_request_body():
+    async def fn(url, session):
+        res = await aio.fetch(request('PUT', url, data=iter([b'ab', b'cd'])),
+                              session=session)
+        return res.json
+
+    assert run(StandInServer(), fn)['body'] == 'abcd'
+
+
+def test_connection_reuse():
+    server = StandInServer()
+
+    async def fn(url, session):
+        return await asyncio.gather(*(aio.fetch(
+            request('POST', url, data=b'%d' % i), session=session)
+                                      for i in range(20)))
+
+    responses = run(server, fn, config.Transport(pool_maxsize=4))
+    assert sorted(int(r.json['body']) for r in responses) == list(range(20))
+    assert server.connections <= 4
+
+
+def test_retry_stale_connection():
+    server = StandInServer(close_after=1)
+
+    async def fn(url, session):
+        first = await aio.fetch(request('GET', url), session=session)
+        # Wait until the server closes the idle connection.
+        await asyncio.sleep(0.05)
+        second = await aio.fetch(request('POST', url, data=b'x'),
+                                 session=session)
+        return first, second
+
+    first, second = run(server, fn)
+    assert second.json['body'] == 'x'
+    assert server.connections == 2
+
+
+class TrickleServer(StandInServer):
+    """ Sends the body one byte every 0.1 seconds. """
+
+    async def respond(self, writer, method, target, headers, body):
+        writer.write(b'HTTP/1.1 200 OK\r\ncontent-length: 5\r\n\r\n')
+        for _ in range(5):
+            await asyncio.sleep(0.1)
+            writer.write(b'x')
+            await writer.drain()
+
+
+def test_read_timeout_per_read():
+    async def fn(url, session):
+        res = await session.request('GET', url, timeout=(None, 0.3))
+        return res.content
+
+    # The body takes longer than the read timeout, but each read does not.
+    assert run(TrickleServer(), fn) == b'xxxxx'
+
+
+def test_deadline_bounds_body():
+    async def fn(url, session):
+        await session.request('GET',
+                              url,
+                              timeout=(None, 0.3),
+                              deadline=time.monotonic() + 0.3)
+
+    with pytest.raises(requests.ReadTimeout):
+        run(TrickleServer(), fn)
+
+
+def test_proxy(monkeypatch):
+    async def fn(url, session):
+        res = await aio.fetch(request('GET', url + '/echo'), session=session)
+        return res.status_code
+
+    monkeypatch.setenv('HTTP_PROXY', 'http://proxy.invalid:3128')
+    monkeypatch.delenv('NO_PROXY', raising=False)
+    monkeypatch.delenv('no_proxy', raising=False)
+    with pytest.raises(aio.UnsupportedProxyError):
+        run(StandInServer(), fn)
+
+    monkeypatch.setenv('NO_PROXY', '127.0.0.1')
+    assert run(StandInServer(), fn) == 200
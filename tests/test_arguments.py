@@ -169,3 +169,97 @@ class TestApicallCommand:
         # This operation MUST NOT update config file.
         assert saved_config == config.Config(
             endpoints=('http://localhost:3333', ), )
+
+    def test_endpoint_probe(self):
+        pc = ct.StartCondition(
+            args=[
+                'apicall', 'endpoint', '--probe', '-n', '1', '--reorder',
+                'http://localhost:1', 'http://localhost:2'
+            ],
+            config=config.Config(),
+        ).parse()
+        assert pc.success
+        assert pc.error_message == ''
+        assert isinstance(pc.fn, arg.Endpoint)
+
+        ec = pc.exec()
+        assert ec.out.startswith('ENDPOINT')
+        assert 'http://localhost:1' in ec.out
+        assert ec.err == ''
+        assert ec.exit_code == arg.ExitOk
+        assert saved_config == config.Config(
+            endpoints=('http://localhost:1', 'http://localhost:2'), )
+
+    def test_restcall_timeouts(self):
+        pc = ct.StartCondition(
+            args=[
+                'restcall', '--connect-timeout', '1.5', '-m', '3', 'get',
+                '/users'
+            ],
+            config=config.Config(),
+        ).parse()
+        assert pc.success
+        assert isinstance(pc.fn, arg.Rest)
+
+        options = arg.build_session(pc.ca).options
+        assert options.connect_timeout == 1.5
+        assert options.max_time == 3
+
+    @pytest.mark.parametrize('value', ['abc', '-1'])
+    def test_restcall_invalid_continue_at(self, value):
+        pc = ct.StartCondition(
+            args=['restcall', '-o', 'out', '-C', value, 'GET', '/'],
+            config=None,
+        ).parse()
+        assert not pc.success
+        assert 'non-negative offset' in pc.error_message
+
+    def test_restcall_invalid_form(self):
+        ec = ct.StartCondition(
+            args=['restcall', 'POST', '/upload', '-F', 'name'],
+            config=config.Config(),
+        ).parse().exec()
+        assert ec.err.startswith('ERROR: Invalid form field')
+        assert ec.exit_code == arg.ExitInvalidArgs
+
+
+class TestRestData:
+    def test_detect_complete_data(self):
+        rest = arg.Rest()
+        assert rest.detect_data_type(b'"text"') == (config.HttpHeader(
+            'content-type', 'application/json'), )
+        assert rest.detect_data_type(b'{') == (config.HttpHeader(
+            'content-type', 'text/plain'), )
+
+    def test_detect_head_of_data(self):
+        rest = arg.Rest()
+        assert rest.detect_data_type(b' [1, 2, ', complete=False) == (
+            config.HttpHeader('content-type', 'application/json'), )
+        # The data ends in the middle of a multi-byte character.
+        assert rest.detect_data_type(b'\xe6\x97\xa5\xe6', complete=False) == (
+            config.HttpHeader('content-type', 'text/plain'), )
+        assert rest.detect_data_type(b'\x93\xfa', complete=False) == (
+            config.HttpHeader('content-type', 'application/octet-stream'), )
+
+    def test_peek_file(self, tmp_path):
+        path = tmp_path / 'data'
+        path.write_bytes(b'x' * (arg.DETECT_SIZE + 10))
+        with open(path, 'rb') as f:
+            head, complete, data = arg.Rest().peek_data(f)
+            assert head == b'x' * arg.DETECT_SIZE
+            assert not complete
+            assert data is f
+            assert f.tell() == 0
+
+    def test_peek_stream(self):
+        chunks = [b'a' * arg.DETECT_SIZE, b'b' * 10, b'c']
+        head, complete, data = arg.Rest().peek_data(iter(chunks))
+        assert head == b'a' * arg.DETECT_SIZE
+        assert not complete
+        assert b''.join(data) == b''.join(chunks)
+
+    def test_peek_short_stream(self):
+        head, complete, data = arg.Rest().peek_data(iter([b'{}', b'']))
+        assert head == b'{}'
+        assert complete
+        assert data == b'{}'
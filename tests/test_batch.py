@@ -0,0 +1,158 @@
+import json
+import asyncio
+import pytest
+import apicall.config as config
+from apicall import batch
+from apicall import transport
+from .stand_in import StandInSession
+
+conf = config.Config(
+    endpoints=('http://localhost:1', ),
+    headers=(config.HttpHeader('x-token', 'abc'), ),
+)
+
+
+class TestBuildRequest:
+    def test_rest(self):
+        req = batch.build_request(
+            {
+                'method': 'GET',
+                'url': '/users',
+                'queries': {
+                    'name': 'bob'
+                },
+                'headers': {
+                    'x-trace': 1
+                },
+            }, conf)
+        assert req.method == 'GET'
+        assert req.urls == ('http://localhost:1/users?name=bob', )
+        assert req.headers == (
+            config.HttpHeader('x-token', 'abc'),
+            config.HttpHeader('x-trace', '1'),
+        )
+        assert req.data is None
+
+    def test_json_data(self):
+        req = batch.build_request(
+            {
+                'method': 'POST',
+                'url': '/users',
+                'data': {
+                    'name': 'bob'
+                }
+            }, conf)
+        assert json.loads(req.data) == {'name': 'bob'}
+        assert config.HttpHeader('content-type',
+                                 'application/json') in req.headers
+
+    def test_text_data(self):
+        req = batch.build_request(
+            {
+                'method': 'POST',
+                'url': '/users',
+                'data': 'hello'
+            }, conf)
+        assert req.data == b'hello'
+        assert config.HttpHeader('content-type', 'text/plain') in req.headers
+
+    def test_jsonrpc(self):
+        req = batch.build_request(
+            {
+                'type': 'jsonrpc',
+                'method': 'get_account',
+                'params': [10]
+            }, conf)
+        assert req.method == 'POST'
+        assert req.urls == ('http://localhost:1', )
+        body = json.loads(req.data)
+        assert body['method'] == 'get_account'
+        assert body['params'] == [10]
+
+    @pytest.mark.parametrize('spec', [
+        [],
+        {
+            'url': '/'
+        },
+        {
+            'method': 'GET'
+        },
+        {
+            'type': 'soap',
+            'method': 'GET'
+        },
+        {
+            'method': 'GET',
+            'url': '/',
+            'queries': 'a=b'
+        },
+        {
+            'method': 1,
+            'url': '/'
+        },
+        {
+            'method': 'GET',
+            'url': 1
+        },
+        {
+            'type': 'jsonrpc',
+            'method': 5
+        },
+    ])
+    def test_invalid(self, spec):
+        with pytest.raises(batch.SpecError):
+            batch.build_request(spec, conf)
+
+
+def test_execute_errors():
+    record = batch.execute(3, 'not json', conf, session=None)  # type: ignore
+    assert record['index'] == 3
+    assert record['error'].startswith('Invalid JSON')
+
+    record = batch.execute(0, '{"id": 7, "url": "/"}', conf,
+                           session=None)  # type: ignore
+    assert record['id'] == 7
+    assert record['error'].startswith('Invalid request spec')
+
+
+@pytest.mark.parametrize('line, endpoint', [
+    ('{"method": "GET", "url": "/", "headers": {"x-a": "1\\n2"}}',
+     'http://localhost:1'),
+    ('{"method": "GET", "url": "/"}', 'localhost:1'),
+    ('{"method": "GET", "url": "/"}', 'http://[::1'),
+])
+def test_execute_invalid_requests(line, endpoint):
+    with transport.Session() as session:
+        record = batch.execute(0, line,
+                               config.Config(endpoints=(endpoint, )), session)
+    assert record['error'].startswith('Invalid request: ')
+
+
+def test_execute_unwritable_body(tmp_path):
+    record = batch.execute(0,
+                           '{"method": "GET", "url": "/"}',
+                           conf,
+                           StandInSession(),
+                           body_dir=str(tmp_path / 'missing'))
+    assert record['status'] == 200
+    assert record['error'].startswith('Could not write the body: ')
+
+
+def test_run_invalid_between_valid():
+    lines = [
+        '{"method": "GET", "url": "/a"}',
+        '{"method": 1, "url": "/b"}',
+        '{"type": "jsonrpc", "method": 5}',
+        '{"method": "GET", "url": "/c"}',
+    ]
+    records = list(batch.run(lines, conf, StandInSession()))
+    assert [r.get('status') for r in records] == [200, None, None, 200]
+    assert records[1]['error'] == 'Invalid request spec: "method" must be a string.'
+    assert records[2]['error'].startswith('Invalid request spec')
+
+
+def test_execute_async_invalid():
+    record = asyncio.run(
+        batch.execute_async(0, '{"method": "GET", "url": ["/"]}', conf,
+                            session=None))  # type: ignore
+    assert record['error'] == 'Invalid request spec: "url" must be a string.'
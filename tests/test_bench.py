@@ -0,0 +1,53 @@
+import io
+import socket
+import apicall.config as config
+from apicall import bench, restapi
+
+
+def request(data=None, url=None):
+    if url is None:
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            url = f'http://127.0.0.1:{sock.getsockname()[1]}'
+    return restapi.Request(method='POST',
+                           urls=(url, ),
+                           headers=(),
+                           basic=None,
+                           data=data)
+
+
+def test_replayable():
+    assert bench.replayable(request(b'abc')).data == b'abc'
+    assert bench.replayable(request(io.BytesIO(b'abc'))).data == b'abc'
+    assert bench.replayable(request(iter([b'a', b'bc']))).data == b'abc'
+
+
+def test_split():
+    plans = bench.split(bench.Plan(requests=10, concurrency=5, rate=100), 3)
+    assert [p.requests for p in plans] == [4, 3, 3]
+    assert all(p.concurrency == 2 for p in plans)
+    assert all(abs(p.rate - 100 / 3) < 1e-9 for p in plans)
+
+
+def test_errors_are_counted():
+    stats = bench.run(request(), bench.Plan(requests=5, concurrency=2),
+                      config.Transport(affinity_ttl=0))
+    assert stats.latency.count == 5
+    assert stats.errors == {'connection failed': 5}
+    assert 'connection failed' in bench.report(stats)
+
+
+def test_other_errors_are_counted():
+    stats = bench.run(request(url='http://[::1'), bench.Plan(requests=3, concurrency=1),
+                      config.Transport(affinity_ttl=0))
+    assert stats.latency.count == 3
+    assert stats.errors == {'InvalidURL': 3}
+
+
+def test_open_loop_schedule():
+    stats = bench.run(request(), bench.Plan(requests=5,
+                                            concurrency=5,
+                                            rate=50))
+    # 5 requests at 50 req/s take 80 ms at least.
+    assert stats.elapsed >= 0.08
+    assert stats.latency.count == 5
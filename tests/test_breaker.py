@@ -0,0 +1,79 @@
+from unittest import mock
+from apicall import statefile
+from apicall.breaker import CircuitBreaker
+
+URL = 'http://localhost:8000/users'
+OTHER = 'http://localhost:8080/users'
+
+
+class TestCircuitBreaker:
+    def test_open_after_threshold(self):
+        breaker = CircuitBreaker(None, threshold=2, cooldown=30)
+        breaker.failed(URL)
+        assert not breaker.is_open(URL)
+        breaker.failed(URL)
+        assert breaker.is_open(URL)
+        # Circuits are kept per endpoint.
+        assert breaker.is_open('http://localhost:8000/items')
+        assert not breaker.is_open(OTHER)
+
+    def test_success_resets(self):
+        breaker = CircuitBreaker(None, threshold=2, cooldown=30)
+        breaker.failed(URL)
+        breaker.succeeded(URL)
+        breaker.failed(URL)
+        assert not breaker.is_open(URL)
+
+    def test_half_open(self):
+        breaker = CircuitBreaker(None, threshold=1, cooldown=30)
+        with mock.patch('time.time', return_value=1000.0):
+            breaker.failed(URL)
+            assert breaker.is_open(URL)
+        with mock.patch('time.time', return_value=1031.0):
+            assert not breaker.is_open(URL)
+            # A failure in the half-open state opens the circuit again.
+            breaker.failed(URL)
+            assert breaker.is_open(URL)
+
+    def test_persist(self, tmp_path):
+        path = str(tmp_path / 'breaker.json')
+        CircuitBreaker(path, threshold=1, cooldown=30).failed(URL)
+        assert CircuitBreaker(path, threshold=1, cooldown=30).is_open(URL)
+
+        CircuitBreaker(path, threshold=1, cooldown=30).succeeded(URL)
+        assert not CircuitBreaker(path, threshold=1, cooldown=30).is_open(URL)
+
+    def test_concurrent_processes(self, tmp_path):
+        path = str(tmp_path / 'breaker.json')
+        first = CircuitBreaker(path, threshold=3, cooldown=30)
+        second = CircuitBreaker(path, threshold=3, cooldown=30)
+        first.failed(URL)
+        second.failed(OTHER)
+        first.failed(URL)
+        # The failures saved by the other process are kept and counted.
+        second.failed(URL)
+        assert second.is_open(URL)
+        assert CircuitBreaker(path, threshold=3, cooldown=30).is_open(URL)
+        assert statefile.read(path)['http://localhost:8080']['failures'] == 1
+
+        first.succeeded(URL)
+        assert not CircuitBreaker(path, threshold=3, cooldown=30).is_open(URL)
+
+    def test_success_clears_other_processes(self, tmp_path):
+        path = str(tmp_path / 'breaker.json')
+        first = CircuitBreaker(path, threshold=1, cooldown=30)
+        second = CircuitBreaker(path, threshold=1, cooldown=30)
+        with mock.patch('time.time', return_value=1000.0):
+            # Recorded after the first one read the file.
+            second.failed(URL)
+        with mock.patch('time.time', return_value=1001.0):
+            first.succeeded(URL)
+            assert not CircuitBreaker(path, threshold=1,
+                                      cooldown=30).is_open(URL)
+            # The other process takes in the success when it saves the state.
+            second.failed(OTHER)
+            assert not second.is_open(URL)
+        with mock.patch('time.time', return_value=1002.0):
+            # A later failure counts from zero.
+            first.failed(URL)
+            assert statefile.read(path)['http://localhost:8000']['failures'] == 1
@@ -0,0 +1,41 @@
+import io
+import gzip
+import zlib
+import pytest
+from apicall import retry
+from apicall.compression import CompressionError, accept_encoding, compress
+
+DATA = b'{"name": "alice", "items": [1, 2, 3]}' * 1000
+
+
+class TestCompress:
+    def test_gzip_bytes(self):
+        body = compress(DATA, 'gzip')
+        assert isinstance(body, bytes)
+        assert gzip.decompress(body) == DATA
+
+    def test_deflate_file(self):
+        body = compress(io.BytesIO(DATA), 'deflate')
+        assert zlib.decompress(b''.join(iter(lambda: body.read(100), b''))) == DATA
+        # The body is compressed again to be sent again on retries.
+        assert retry.replayable(body)
+        body.seek(0)
+        assert body.tell() == 0
+        assert zlib.decompress(body.read()) == DATA
+
+    def test_gzip_stream(self):
+        chunks = iter([DATA[:10], DATA[10:]])
+        body = compress(chunks, 'gzip')
+        # Compressed while it is sent, so nothing has been read yet.
+        assert next(chunks) == DATA[:10]
+        assert gzip.decompress(b''.join(body)) == DATA[10:]
+        assert not retry.replayable(body)
+
+    def test_unsupported_encoding(self):
+        with pytest.raises(CompressionError):
+            compress(DATA, 'compress')
+
+
+class TestAcceptEncoding:
+    def test_compressed(self):
+        assert 'gzip' in accept_encoding().value
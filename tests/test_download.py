@@ -0,0 +1,224 @@
+import io
+import os
+import re
+import pytest
+import requests
+from apicall import restapi
+from apicall.download import ContentRange, RangeError, Segment, \
+    parse_content_range, resume_offset, range_headers, save, \
+    save_segmented, split, load_validator
+from .stand_in import Reply, StandInSession
+
+CONTENT = bytes(range(256)) * 4
+
+
+def response(status, body=b'', **headers):
+    res = requests.Response()
+    res.status_code = status
+    res.headers.update({k.replace('_', '-'): v for k, v in headers.items()})
+    res.raw = io.BytesIO(body)
+    return restapi.Response(request=None, _result=res)
+
+
+class BrokenBody(io.RawIOBase):
+    """ Returns some bytes, and then the connection is lost. """
+    def __init__(self, data=b'abc'):
+        self.data = data
+        self.sent = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.sent:
+            raise requests.ConnectionError()
+        self.sent = True
+        b[:len(self.data)] = self.data
+        return len(self.data)
+
+
+def serve_ranges(total='1024', drops=()):
+    """ Serves CONTENT and honors Range headers.
+
+    :param total: Value of the total length in Content-Range.
+    :param drops: Starts of ranges whose first transfer is interrupted.
+    """
+    drops = set(drops)
+
+    def answer(sent):
+        m = re.fullmatch(r'bytes=(\d+)-(\d*)', sent.headers.get('range', ''))
+        if m is None:
+            return Reply(200, {'etag': '"v1"'}, CONTENT)
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else len(CONTENT) - 1
+        headers = {
+            'etag': '"v1"',
+            'content-range': f'bytes {start}-{end}/{total}'
+        }
+        if start in drops:
+            drops.discard(start)
+            return Reply(206, headers, BrokenBody(CONTENT[start:start + 3]))
+        return Reply(206, headers, CONTENT[start:end + 1])
+
+    return StandInSession(answer)
+
+
+def ranges(session):
+    return [sent.headers.get('range') for sent in session.sent]
+
+
+def xattr_supported(path):
+    try:
+        os.setxattr(path, 'user.apicall.test', b'')
+        return True
+    except (AttributeError, OSError):
+        return False
+
+
+class TestParseContentRange:
+    def test_range(self):
+        assert parse_content_range('bytes 100-199/1000') == ContentRange(
+            100, 199, 1000)
+
+    def test_unknown_length(self):
+        assert parse_content_range('bytes 100-199/*') == ContentRange(
+            100, 199, None)
+
+    def test_unsatisfied_range(self):
+        assert parse_content_range('bytes */1000') == ContentRange(
+            None, None, 1000)
+
+    def test_invalid(self):
+        assert parse_content_range('') is None
+        assert parse_content_range('items 0-1/2') is None
+
+
+class TestResumeOffset:
+    def test_existing_file(self, tmp_path):
+        path = tmp_path / 'out'
+        path.write_bytes(b'x' * 10)
+        assert resume_offset(str(path), '-') == 10
+
+    def test_missing_file(self, tmp_path):
+        assert resume_offset(str(tmp_path / 'out'), '-') == 0
+
+    def test_explicit_offset(self, tmp_path):
+        assert resume_offset(str(tmp_path / 'out'), '42') == 42
+
+    @pytest.mark.parametrize('value', ['abc', '-1', ''])
+    def test_invalid_offset(self, tmp_path, value):
+        with pytest.raises(ValueError):
+            resume_offset(str(tmp_path / 'out'), value)
+
+
+class TestRangeHeaders:
+    def test_from_beginning(self, tmp_path):
+        assert range_headers(str(tmp_path / 'out'), 0) == tuple()
+
+    def test_resume(self, tmp_path):
+        headers = range_headers(str(tmp_path / 'out'), 10)
+        assert ('range', 'bytes=10-') in ((h.name, h.value) for h in headers)
+
+
+class TestSplit:
+    def test_even(self):
+        assert split(100, 4) == (
+            Segment(0, 24),
+            Segment(25, 49),
+            Segment(50, 74),
+            Segment(75, 99),
+        )
+
+    def test_uneven(self):
+        assert split(10, 3) == (
+            Segment(0, 3),
+            Segment(4, 6),
+            Segment(7, 9),
+        )
+
+    def test_more_segments_than_bytes(self):
+        assert split(2, 8) == (Segment(0, 0), Segment(1, 1))
+
+
+class TestSave:
+    def test_append(self, tmp_path):
+        path = tmp_path / 'out'
+        path.write_bytes(b'01234')
+        res = response(206, b'56789', content_range='bytes 5-9/10')
+        assert save(str(path), res, 5) == 5
+        assert path.read_bytes() == b'0123456789'
+
+    def test_unexpected_range(self, tmp_path):
+        path = tmp_path / 'out'
+        path.write_bytes(b'01234')
+        res = response(206, b'6789', content_range='bytes 6-9/10')
+        with pytest.raises(RangeError):
+            save(str(path), res, 5)
+        assert path.read_bytes() == b'01234'
+
+    def test_restart(self, tmp_path):
+        path = tmp_path / 'out'
+        path.write_bytes(b'old content')
+        assert save(str(path), response(200, b'new'), 5) == 3
+        assert path.read_bytes() == b'new'
+
+    def test_already_complete(self, tmp_path):
+        path = tmp_path / 'out'
+        path.write_bytes(b'0123456789')
+        res = response(416, content_range='bytes */10')
+        assert save(str(path), res, 10) == 0
+        assert path.read_bytes() == b'0123456789'
+
+    def test_not_satisfiable(self, tmp_path):
+        path = tmp_path / 'out'
+        path.write_bytes(b'0123456789')
+        with pytest.raises(RangeError):
+            save(str(path), response(416, content_range='bytes */8'), 10)
+
+    def test_validator_of_interrupted_transfer(self, tmp_path):
+        path = tmp_path / 'out'
+        path.write_bytes(b'')
+        if not xattr_supported(str(path)):
+            pytest.skip('Extended attributes are not supported.')
+        res = response(200, etag='"v1"')
+        res._result.raw = BrokenBody()
+        with pytest.raises(restapi.TransferError):
+            save(str(path), res)
+        # The partial file can be resumed with If-Range.
+        assert path.read_bytes() == b'abc'
+        assert load_validator(str(path)) == '"v1"'
+
+
+class TestSaveSegmented:
+    REQUEST = restapi.Request(method='GET',
+                              urls=('http://localhost/file', ),
+                              headers=(),
+                              basic=None,
+                              data=None)
+
+    def test_segments(self, tmp_path):
+        path = tmp_path / 'out'
+        session = serve_ranges()
+        assert save_segmented(str(path), self.REQUEST, 4,
+                              session=session) == len(CONTENT)
+        assert path.read_bytes() == CONTENT
+        assert sorted(ranges(session)) == sorted([
+            'bytes=0-0', 'bytes=1-256', 'bytes=257-512', 'bytes=513-768',
+            'bytes=769-1023'
+        ])
+
+    def test_retry_segment(self, tmp_path):
+        path = tmp_path / 'out'
+        session = serve_ranges(drops=[257])
+        save_segmented(str(path), self.REQUEST, 4, session=session)
+        assert path.read_bytes() == CONTENT
+        # The rest of the segment is requested after the first 3 bytes.
+        assert 'bytes=260-512' in ranges(session)
+
+    def test_unknown_length(self, tmp_path):
+        path = tmp_path / 'out'
+        session = serve_ranges(total='*')
+        assert save_segmented(str(path), self.REQUEST, 4,
+                              session=session) == len(CONTENT)
+        assert path.read_bytes() == CONTENT
+        assert ranges(session) == ['bytes=0-0', None]
@@ -0,0 +1,40 @@
+import random
+import pytest
+from apicall.histogram import Histogram
+
+
+def test_empty():
+    h = Histogram()
+    assert h.count == 0
+    assert h.percentile(99) == 0
+    assert h.mean == 0.0
+
+
+def test_small_values_are_exact():
+    h = Histogram()
+    for v in range(1, 101):
+        h.record(v)
+    assert h.percentile(50) == 50
+    assert h.percentile(99) == 99
+    assert h.percentile(100) == 100
+    assert (h.min, h.max, h.mean) == (1, 100, 50.5)
+
+
+@pytest.mark.parametrize('p', [50, 90, 99, 99.9])
+def test_relative_error(p):
+    rnd = random.Random(0)
+    values = sorted(int(rnd.lognormvariate(10, 2)) for _ in range(10000))
+    h = Histogram()
+    for v in values:
+        h.record(v)
+    exact = values[int(len(values) * p / 100 + 0.5) - 1]
+    assert exact <= h.percentile(p) <= exact * 1.001 + 1
+
+
+def test_merge():
+    a, b, whole = Histogram(), Histogram(), Histogram()
+    for v in range(0, 100000, 7):
+        (a if v % 2 else b).record(v)
+        whole.record(v)
+    a.merge(b)
+    assert a == whole
@@ -0,0 +1,183 @@
+import io
+import email.utils
+import requests
+import urllib3
+from apicall import httpcache
+from apicall import statefile
+
+URL = 'http://localhost:8000/catalog'
+
+
+class StandInServer:
+    """ A send() function of requests.Session which returns prepared responses. """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def __call__(self, method, url, headers=None, stream=False, **kwargs):
+        self.requests.append(dict(headers or {}))
+        status, headers, body = self.responses.pop(0)
+        res = requests.Response()
+        res.status_code = status
+        res.reason = 'OK'
+        res.raw = urllib3.HTTPResponse(body=io.BytesIO(body),
+                                       headers=headers,
+                                       status=status,
+                                       preload_content=False)
+        res.headers = requests.structures.CaseInsensitiveDict(headers)
+        res.url = url
+        res.request = requests.Request(method, url).prepare()
+        return res
+
+
+def fetch(cache, server, headers=None):
+    return httpcache.request(cache, server, 'GET', URL, headers=headers or {})
+
+
+def now():
+    return email.utils.formatdate(usegmt=True)
+
+
+class TestFreshness:
+    def test_max_age(self):
+        assert httpcache.freshness_lifetime(
+            {'cache-control': 'public, max-age=60'}, 0) == 60
+
+    def test_expires(self):
+        headers = {
+            'date': 'Sun, 18 Oct 2026 00:00:00 GMT',
+            'expires': 'Sun, 18 Oct 2026 00:01:00 GMT',
+        }
+        assert httpcache.freshness_lifetime(headers, 0) == 60
+        assert httpcache.freshness_lifetime({'expires': '0'}, 0) == 0
+
+    def test_heuristic(self):
+        headers = {
+            'date': 'Sun, 18 Oct 2026 00:00:00 GMT',
+            'last-modified': 'Sun, 18 Oct 2026 00:00:00 GMT',
+        }
+        assert httpcache.freshness_lifetime(headers, 0) == 0
+        headers['last-modified'] = 'Sat, 17 Oct 2026 23:00:00 GMT'
+        assert httpcache.freshness_lifetime(headers, 0) == 360
+
+
+class TestRequest:
+    def test_fresh_hit(self, tmp_path):
+        cache = httpcache.Cache(str(tmp_path))
+        server = StandInServer(
+            (200, {'cache-control': 'max-age=60', 'date': now()}, b'catalog'))
+        assert fetch(cache, server).content == b'catalog'
+
+        res = fetch(cache, server)
+        assert res.status_code == 200
+        assert res.content == b'catalog'
+        assert len(server.requests) == 1
+
+    def test_revalidate(self, tmp_path):
+        cache = httpcache.Cache(str(tmp_path))
+        server = StandInServer(
+            (200, {'etag': '"v1"', 'cache-control': 'no-cache'}, b'catalog'),
+            (304, {'etag': '"v1"'}, b''),
+        )
+        assert fetch(cache, server).content == b'catalog'
+
+        res = fetch(cache, server)
+        assert res.status_code == 200
+        assert res.content == b'catalog'
+        assert server.requests[1]['if-none-match'] == '"v1"'
+
+    def test_changed(self, tmp_path):
+        cache = httpcache.Cache(str(tmp_path))
+        server = StandInServer(
+            (200, {'etag': '"v1"'}, b'old'),
+            (200, {'etag': '"v2"'}, b'new'),
+            (304, {'etag': '"v2"'}, b''),
+        )
+        assert fetch(cache, server).content == b'old'
+        assert fetch(cache, server).content == b'new'
+        assert fetch(cache, server).content == b'new'
+        assert server.requests[2]['if-none-match'] == '"v2"'
+
+    def test_no_store(self, tmp_path):
+        cache = httpcache.Cache(str(tmp_path))
+        server = StandInServer(
+            (200, {'cache-control': 'no-store, max-age=60'}, b'a'),
+            (200, {'cache-control': 'max-age=60'}, b'b'),
+        )
+        fetch(cache, server)
+        assert fetch(cache, server).content == b'b'
+
+    def test_request_no_cache(self, tmp_path):
+        cache = httpcache.Cache(str(tmp_path))
+        server = StandInServer(
+            (200, {'cache-control': 'max-age=60', 'etag': '"v1"'}, b'a'),
+            (304, {}, b''),
+        )
+        fetch(cache, server).content
+        assert fetch(cache, server, {
+            'cache-control': 'no-cache'
+        }).content == b'a'
+        assert len(server.requests) == 2
+
+    def test_vary(self, tmp_path):
+        cache = httpcache.Cache(str(tmp_path))
+        server = StandInServer(
+            (200, {'cache-control': 'max-age=60', 'vary': 'accept'}, b'json'),
+            (200, {'cache-control': 'max-age=60', 'vary': 'accept'}, b'xml'),
+        )
+        json_ = {'accept': 'application/json'}
+        xml = {'accept': 'application/xml'}
+        assert fetch(cache, server, json_).content == b'json'
+        assert fetch(cache, server, xml).content == b'xml'
+        assert fetch(cache, server, json_).content == b'json'
+        assert fetch(cache, server, xml).content == b'xml'
+        assert len(server.requests) == 2
+
+    def test_partial_read_is_not_stored(self, tmp_path):
+        cache = httpcache.Cache(str(tmp_path))
+        server = StandInServer(
+            (200, {'cache-control': 'max-age=60'}, b'x' * 100000),
+            (200, {'cache-control': 'max-age=60'}, b'y'),
+        )
+        res = httpcache.request(cache, server, 'GET', URL, stream=True)
+        next(res.iter_content(10))
+        res.close()
+        assert fetch(cache, server).content == b'y'
+
+
+class TestEvict:
+    def test_least_recently_used(self, tmp_path):
+        cache = httpcache.Cache(str(tmp_path), max_size=3000)
+        for i in range(5):
+            server = StandInServer(
+                (200, {'cache-control': 'max-age=60'}, bytes([i]) * 1000))
+            httpcache.request(cache, server, 'GET', f'{URL}/{i}').content
+
+        total = sum(f.stat().st_size for f in tmp_path.rglob('*')
+                    if f.is_file())
+        assert total <= 3000
+        assert cache.lookup(f'{URL}/4', {}) is not None
+        assert cache.lookup(f'{URL}/0', {}) is None
+
+    def test_scan_only_over_limit(self, tmp_path, monkeypatch):
+        cache = httpcache.Cache(str(tmp_path), max_size=10000)
+        scans = []
+        evict = cache.evict
+        monkeypatch.setattr(cache, 'evict', lambda: scans.append(1) or evict())
+
+        def store(i, size):
+            server = StandInServer(
+                (200, {'cache-control': 'max-age=60'}, bytes([i]) * size))
+            httpcache.request(cache, server, 'GET', f'{URL}/{i}').content
+
+        for i in range(5):
+            store(i, 500)
+        # Scanned only to know the size of the new cache.
+        assert len(scans) == 1
+        store(5, 6000)
+        assert len(scans) == 2
+        total = sum(f.stat().st_size for f in tmp_path.rglob('*')
+                    if f.is_file() and f.name != 'size.json')
+        assert total <= 10000
+        assert statefile.read(cache.size_path) == {'size': total}
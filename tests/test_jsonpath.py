@@ -0,0 +1,22 @@
+import pytest
+from apicall import jsonpath
+
+
+class TestJsonPath:
+    def test_parse(self):
+        assert jsonpath.parse('.') == ()
+        assert jsonpath.parse('.items[0].state') == ('items', 0, 'state')
+        assert jsonpath.parse('.["a key"][1]') == ('a key', 1)
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            jsonpath.parse('items')
+
+    def test_format(self):
+        assert jsonpath.format(('items', 0, 'a key')) == '.items[0]["a key"]'
+
+    def test_lookup(self):
+        obj = {'items': [{'state': 'ready'}]}
+        assert jsonpath.lookup(obj, ('items', 0, 'state')) == 'ready'
+        assert jsonpath.lookup(obj, ('items', 1, 'state')) is None
+        assert jsonpath.lookup(obj, ('items', 'x'), 'missing') == 'missing'
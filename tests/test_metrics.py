@@ -0,0 +1,169 @@
+import io
+import dataclasses
+import pytest
+import requests
+from apicall import config
+from apicall import metrics
+from apicall import restapi
+from .stand_in import Reply, StandInSession
+
+
+class BrokenBody(io.RawIOBase):
+    """ The connection is lost before the body arrives. """
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        raise requests.ConnectionError()
+
+
+def answer(sent):
+    """ Fails to connect to "http://down", loses the body from "http://broken",
+    and answers others.
+    """
+    if sent.url.startswith('http://down'):
+        raise requests.ConnectionError()
+    if sent.url.startswith('http://broken'):
+        return Reply(body=BrokenBody())
+    return Reply()
+
+
+def record(time=1000.0, latency=0.25, path='/users', status=200, **kwargs):
+    return metrics.Record(time, latency, 'GET', 'http://a', path, status,
+                          **kwargs)
+
+
+def test_encode():
+    r = record(path='/ユーザー', failovers=1, retries=2)
+    data = metrics.encode(r) + metrics.encode(record(status=503))
+    assert list(metrics.decode(data)) == [r, record(status=503)]
+
+
+def test_truncate():
+    r = record(path='/' + 'あ' * metrics._MAX_TEXT)
+    data = metrics.encode(r) + metrics.encode(record())
+    truncated, rest = metrics.decode(data)
+    # Not split in the middle of a character.
+    assert truncated.path == '/' + 'あ' * ((metrics._MAX_TEXT - 1) // 3)
+    assert rest == record()
+
+
+def test_broken_text():
+    data = bytearray(metrics.encode(record(path='/ab')))
+    data[-1] = 0xFF
+    broken, rest = metrics.decode(bytes(data) + metrics.encode(record()))
+    assert broken.path == '/a\ufffd'
+    assert rest == record()
+
+
+def test_broken_tail():
+    data = metrics.encode(record()) + metrics.encode(record())[:-3]
+    assert list(metrics.decode(data)) == [record()]
+
+
+def test_rotate(tmp_path):
+    log = metrics.Log(str(tmp_path / 'metrics'), max_size=100, backups=2)
+    size = len(metrics.encode(record()))
+    for i in range(20):
+        log.append(record(time=float(i)))
+    assert len(log.files()) == 3
+    assert all(p.stat().st_size <= 100 + size for p in tmp_path.iterdir())
+    times = [r.time for r in log.read()]
+    # Old records are dropped, and the rest are in order.
+    assert times == sorted(times) and times[-1] == 19.0 and times[0] > 0
+
+
+def test_parse_duration():
+    assert metrics.parse_duration('90') == 90
+    assert metrics.parse_duration('15m') == 900
+    assert metrics.parse_duration('1.5h') == 5400
+    assert metrics.parse_duration('7d') == 7 * 86400
+    for value in ('', '0', '-1h', '1w'):
+        with pytest.raises(ValueError):
+            metrics.parse_duration(value)
+
+
+def test_aggregate():
+    records = [
+        record(time=100.0, latency=0.1),
+        record(time=200.0, latency=0.3, failovers=1),
+        record(time=3700.0, latency=0.2, status=0, retries=2),
+        record(time=3800.0, path='/items', status=404),
+    ]
+    groups = metrics.aggregate(records)
+    users = groups[('http://a', '/users')]
+    assert users.count == 3
+    assert users.errors == 1
+    assert users.failovers == 1 and users.retries == 2
+    assert users.latency.percentile(50) == pytest.approx(200000, rel=1e-3)
+    assert groups[('http://a', '/items')].errors == 0
+
+    by_hour = metrics.aggregate(records, ['status'], window=3600, since=150)
+    assert list(by_hour) == [(0.0, 200), (3600.0, 0), (3600.0, 404)]
+
+
+def test_report():
+    groups = metrics.aggregate([record(), record(status=500)], ['path'])
+    lines = metrics.report(groups, ['path']).splitlines()
+    assert lines[0].split()[:3] == ['PATH', 'REQUESTS', 'ERRORS']
+    assert lines[2].split()[:4] == ['/users', '2', '1', '(50.0%)']
+
+
+def test_fetch(tmp_path):
+    log = metrics.Log(str(tmp_path / 'metrics'))
+    session = StandInSession(answer, metrics=log)
+    request = restapi.Request(method='GET',
+                              urls=('http://down', 'http://up/users?id=1'),
+                              headers=(),
+                              basic=None,
+                              data=None)
+    request.fetch(session=session)
+    with pytest.raises(restapi.ConnectionError):
+        dataclasses.replace(request, urls=('http://down', )).fetch(session=session)
+    ok, failed = log.read()
+    assert (ok.endpoint, ok.path, ok.status, ok.failovers) == ('http://up',
+                                                               '/users', 200, 1)
+    assert (failed.endpoint, failed.status) == ('http://down', 0)
+
+
+def get(*urls):
+    return restapi.Request(method='GET',
+                           urls=urls,
+                           headers=(),
+                           basic=None,
+                           data=None)
+
+
+def test_fetch_last_tried(tmp_path):
+    log = metrics.Log(str(tmp_path / 'metrics'))
+    session = StandInSession(answer, metrics=log)
+    with pytest.raises(restapi.ConnectionError):
+        get('http://down1', 'http://down2').fetch(session=session)
+    failed, = log.read()
+    assert (failed.endpoint, failed.status) == ('http://down2', 0)
+
+
+@pytest.mark.parametrize('stream', [True, False])
+def test_fetch_broken_body(tmp_path, stream):
+    log = metrics.Log(str(tmp_path / 'metrics'))
+    # A deadline makes even a non-streaming fetch read the body itself.
+    options = config.Transport(max_time=60.0 if not stream else None)
+    session = StandInSession(answer, options, metrics=log)
+    with pytest.raises(restapi.TransferError):
+        res = get('http://broken').fetch(session=session, stream=stream)
+        b''.join(res.iter_body())
+    failed, = log.read()
+    assert (failed.endpoint, failed.status) == ('http://broken', 0)
+
+
+def test_fetch_stream(tmp_path):
+    log = metrics.Log(str(tmp_path / 'metrics'))
+    session = StandInSession(answer, metrics=log)
+    res = get('http://up').fetch(session=session, stream=True)
+    # Recorded when the body has been received.
+    assert not list(log.read())
+    assert b''.join(res.iter_body()) == b''
+    res.close()
+    ok, = log.read()
+    assert ok.status == 200
@@ -0,0 +1,73 @@
+import email.parser
+import email.policy
+import pytest
+from apicall.multipart import Field, MultipartEncoder, parse_field
+
+
+def parse_body(encoder: MultipartEncoder, body: bytes):
+    msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b'Content-Type: ' + encoder.content_type.encode() + b'\r\n\r\n' +
+        body)
+    return list(msg.iter_parts())
+
+
+class TestParseField:
+    def test_text(self):
+        assert parse_field('name=a=b') == Field(name='name', value=b'a=b')
+
+    def test_file(self):
+        assert parse_field('icon=@./images/icon.png') == Field(
+            name='icon',
+            path='./images/icon.png',
+            filename='icon.png',
+            content_type='image/png',
+        )
+
+    def test_file_options(self):
+        assert parse_field('f=@data.bin;type=text/csv;filename=a.csv') == Field(
+            name='f',
+            path='data.bin',
+            filename='a.csv',
+            content_type='text/csv',
+        )
+
+    def test_text_from_file(self):
+        assert parse_field('comment=<msg.txt') == Field(name='comment',
+                                                       path='msg.txt')
+
+    @pytest.mark.parametrize('spec', ['name', '=value', ''])
+    def test_invalid(self, spec):
+        with pytest.raises(ValueError, match='Invalid form field'):
+            parse_field(spec)
+
+
+class TestMultipartEncoder:
+    def test_encode(self, tmp_path):
+        path = tmp_path / 'data.bin'
+        path.write_bytes(bytes(range(256)) * 1000)
+        encoder = MultipartEncoder([
+            Field(name='name', value=b'alice'),
+            parse_field(f'file=@{path}'),
+        ])
+
+        body = encoder.read()
+        assert len(body) == len(encoder)
+        parts = parse_body(encoder, body)
+        assert parts[0].get_param('name', header='content-disposition') == 'name'
+        assert parts[0].get_payload(decode=True) == b'alice'
+        assert parts[1].get_filename() == 'data.bin'
+        assert parts[1].get_content_type() == 'application/octet-stream'
+        assert parts[1].get_payload(decode=True) == path.read_bytes()
+
+    def test_read_in_chunks(self, tmp_path):
+        path = tmp_path / 'data.txt'
+        path.write_bytes(b'hello' * 10000)
+        encoder = MultipartEncoder([parse_field(f'a=<{path}')] * 3)
+
+        body = b''.join(iter(lambda: encoder.read(1000), b''))
+        assert len(body) == len(encoder)
+        assert encoder.tell() == len(encoder)
+
+        encoder.seek(0)
+        assert b''.join(encoder) == body
+        encoder.close()
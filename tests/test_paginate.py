@@ -0,0 +1,117 @@
+import io
+import json
+import threading
+import pytest
+from apicall import paginate
+from apicall import restapi
+from .stand_in import Reply, StandInSession
+
+BASE = 'http://localhost:8000/items'
+
+
+def request(url=BASE):
+    return restapi.Request(method='GET',
+                           urls=(url, ),
+                           headers=(),
+                           basic=None,
+                           data=None)
+
+
+def serve(pages):
+    """ Serves pages from a dict of url to (headers, body). """
+
+    def answer(sent):
+        headers, body = pages[sent.url]
+        return Reply(200, headers, json.dumps(body).encode())
+
+    return StandInSession(answer)
+
+
+def items_of(pages):
+    return [item for page in pages for item in page.items]
+
+
+def test_link_header():
+    session = serve({
+        BASE: ({
+            'link': '<?page=2>; rel="next", <?page=9>; rel="last"'
+        }, [1, 2]),
+        BASE + '?page=2': ({}, [3]),
+    })
+    pages = paginate.pages(request(), paginate.Pager(), session=session)
+    assert items_of(pages) == [1, 2, 3]
+
+
+def test_cursor():
+    session = serve({
+        BASE: ({}, {'data': [1, 2], 'next': 'abc'}),
+        BASE + '?cursor=abc': ({}, {'data': [3], 'next': None}),
+    })
+    pager = paginate.Pager(items_path=('data', ), cursor_path=('next', ))
+    assert items_of(paginate.pages(request(), pager, session=session)) == [1, 2, 3]
+
+
+def test_offset():
+    session = serve({
+        BASE + '?limit=2': ({}, [1, 2]),
+        BASE + '?limit=2&offset=2': ({}, [3]),
+        BASE + '?limit=2&offset=3': ({}, []),
+    })
+    pager = paginate.Pager(offset_param='offset')
+    pages = paginate.pages(request(BASE + '?limit=2'), pager, session=session)
+    assert items_of(pages) == [1, 2, 3]
+
+
+def test_max_pages():
+    session = serve({
+        BASE: ({}, {'next': 1}),
+        BASE + '?cursor=1': ({}, {'next': 2}),
+    })
+    pager = paginate.Pager(cursor_path=('next', ), max_pages=2)
+    assert len(list(paginate.pages(request(), pager, session=session))) == 2
+    assert len(session.sent) == 2
+
+
+def test_prefetch():
+    session = serve({
+        BASE: ({}, {'next': 1}),
+        BASE + '?cursor=1': ({}, {'next': None}),
+    })
+    pager = paginate.Pager(cursor_path=('next', ))
+    pages = paginate.pages(request(), pager, session=session)
+    next(pages)
+    # The second page is requested before the first page is consumed.
+    for _ in range(100):
+        if len(session.sent) == 2:
+            break
+        threading.Event().wait(0.01)
+    assert len(session.sent) == 2
+    assert len(list(pages)) == 1
+
+
+def test_items_not_array():
+    session = serve({BASE: ({}, {'data': 1})})
+    pager = paginate.Pager(items_path=('data', ))
+    with pytest.raises(paginate.PageError):
+        list(paginate.pages(request(), pager, session=session))
+
+
+@pytest.mark.parametrize('write, expected', [
+    (paginate.write_ndjson, '{"id": 1}\n{"id": 2}\n'),
+    (paginate.write_array, '[\n{"id": 1},\n{"id": 2}\n]\n'),
+])
+def test_write(write, expected):
+    pages = [
+        paginate.Page(BASE, [{'id': 1}], None),
+        paginate.Page(BASE, [], None),
+        paginate.Page(BASE, [{'id': 2}], None),
+    ]
+    out = io.StringIO()
+    write(pages, out)
+    assert out.getvalue() == expected
+
+
+def test_write_empty_array():
+    out = io.StringIO()
+    paginate.write_array([], out)
+    assert json.loads(out.getvalue()) == []
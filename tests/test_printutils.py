@@ -1,6 +1,7 @@
 import tempfile
 from contextlib import redirect_stdout, redirect_stderr
-from apicall.printutils import is_unicode_string, is_json, pprint
+from apicall.printutils import is_unicode_string, is_json, pprint, write_stream, \
+    pprint_file, is_unicode_file, looks_like_json_file
 
 UNICODE_STRING = b'\xe6\x97\xa5\xe6\x9c\xac\xe8\xaa\x9e'
 NON_UNICODE_DATA = b'\x93\xfa\x96{\x8c\xea'
@@ -9,6 +10,13 @@ NON_UNICODE_DATA_HEX= \
     b'0000006\n'
 
 
+def DataFile(data: bytes):
+    f = tempfile.TemporaryFile('w+b')
+    f.write(data)
+    f.seek(0)
+    return f
+
+
 def FakeTerminal(mode: str):
     f = tempfile.TemporaryFile(mode)
     # isatty() method is always returns True.
@@ -74,3 +82,70 @@ class TestWriteBinaryData:
             assert out.buffer.read() == NON_UNICODE_DATA_HEX
             err.seek(0)
             assert err.read().startswith('WARNING: ')
+
+
+class TestWriteStream:
+    def test_chunks(self):
+        out = tempfile.TemporaryFile('w+t')
+        with out:
+            with redirect_stdout(out):
+                write_stream(iter([b'{"name"', b': ', NON_UNICODE_DATA]))
+
+            out.seek(0)
+            assert out.buffer.read() == b'{"name": ' + NON_UNICODE_DATA
+
+
+class TestInspectFile:
+    def test_unicode_file(self):
+        with DataFile(UNICODE_STRING * 1000) as f:
+            assert is_unicode_file(f)
+        with DataFile(b'') as f:
+            assert is_unicode_file(f)
+        with DataFile(NON_UNICODE_DATA) as f:
+            assert not is_unicode_file(f)
+
+    def test_json_file(self):
+        with DataFile(b'  \n[1, 2]') as f:
+            assert looks_like_json_file(f)
+        with DataFile(b'') as f:
+            assert not looks_like_json_file(f)
+        with DataFile(b'hello') as f:
+            assert not looks_like_json_file(f)
+
+
+class TestPrintFile:
+    def test_stdout_is_not_terminal(self):
+        out = tempfile.TemporaryFile('w+t')
+        err = FakeTerminal('w+t')
+        with out, err, DataFile(NON_UNICODE_DATA) as f:
+            with redirect_stdout(out), redirect_stderr(err):
+                pprint_file(f)
+
+            out.seek(0)
+            assert out.buffer.read() == NON_UNICODE_DATA
+            err.seek(0)
+            assert err.read() == ''
+
+    def test_unicode_string(self):
+        out = FakeTerminal('w+t')
+        err = FakeTerminal('w+t')
+        with out, err, DataFile(UNICODE_STRING) as f:
+            with redirect_stdout(out), redirect_stderr(err):
+                pprint_file(f)
+
+            out.seek(0)
+            assert out.buffer.read() == UNICODE_STRING
+            err.seek(0)
+            assert err.read() == ''
+
+    def test_non_unicode_data(self):
+        out = FakeTerminal('w+t')
+        err = FakeTerminal('w+t')
+        with out, err, DataFile(NON_UNICODE_DATA) as f:
+            with redirect_stdout(out), redirect_stderr(err):
+                pprint_file(f)
+
+            out.seek(0)
+            assert out.buffer.read() == NON_UNICODE_DATA_HEX
+            err.seek(0)
+            assert err.read().startswith('WARNING: ')
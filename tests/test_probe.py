@@ -0,0 +1,37 @@
+from apicall.probe import Sample, ProbeResult, fastest_first
+
+OK_FAST = Sample(connect=0.001, ttfb=0.002, ok=True)
+OK_SLOW = Sample(connect=0.010, ttfb=0.200, ok=True)
+FAILED = Sample(connect=None, ttfb=None, ok=False)
+
+
+class TestProbeResult:
+    def test_success_rate(self):
+        r = ProbeResult('http://a', (OK_FAST, OK_FAST, FAILED, FAILED))
+        assert r.success_rate == 0.5
+
+    def test_median(self):
+        r = ProbeResult('http://a', (OK_FAST, OK_SLOW, OK_SLOW, FAILED))
+        assert r.connect == 0.010
+        assert r.ttfb == 0.200
+
+    def test_no_samples(self):
+        r = ProbeResult('http://a', ())
+        assert r.success_rate == 0.0
+        assert r.connect is None
+        assert r.latency == float('inf')
+
+
+class TestFastestFirst:
+    def test_sort_by_latency(self):
+        assert fastest_first((
+            ProbeResult('http://slow', (OK_SLOW, )),
+            ProbeResult('http://fast', (OK_FAST, )),
+        )) == ('http://fast', 'http://slow')
+
+    def test_failed_endpoints_last(self):
+        assert fastest_first((
+            ProbeResult('http://dead', (FAILED, )),
+            ProbeResult('http://flaky', (OK_FAST, FAILED)),
+            ProbeResult('http://slow', (OK_SLOW, OK_SLOW)),
+        )) == ('http://slow', 'http://flaky', 'http://dead')
@@ -0,0 +1,94 @@
+import io
+import pstats
+import tracemalloc
+import pytest
+from apicall import arguments
+from apicall import profiling
+
+
+class TestSplitArgv:
+    def test_absent(self):
+        assert profiling.split_argv(['GET', '/']) == (None, ['GET', '/'])
+
+    def test_flag(self):
+        assert profiling.split_argv(['--profile', 'GET',
+                                     '/']) == ('time', ['GET', '/'])
+
+    def test_mode(self):
+        assert profiling.split_argv(['GET', '/',
+                                     '--profile=mem']) == ('mem', ['GET', '/'])
+
+    def test_after_separator(self):
+        assert profiling.split_argv(['--', '--profile']) == (None,
+                                                             ['--', '--profile'])
+
+    def test_value(self):
+        args = ['get', '-H', '--profile', '--header', '--profile=mem', '/']
+        assert profiling.split_argv(args, {'-H', '--header'}) == (None, args)
+
+    def test_value_options(self):
+        options = arguments.value_options('apicall')
+        assert {'-H', '--header', '-F', '--trace-file'} <= options
+        assert not {'-v', '--compressed', '--profile'} & options
+        assert profiling.split_argv(['rest', 'get', '-v', '--profile', '/'],
+                                    options) == ('time',
+                                                 ['rest', 'get', '-v', '/'])
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            profiling.split_argv(['--profile=gpu'])
+
+
+class TestProfiler:
+    def test_phases(self):
+        p = profiling.Profiler()
+        p.record('imports', 0.5, 0.25)
+        with p.phase('command'):
+            with p.phase('network'):
+                pass
+        assert [x.name for x in p.phases] == ['imports', 'command',
+                                              'command/network']
+        assert p.phases[1].wall >= p.phases[2].wall
+        lines = p.report().splitlines()
+        assert lines[0].split() == ['PHASE', 'WALL(ms)', 'CPU(ms)', 'PEAK', 'RSS(MiB)']
+        assert lines[2].split()[:3] == ['imports', '500.0', '250.0']
+        assert lines[4].startswith('command/network')
+
+    def test_mem(self):
+        p = profiling.Profiler('mem')
+        p.start()
+        try:
+            with p.phase('command'):
+                with p.phase('render'):
+                    data = bytearray(4 * 1024 * 1024)
+                    del data
+                with p.phase('small'):
+                    pass
+            assert 'ALLOC PEAK(MiB)' in p.report()
+            assert p.top_allocations()
+        finally:
+            p.stop()
+            tracemalloc.stop()
+        command, render, small = p.phases
+        assert render.alloc_peak >= 4 * 1024 * 1024
+        assert small.alloc_peak < 1024 * 1024
+        # The outer phase includes the peak of the inner phases.
+        assert command.alloc_peak >= render.alloc_peak
+
+    def test_cpu(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        p = profiling.Profiler('cpu')
+        p.start()
+        with p.phase('command'):
+            sorted(range(1000), key=str)
+        p.stop()
+        out = io.StringIO()
+        profiling.write_report(p, 'restcall', file=out)
+        assert 'restcall.pstats' in out.getvalue()
+        assert pstats.Stats(str(tmp_path / 'restcall.pstats')).total_calls > 0
+
+
+def test_disabled():
+    with profiling.phase('command') as value:
+        assert value is None
+    assert not profiling.profiler().enabled
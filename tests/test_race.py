@@ -0,0 +1,67 @@
+import socket
+import pytest
+from apicall import race as race_
+from apicall.race import address_of, race
+
+
+@pytest.fixture
+def listening_url():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        sock.listen()
+        yield f'http://127.0.0.1:{sock.getsockname()[1]}'
+
+
+@pytest.fixture
+def closed_url():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f'http://127.0.0.1:{port}'
+
+
+class TestAddressOf:
+    def test_explicit_port(self):
+        assert address_of('http://example.com:8080/api') == ('example.com',
+                                                             8080)
+
+    def test_default_port(self):
+        assert address_of('http://example.com/api') == ('example.com', 80)
+        assert address_of('https://example.com/api') == ('example.com', 443)
+
+
+class TestRace:
+    def test_single_url(self, closed_url):
+        assert race((closed_url, )) == (closed_url, )
+
+    def test_alive_url_first(self, listening_url, closed_url):
+        assert race((closed_url, listening_url)) == (listening_url,
+                                                     closed_url)
+
+    def test_keep_order_if_first_is_alive(self, listening_url, closed_url):
+        assert race((listening_url, closed_url),
+                    stagger=1.0) == (listening_url, closed_url)
+
+    def test_all_failed(self, closed_url):
+        urls = (closed_url, closed_url + '/other')
+        assert race(urls) == urls
+
+    def test_all_addresses(self, monkeypatch, listening_url, closed_url):
+        """ A host is reachable if any of its addresses is. """
+        def getaddrinfo(host, port, **kwargs):
+            if host != 'multi.example':
+                return socket_getaddrinfo(host, port, **kwargs)
+            return [(socket.AF_INET, socket.SOCK_STREAM, 0, '',
+                     address_of(u)) for u in (closed_url, listening_url)]
+
+        socket_getaddrinfo = socket.getaddrinfo
+        monkeypatch.setattr(race_.socket, 'getaddrinfo', getaddrinfo)
+        urls = (closed_url + '/a', 'http://multi.example/b')
+        assert race(urls) == (urls[1], urls[0])
+
+    def test_interleave(self):
+        v6 = [(socket.AF_INET6, 0, 0, '', (f'::{i}', 80)) for i in range(3)]
+        v4 = [(socket.AF_INET, 0, 0, '', (f'10.0.0.{i}', 80)) for i in range(2)]
+        assert race_._interleave(v6 + v4) == [
+            v6[0], v4[0], v6[1], v4[1], v6[2]
+        ]
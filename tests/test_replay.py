@@ -0,0 +1,86 @@
+import socket
+import apicall.config as config
+from apicall import replay, transport
+
+
+class TestParseLine:
+    def test_common(self):
+        e = replay.parse_line(
+            '127.0.0.1 - frank [10/Oct/2000:13:55:36 -0700] '
+            '"GET /apache_pb.gif?a=1 HTTP/1.0" 200 2326')
+        assert e == replay.Entry(time=971211336.0,
+                                 method='GET',
+                                 target='/apache_pb.gif?a=1',
+                                 status=200)
+
+    def test_combined_with_response_time(self):
+        e = replay.parse_line(
+            '10.0.0.1 - - [10/Oct/2000:13:55:36 +0000] "POST /users HTTP/1.1" '
+            '201 12 "http://example.com/" "Mozilla/5.0 (X11)" 0.125')
+        assert e.method == 'POST'
+        assert e.status == 201
+        assert e.latency == 0.125
+
+    def test_json(self):
+        e = replay.parse_line(
+            '{"time": "2000-10-10T20:55:36Z", "method": "put", '
+            '"url": "https://prod.example.com/users/1?x=2", "status": 204, '
+            '"latency": 0.01, "headers": {"Host": "prod", "X-Trace": "1"}, '
+            '"body": "{}"}')
+        assert e == replay.Entry(
+            time=971211336.0,
+            method='PUT',
+            target='/users/1?x=2',
+            status=204,
+            latency=0.01,
+            headers=(config.HttpHeader('X-Trace', '1'), ),
+            body=b'{}',
+        )
+
+    def test_invalid(self):
+        assert replay.parse_line('') is None
+        assert replay.parse_line('garbage') is None
+        assert replay.parse_line('{"method": "GET"}') is None
+
+
+def test_replay_schedule():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        endpoint = f'http://127.0.0.1:{sock.getsockname()[1]}'
+    lines = [
+        '{"time": 100.0, "method": "GET", "path": "/a", "latency": 0.001}',
+        'garbage',
+        '{"time": 100.2, "method": "GET", "path": "/b", "latency": 0.001}',
+    ]
+    conf = config.Config(endpoints=(endpoint, ))
+    stats = replay.replay(lines,
+                          conf,
+                          session=transport.Session(),
+                          speed=2.0)
+    assert stats.replayed.count == 2
+    assert stats.skipped == 1
+    assert stats.errors == {'connection failed': 2}
+    # The interval of 0.2 seconds is replayed in 0.1 seconds.
+    assert 0.1 <= stats.elapsed < 0.2
+    assert 'ORIGINAL' in replay.report(stats)
+
+
+def test_replay_without_schedule():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        endpoint = f'http://127.0.0.1:{sock.getsockname()[1]}'
+    lines = [
+        '{"time": 100.0, "method": "GET", "path": "/a"}',
+        '{"time": 100.2, "method": "GET", "path": "/b", '
+        '"headers": {"X-Bad": "a\\nb"}}',
+    ]
+    conf = config.Config(endpoints=(endpoint, ))
+    stats = replay.replay(lines,
+                          conf,
+                          session=transport.Session(),
+                          speed=0)
+    assert stats.replayed.count == 2
+    assert stats.lag.count == 0
+    # An invalid entry does not stop the replay.
+    assert stats.errors == {'connection failed': 1, 'invalid request': 1}
+    assert 'Max lag:    - (no schedule)' in replay.report(stats)
@@ -0,0 +1,61 @@
+import time
+import threading
+import http.server
+import pytest
+from apicall import config, restapi, transport
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """ Sends the headers at once, and the body slowly. """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('content-length', '5')
+        self.end_headers()
+        self.wfile.flush()
+        for _ in range(5):
+            time.sleep(0.1)
+            try:
+                self.wfile.write(b'x')
+                self.wfile.flush()
+            except OSError:
+                return
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(url):
+    return restapi.Request(method='GET',
+                           urls=(url, ),
+                           headers=(),
+                           basic=None,
+                           data=None)
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_max_time_bounds_body(server, stream):
+    options = config.Transport(max_time=0.2)
+    with transport.Session(options) as session:
+        start = time.monotonic()
+        with pytest.raises(restapi.TimeoutError):
+            res = get(server).fetch(session=session, stream=stream)
+            b''.join(res.iter_body())
+    assert time.monotonic() - start < 2.0
+
+
+def test_body_within_max_time(server):
+    with transport.Session(config.Transport(max_time=5)) as session:
+        res = get(server).fetch(session=session)
+    assert res.raw_body == b'x' * 5
@@ -0,0 +1,67 @@
+import io
+import time
+import email.utils
+from apicall import retry
+from apicall.config import Retry
+
+POLICY = Retry(max_attempts=3, backoff=1.0, max_backoff=10.0)
+
+
+class TestParseRetryAfter:
+    def test_seconds(self):
+        assert retry.parse_retry_after('120') == 120.0
+
+    def test_date(self):
+        value = email.utils.formatdate(time.time() + 60, usegmt=True)
+        assert 55 < retry.parse_retry_after(value) <= 60
+
+    def test_invalid(self):
+        assert retry.parse_retry_after(None) is None
+        assert retry.parse_retry_after('soon') is None
+
+
+class TestDelay:
+    def test_backoff_is_capped(self):
+        for attempt in range(1, 10):
+            assert 0 <= retry.backoff(POLICY, attempt) <= 10.0
+
+    def test_disabled_by_default(self):
+        assert retry.delay_after_error(Retry(), 'GET', None, 1, None) is None
+
+    def test_error_idempotent_only(self):
+        assert retry.delay_after_error(POLICY, 'GET', None, 1, None) is not None
+        assert retry.delay_after_error(POLICY, 'POST', None, 1, None) is None
+
+    def test_attempts_exhausted(self):
+        assert retry.delay_after_error(POLICY, 'GET', None, 3, None) is None
+
+    def test_stream_body(self):
+        assert retry.delay_after_error(POLICY, 'PUT', iter([b'a']), 1,
+                                       None) is None
+        assert retry.delay_after_error(POLICY, 'PUT', io.BytesIO(b'a'), 1,
+                                       None) is not None
+
+    def test_status(self):
+        assert retry.delay_after_response(POLICY, 'GET', None, 200, {}, 1,
+                                          None) is None
+        assert retry.delay_after_response(POLICY, 'GET', None, 502, {}, 1,
+                                          None) is not None
+        # POST may have been processed by the server.
+        assert retry.delay_after_response(POLICY, 'POST', None, 502, {}, 1,
+                                          None) is None
+        # But 429 and 503 tell that it was not.
+        assert retry.delay_after_response(POLICY, 'POST', None, 503, {}, 1,
+                                          None) is not None
+
+    def test_retry_after(self):
+        assert retry.delay_after_response(POLICY, 'GET', None, 429,
+                                          {'retry-after': '3'}, 1, None) == 3.0
+        assert retry.delay_after_response(POLICY, 'GET', None, 429,
+                                          {'retry-after': '60'}, 1,
+                                          None) is None
+
+    def test_deadline(self):
+        deadline = time.monotonic() + 1
+        assert retry.delay_after_response(POLICY, 'GET', None, 429,
+                                          {'retry-after': '3'}, 1,
+                                          deadline) is None
@@ -0,0 +1,80 @@
+import pytest
+from apicall import restapi
+from apicall import sweep
+from .stand_in import Reply, StandInSession
+
+
+def echo(sent):
+    """ Answers the url, or 404 for ".../missing". """
+    return Reply(404 if sent.url.endswith('/missing') else 200, {},
+                 sent.url.encode())
+
+
+def test_parse():
+    assert sweep.Param.parse('id=@ids.txt') == sweep.Param('id', '@ids.txt')
+    with pytest.raises(ValueError):
+        sweep.Param.parse('id')
+    with pytest.raises(ValueError):
+        sweep.Param.parse('a-b=1')
+
+
+def test_values(tmp_path):
+    path = tmp_path / 'ids.txt'
+    path.write_text('1\n\n 2 \n')
+    assert list(sweep.Param('id', f'@{path}').values([])) == ['1', '2']
+    assert list(sweep.Param('id', '@-').values(['3\n', '4\n'])) == ['3', '4']
+    assert list(sweep.Param('id', 'a,b,').values([])) == ['a', 'b']
+
+
+def test_combinations():
+    params = [sweep.Param('a', '1,2'), sweep.Param('b', 'x,y')]
+    assert list(sweep.combinations(params, [])) == [
+        {'a': '1', 'b': 'x'},
+        {'a': '1', 'b': 'y'},
+        {'a': '2', 'b': 'x'},
+        {'a': '2', 'b': 'y'},
+    ]
+
+
+def test_first_param_is_streamed():
+    def endless():
+        n = 0
+        while True:
+            yield f'{n}\n'
+            n += 1
+
+    combos = sweep.combinations([sweep.Param('id', '@-')], endless())
+    assert next(combos) == {'id': '0'}
+
+
+def test_run():
+    def build(values):
+        return restapi.Request(method='GET',
+                               urls=(f'http://localhost:8000/{values["id"]}', ),
+                               headers=(),
+                               basic=None,
+                               data=None)
+
+    records = list(
+        sweep.run([{'id': '1'}, {'id': 'missing'}], build, StandInSession(echo),
+                  concurrency=2))
+    assert [r['params'] for r in records] == [{'id': '1'}, {'id': 'missing'}]
+    assert records[0]['status'] == 200
+    assert records[0]['body'] == 'http://localhost:8000/1'
+    assert records[1]['status'] == 404
+
+
+def test_run_invalid_value():
+    def build(values):
+        return restapi.Request(
+            method='GET',
+            urls=(f'http://localhost:{int(values["port"])}/', ),
+            headers=(),
+            basic=None,
+            data=None)
+
+    records = list(
+        sweep.run([{'port': 'x'}, {'port': '8000'}], build, StandInSession(echo)))
+    # The invalid value does not stop the sweep.
+    assert records[0]['error'].startswith('Invalid request: ')
+    assert records[1]['status'] == 200
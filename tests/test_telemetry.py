@@ -0,0 +1,147 @@
+import threading
+import http.server
+import pytest
+from apicall import restapi, telemetry, transport
+
+PARENT = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    received = []
+
+    def do_GET(self):
+        Handler.received.append(self.headers.get('traceparent'))
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('location', '/')
+            self.send_header('content-length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('content-length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.received = []
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(url):
+    return restapi.Request(method='GET',
+                           urls=(url, ),
+                           headers=(),
+                           basic=None,
+                           data=None)
+
+
+class TestSpanContext:
+    def test_parse(self):
+        ctx = telemetry.SpanContext.parse(PARENT, 'k=v')
+        assert ctx.trace_id == '0af7651916cd43dd8448eb211c80319c'
+        assert ctx.span_id == 'b7ad6b7169203331'
+        assert ctx.traceparent == PARENT
+        assert ctx.headers() == {'traceparent': PARENT, 'tracestate': 'k=v'}
+
+    @pytest.mark.parametrize('value', [
+        '',
+        '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331',
+        '01-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01',
+        '00-00000000000000000000000000000000-b7ad6b7169203331-01',
+        '00-0af7651916cd43dd8448eb211c80319c-0000000000000000-01',
+    ])
+    def test_invalid(self, value):
+        assert telemetry.SpanContext.parse(value) is None
+
+
+class TestTracer:
+    def test_nesting(self):
+        tracer = telemetry.Tracer()
+        with tracer.span('root') as root:
+            with tracer.span('child') as child:
+                pass
+            done = tracer.record('done', 1, 2)
+        assert root.parent_id is None
+        assert child.parent_id == done.parent_id == root.context.span_id
+        assert {s.context.trace_id for s in tracer.spans} == {tracer.trace_id}
+
+    def test_remote_parent(self):
+        tracer = telemetry.Tracer(telemetry.SpanContext.parse(PARENT))
+        with tracer.span('root') as root:
+            pass
+        assert tracer.trace_id == '0af7651916cd43dd8448eb211c80319c'
+        assert root.parent_id == 'b7ad6b7169203331'
+
+    def test_other_thread(self):
+        tracer = telemetry.Tracer()
+        with tracer.span('root') as root:
+            thread = threading.Thread(
+                target=lambda: tracer.record('worker', 1, 2))
+            thread.start()
+            thread.join()
+        assert tracer.spans[1].parent_id == root.context.span_id
+
+    def test_error(self):
+        tracer = telemetry.Tracer()
+        with pytest.raises(KeyError):
+            with tracer.span('root'):
+                raise KeyError()
+        assert tracer.spans[0].error == 'KeyError'
+
+    def test_export(self):
+        tracer = telemetry.Tracer()
+        with tracer.span('root', {'n': 1, 'ok': True, 'skipped': None}):
+            pass
+        payload = tracer.export('restcall')
+        resource = payload['resourceSpans'][0]
+        assert resource['resource']['attributes'] == [{
+            'key': 'service.name',
+            'value': {'stringValue': 'restcall'}
+        }]
+        span = resource['scopeSpans'][0]['spans'][0]
+        assert span['name'] == 'root'
+        assert span['attributes'] == [
+            {'key': 'n', 'value': {'intValue': '1'}},
+            {'key': 'ok', 'value': {'boolValue': True}},
+        ]
+        assert int(span['endTimeUnixNano']) >= int(span['startTimeUnixNano'])
+        assert 'parentSpanId' not in span
+
+
+class TestNullTracer:
+    def test_span(self):
+        with telemetry.NullTracer().span('root', {'n': 1}) as span:
+            span.set('k', 'v')
+        assert span is telemetry.NULL_SPAN
+        assert span.headers() == {}
+
+
+class TestPropagation:
+    def test_traceparent(self, server):
+        tracer = telemetry.Tracer()
+        with telemetry.installed(tracer), transport.Session() as session:
+            get(server + '/redirect').fetch(session=session).close()
+        names = [s.name for s in tracer.spans]
+        assert names == ['fetch', 'GET', 'redirect']
+        fetch, attempt, redirect = tracer.spans
+        assert attempt.parent_id == fetch.context.span_id
+        assert redirect.parent_id == attempt.context.span_id
+        assert attempt.attributes['http.response.status_code'] == 200
+        assert redirect.attributes['http.response.status_code'] == 302
+        assert Handler.received == [attempt.context.traceparent] * 2
+
+    def test_disabled(self, server):
+        with transport.Session() as session:
+            get(server + '/').fetch(session=session).close()
+        assert Handler.received == [None]
@@ -0,0 +1,126 @@
+import json
+import threading
+import http.server
+import pytest
+from apicall import timing, transport
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('location', '/')
+            self.send_header('content-length', '0')
+            self.end_headers()
+            return
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_trace():
+    trace = timing.Trace(start=10.0, end=10.5)
+    trace.hops.append(
+        timing.Hop(start=10.0, url='http://a/x', reused=False,
+                   dns=10.01, error='NewConnectionError'))
+    trace.hops.append(
+        timing.Hop(start=10.05, method='GET', url='http://b/x', reused=False,
+                   remote_ip='10.0.0.2', dns=10.06, tcp=10.08, sent=10.09,
+                   first_byte=10.3, status=200, bytes_up=100))
+    return trace
+
+
+class TestSummary:
+    def test_final_hop(self):
+        m = timing.summary(make_trace())
+        assert m['http_code'] == 200
+        assert m['url_effective'] == 'http://b/x'
+        assert m['time_namelookup'] == pytest.approx(0.06)
+        assert m['time_connect'] == pytest.approx(0.08)
+        assert m['time_appconnect'] == 0.0
+        assert m['time_starttransfer'] == pytest.approx(0.3)
+        assert m['time_total'] == pytest.approx(0.5)
+        assert m['num_connects'] == 2
+        assert m['num_redirects'] == 0
+
+    def test_attempt_counts_failover(self):
+        assert timing.summary(make_trace())['attempt'] == 2
+
+    def test_hops(self):
+        hops = timing.summary(make_trace())['hops']
+        assert [h['error'] for h in hops] == ['NewConnectionError', None]
+        assert hops[1]['connect'] == pytest.approx(0.02)
+        assert hops[1]['wait'] == pytest.approx(0.21)
+        assert hops[1]['transfer'] == pytest.approx(0.2)
+        assert hops[1]['tls'] is None
+
+    def test_no_response(self):
+        trace = timing.Trace(start=1.0, end=2.0)
+        m = timing.summary(trace)
+        assert 'http_code' not in m
+        assert m['time_total'] == 1.0
+
+
+class TestWriteOut:
+    def test_variables(self):
+        metrics = {'http_code': 200, 'time_total': 0.25}
+        assert timing.write_out('%{http_code} %{time_total}\\n',
+                                metrics) == '200 0.250000\n'
+
+    def test_unknown_variable(self):
+        assert timing.write_out('[%{nothing}]', {}) == '[]'
+
+    def test_json(self):
+        metrics = {'url_effective': 'http://a/\\n'}
+        assert json.loads(timing.write_out('%{json}', metrics)) == metrics
+
+
+class TestTracing:
+    def test_phases(self, server):
+        with transport.Session(timing=True) as session:
+            with timing.tracing() as trace:
+                session.request('GET', server + '/').content
+                session.request('GET', server + '/').content
+                trace.finish()
+        first, second = trace.hops
+        assert first.status == second.status == 200
+        assert not first.reused
+        assert first.dns is not None and first.tcp is not None
+        assert first.remote_ip == '127.0.0.1'
+        assert first.bytes_up > 0 and first.bytes_down > len(b'{"ok": true}')
+        assert second.reused
+        assert second.dns is None
+
+    def test_redirect(self, server):
+        with transport.Session(timing=True) as session:
+            with timing.tracing() as trace:
+                session.request('GET', server + '/redirect').content
+                trace.finish()
+        m = timing.summary(trace)
+        assert [h['status'] for h in m['hops']] == [302, 200]
+        assert m['num_redirects'] == 1
+        assert m['url_effective'] == server + '/'
+
+    def test_outside_tracing(self, server):
+        with transport.Session(timing=True) as session:
+            session.request('GET', server + '/').content
+            with timing.tracing() as trace:
+                pass
+        assert trace.hops == []
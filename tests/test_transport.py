@@ -0,0 +1,67 @@
+import threading
+import http.server
+import pytest
+from apicall import config, transport
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Client ports of requests.  A new port means a new connection.
+    ports = []
+
+    def do_GET(self):
+        Handler.ports.append(self.client_address[1])
+        self.send_response(200)
+        self.send_header('content-length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.ports = []
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_connection_reused(server):
+    with transport.Session() as session:
+        for _ in range(3):
+            session.request('GET', server + '/').close()
+    assert len(Handler.ports) == 3
+    assert len(set(Handler.ports)) == 1
+
+
+def test_keep_alive_disabled(server):
+    with transport.Session(config.Transport(keep_alive=False)) as session:
+        for _ in range(2):
+            session.request('GET', server + '/').close()
+    assert len(set(Handler.ports)) == 2
+
+
+def test_close(server):
+    session = transport.Session()
+    session.request('GET', server + '/').close()
+    session.close()
+    # Pooled connections were closed.  A new request opens a new one.
+    session.request('GET', server + '/').close()
+    assert len(set(Handler.ports)) == 2
+
+
+def test_pool_size():
+    options = config.Transport(pool_connections=3, pool_maxsize=7)
+    with transport.Session(options) as session:
+        adapter = session._session.get_adapter('https://example.com/')
+        assert adapter._pool_connections == 3
+        assert adapter._pool_maxsize == 7
+
+
+def test_default():
+    assert transport.default() is transport.default()
@@ -1,4 +1,5 @@
-from apicall.urlutils import is_absolute_url, escape_query, concat_urls
+from apicall.urlutils import is_absolute_url, escape_query, concat_urls, \
+    placeholders, expand_template
 
 
 class TestIsAbsoluteUrl:
@@ -49,3 +50,14 @@ class TestConcatUrls:
             url='https://localhost:3333',
             queries=tuple(),
         ) == ('https://localhost:3333', )
+
+
+class TestTemplate:
+    def test_placeholders(self):
+        assert placeholders('/users/{id}/items?sort={key}') == ('id', 'key')
+        assert placeholders('/users/{}') == ()
+
+    def test_expand(self):
+        assert expand_template('/users/{id}', {'id': 'a/b c'}) == '/users/a%2Fb%20c'
+        assert expand_template('q={v}', {'v': 'a&b'}, escape=False) == 'q=a&b'
+
@@ -0,0 +1,98 @@
+import json
+import pytest
+from apicall import restapi
+from apicall import watch
+from .stand_in import Reply, StandInSession, replies
+
+REQUEST = restapi.Request(
+    method='GET',
+    urls=('http://localhost:8000/status', ),
+    headers=(),
+    basic=None,
+    data=None,
+)
+
+
+class TestCondition:
+    def test_equal(self):
+        cond = watch.Condition.parse('.state == "ready"')
+        assert cond.matches(b'{"state": "ready"}')
+        assert not cond.matches(b'{"state": "starting"}')
+        assert not cond.matches(b'{}')
+        assert not cond.matches(b'not json')
+
+    def test_bare_string(self):
+        assert watch.Condition.parse('.state==ready').matches(
+            b'{"state": "ready"}')
+
+    def test_not_equal(self):
+        cond = watch.Condition.parse('.jobs[0].count != 0')
+        assert cond.matches(b'{"jobs": [{"count": 3}]}')
+        assert not cond.matches(b'{"jobs": [{"count": 0}]}')
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            watch.Condition.parse('.state')
+
+
+class TestDiff:
+    def test_diff(self):
+        old = {'state': 'starting', 'nodes': [1, 2], 'old': True}
+        new = {'state': 'ready', 'nodes': [1], 'new': None}
+        assert list(watch.diff(old, new)) == [
+            '~ .state: "starting" -> "ready"',
+            '- .nodes[1]: 2',
+            '- .old: true',
+            '+ .new: null',
+        ]
+
+    def test_not_json(self):
+        assert watch.diff_bodies(b'a', json.dumps({}).encode()) is None
+
+
+class TestWatcher:
+    def test_change_only(self):
+        session = StandInSession(
+            replies(
+                Reply(200, {'etag': '"1"'}, b'{"state": "starting"}'),
+                Reply(304),
+                Reply(200, {}, b'{"state": "ready"}'),
+                Reply(200, {}, b'{"state": "ready"}'),
+            ))
+        watcher = watch.Watcher(REQUEST)
+        first = watcher.poll(session=session)
+        assert first == watch.Change(200, b'{"state": "starting"}')
+        assert watcher.poll(session=session) is None
+        assert session.sent[1].headers['if-none-match'] == '"1"'
+
+        second = watcher.poll(session=session)
+        assert second.body == b'{"state": "ready"}'
+        assert second.previous == first
+        assert watcher.poll(session=session) is None
+        # The last response had no validators.
+        assert 'if-none-match' not in session.sent[3].headers
+
+    def test_status_change(self):
+        session = StandInSession(replies(Reply(200, {}, b'ok'), Reply(503, {}, b'ok')))
+        watcher = watch.Watcher(REQUEST)
+        watcher.poll(session=session)
+        assert watcher.poll(session=session).status == 503
+
+
+def test_ticks_skip_missed():
+    now = [0.0]
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+
+    it = watch.ticks(1.0, clock=lambda: now[0], sleep=sleep)
+    assert next(it) == 0
+    now[0] += 0.3
+    assert next(it) == 1
+    assert slept == [pytest.approx(0.7)]
+    # A slow iteration misses the next tick.
+    now[0] += 1.5
+    assert next(it) == 3
+    assert now[0] == pytest.approx(3.0)
@@ -0,0 +1,98 @@
+import time
+import asyncio
+import threading
+from apicall.workers import imap_bounded, amap_bounded, aiter_in_thread
+
+
+def test_ordered():
+    def fn(i):
+        # Later items finish earlier.
+        time.sleep((5 - i) * 0.01)
+        return i * 2
+
+    assert list(imap_bounded(fn, range(5), concurrency=5)) == [0, 2, 4, 6, 8]
+
+
+def test_completion_order():
+    def fn(i):
+        time.sleep((3 - i) * 0.05)
+        return i
+
+    assert list(imap_bounded(fn, range(3), concurrency=3,
+                             ordered=False)) == [2, 1, 0]
+
+
+def test_bounded_input():
+    taken = []
+
+    def items():
+        for i in range(100):
+            taken.append(i)
+            yield i
+
+    results = imap_bounded(lambda i: i, items(), concurrency=2)
+    assert next(results) == 0
+    # Items are read only up to the window size.
+    assert len(taken) <= 5
+    assert list(results) == list(range(1, 100))
+
+
+def test_concurrency():
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def fn(i):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+
+    list(imap_bounded(fn, range(20), concurrency=4))
+    assert peak[0] <= 4
+
+
+def test_amap_bounded():
+    async def fn(i):
+        await asyncio.sleep((5 - i) * 0.05)
+        return i
+
+    async def collect(ordered):
+        return [
+            r async for r in amap_bounded(
+                fn, range(5), concurrency=5, ordered=ordered)
+        ]
+
+    assert asyncio.run(collect(True)) == [0, 1, 2, 3, 4]
+    assert asyncio.run(collect(False)) == [4, 3, 2, 1, 0]
+
+
+def test_amap_bounded_blocking_input():
+    ticks = []
+
+    def lines():
+        # Blocks like stdin waiting for input.
+        time.sleep(0.2)
+        yield 'a'
+
+    async def tick():
+        for _ in range(3):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def main():
+        ticker = asyncio.ensure_future(tick())
+        results = [
+            r async for r in amap_bounded(lambda s: asyncio.sleep(0, s.upper()),
+                                          aiter_in_thread(lines()),
+                                          concurrency=1)
+        ]
+        await ticker
+        return results
+
+    start = time.monotonic()
+    assert asyncio.run(main()) == ['A']
+    # The event loop kept running while the input was blocked.
+    assert ticks[-1] - start < 0.15